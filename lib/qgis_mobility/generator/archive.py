@@ -0,0 +1,141 @@
+#
+#  This file is part of QGis Mobility
+#
+#  QGis Mobility is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  QGis Mobility is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with QGis Mobility. If not, see
+#  <http://www.gnu.org/licenses/>.
+#
+
+import os
+import copy
+import time
+import fnmatch
+import tarfile
+from subprocess import PIPE
+from distutils.spawn import find_executable
+
+from qgis_mobility.generator.buildlog import spawn
+
+# Magic bytes at the start of compressed files
+_magics = [('\x1f\x8b', 'gz'),
+           ('BZh', 'bz2'),
+           ('\xfd7zXZ\x00', 'xz')]
+
+# Decompressors by compression, the multi-threaded ones first
+_decompressors = { 'gz'  : [['pigz', '-dc'], ['gzip', '-dc']],
+                   'bz2' : [['lbzip2', '-dc'], ['pbzip2', '-dc'],
+                            ['bzip2', '-dc']],
+                   'xz'  : [['xz', '-T0', '-dc']] }
+
+
+def detect_compression(path):
+    """
+    Returns the compression of the file at path, as 'gz', 'bz2' or 'xz',
+    or None for an uncompressed archive
+    """
+    with open(path, 'rb') as f:
+        head = f.read(6)
+    for magic, compression in _magics:
+        if head.startswith(magic): return compression
+    return None
+
+def find_decompressor(compression):
+    """
+    Returns the command line of the fastest decompressor available for the
+    compression, or None if there is none
+    """
+    for command in _decompressors.get(compression, []):
+        executable = find_executable(command[0])
+        if executable != None: return [executable] + command[1:]
+    return None
+
+def _selected(name, members, excludes):
+    if members != None and not any(fnmatch.fnmatch(name, pattern) or
+                                   name.startswith(pattern.rstrip('/') + '/')
+                                   for pattern in members):
+        return False
+    return not any(fnmatch.fnmatch(name, pattern) for pattern in excludes)
+
+def _safe(member):
+    """ Returns False for members which would land outside the destination """
+    name = os.path.normpath(member.name)
+    if os.path.isabs(name) or name == '..' or name.startswith('..' + os.sep):
+        return False
+    if member.islnk() and os.path.normpath(member.linkname).startswith('..'):
+        return False
+    return True
+
+def extract(path, destination, members=None, excludes=[]):
+    """
+    Extracts the archive at path into destination, streaming it through a
+    (preferably multi-threaded) decompressor. If members is given, only
+    members matching one of its patterns, or lying below one of them, are
+    extracted; members matching a pattern in excludes are skipped. Prints a
+    single summary line and returns the amount of extracted members.
+    """
+    start = time.time()
+    compression = detect_compression(path)
+    command = find_decompressor(compression)
+    process = None
+    if compression == None:
+        archive = tarfile.open(path, 'r|')
+    elif command != None:
+        process = spawn(command + [path], stdout=PIPE, bufsize=1024 * 1024)
+        archive = tarfile.open(fileobj=process.stdout, mode='r|')
+    elif compression in ['gz', 'bz2']:
+        archive = tarfile.open(path, 'r|' + compression)
+    else:
+        raise EnvironmentError("No decompressor found for %s archive: %s" %
+                               (compression, path))
+
+    count = 0
+    size = 0
+    directories = []
+    try:
+        for member in archive:
+            if not _selected(member.name, members, excludes): continue
+            if not _safe(member):
+                raise ValueError("Archive member outside destination: " +
+                                 member.name)
+            if member.isdir():
+                # Like extractall, directories stay writable until the end
+                directories.append(member)
+                member = copy.copy(member)
+                member.mode = 0700
+            archive.extract(member, destination)
+            count += 1
+            size += member.size
+        if process != None:
+            # Tar archives end before the stream does, drain the rest so the
+            # decompressor does not die of a broken pipe
+            while len(process.stdout.read(1024 * 1024)) > 0: pass
+    finally:
+        archive.close()
+        if process != None:
+            process.stdout.close()
+            process.wait()
+    if process != None and process.returncode != 0:
+        raise ValueError("Decompression failed: " + ' '.join(command + [path]))
+
+    directories.sort(key=lambda member: member.name, reverse=True)
+    for member in directories:
+        directory_path = os.path.join(destination, member.name)
+        archive.chown(member, directory_path)
+        archive.utime(member, directory_path)
+        archive.chmod(member, directory_path)
+
+    tool = os.path.basename(command[0]) if command != None else 'tarfile'
+    print "Extracted %d members (%.1f MiB) from %s using %s in %.1fs" % (
+        count, size / (1024.0 * 1024.0), os.path.basename(path), tool,
+        time.time() - start)
+    return count
@@ -0,0 +1,137 @@
+#
+#  This file is part of QGis Mobility
+#
+#  QGis Mobility is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  QGis Mobility is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with QGis Mobility. If not, see
+#  <http://www.gnu.org/licenses/>.
+#
+
+import os
+import time
+import errno
+import tarfile
+import tempfile
+
+
+class ArtifactStore(object):
+    """
+    A content addressed store of built libraries. Every artifact is a
+    compressed tarball of the output trees of a builder, keyed by the library
+    name and the fingerprint of the build. The store is a plain directory,
+    so it can live on shared storage and serve several machines.
+
+    Built libraries embed the absolute path of the cache they were built in
+    (install prefixes, libtool and pkg-config files, the -config scripts),
+    and so do the flags in their fingerprint. Machines therefore only share
+    artifacts when their caches have the same path, a common mount point
+    like /var/cache/qgsmg for instance.
+    """
+
+    def __init__(self, path):
+        self._path = os.path.abspath(path)
+
+    def get_path(self):
+        """ Returns the directory of the store """
+        return self._path
+
+    def get_artifact_path(self, library, digest):
+        """ Returns the path of the artifact of library with digest """
+        return os.path.join(self._path, library, digest + '.tar.gz')
+
+    def contains(self, library, digest):
+        """ Returns True if the store has an artifact for library and digest """
+        return os.path.exists(self.get_artifact_path(library, digest))
+
+    def store(self, library, digest, base, paths):
+        """
+        Packs the given paths, which have to reside below base, as the
+        artifact of library with digest
+        """
+        artifact_path = self.get_artifact_path(library, digest)
+        if os.path.exists(artifact_path): return
+        directory = os.path.dirname(artifact_path)
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST: raise
+        # Pack into a temporary file next to the artifact, so concurrent
+        # readers never see a partial artifact
+        descriptor, temporary = tempfile.mkstemp(suffix='.tmp', dir=directory)
+        os.close(descriptor)
+        try:
+            archive = tarfile.open(temporary, 'w:gz', compresslevel=1)
+            try:
+                for path in paths:
+                    if os.path.exists(path):
+                        archive.add(path, os.path.relpath(path, base))
+            finally:
+                archive.close()
+            os.rename(temporary, artifact_path)
+        finally:
+            if os.path.exists(temporary): os.remove(temporary)
+        self._count('store', library, digest)
+        print "Stored artifact:", artifact_path
+
+    def restore(self, library, digest, base):
+        """
+        Unpacks the artifact of library with digest into base. Returns False
+        if the store has no such artifact.
+        """
+        artifact_path = self.get_artifact_path(library, digest)
+        if not os.path.exists(artifact_path):
+            self._count('miss', library, digest)
+            return False
+        archive = tarfile.open(artifact_path, 'r:gz')
+        try:
+            archive.extractall(base)
+        finally:
+            archive.close()
+        # Touching the artifact keeps track of its last use
+        os.utime(artifact_path, None)
+        self._count('hit', library, digest)
+        print "Restored artifact:", artifact_path
+        return True
+
+    def _count(self, event, library, digest):
+        """
+        Appends an event to the statistics log. Single appends are atomic,
+        so concurrent qgsmg runs can share the log.
+        """
+        try:
+            os.makedirs(self._path)
+        except OSError as e:
+            if e.errno != errno.EEXIST: raise
+        line = "%d %s %s %s\n" % (time.time(), event, library, digest)
+        descriptor = os.open(os.path.join(self._path, 'stats.log'),
+                             os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+        try:
+            os.write(descriptor, line)
+        finally:
+            os.close(descriptor)
+
+    def statistics(self):
+        """
+        Returns a dictionary mapping every library to a dictionary with the
+        counts of its hit, miss and store events
+        """
+        result = {}
+        log_path = os.path.join(self._path, 'stats.log')
+        if not os.path.exists(log_path): return result
+        with open(log_path) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) != 4: continue
+                counts = result.setdefault(parts[2], { 'hit' : 0, 'miss' : 0,
+                                                       'store' : 0 })
+                if parts[1] in counts: counts[parts[1]] += 1
+        return result
@@ -0,0 +1,185 @@
+#
+#  This file is part of QGis Mobility
+#
+#  QGis Mobility is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  QGis Mobility is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with QGis Mobility. If not, see
+#  <http://www.gnu.org/licenses/>.
+#
+
+import os
+import re
+import errno
+import shutil
+import tempfile
+import threading
+from subprocess import PIPE, STDOUT
+
+from qgis_mobility.generator.fingerprint import hash_file, hash_value
+from qgis_mobility.generator.buildlog import spawn
+from qgis_mobility.generator import locking
+
+# The tools regenerating a build system, their versions are part of the key
+_tools = ['autoconf', 'automake', 'libtoolize']
+
+# The files a build system is generated from
+_inputs = re.compile(r'^(configure\.(ac|in)|Makefile\.am|.*\.m4|autogen\.sh)$')
+
+# Caches of the tools themselves, which are neither inputs nor outputs
+_ignored = ['autom4te.cache', '.git', '.svn']
+
+_versions = {}
+_versions_lock = threading.Lock()
+
+def tool_versions():
+    """ Returns the first line of the --version output of every tool """
+    with _versions_lock:
+        if len(_versions) == 0:
+            for tool in _tools:
+                try:
+                    process = spawn([tool, '--version'], stdout=PIPE,
+                                    stderr=STDOUT)
+                    output = process.communicate()[0]
+                    _versions[tool] = (output.splitlines() or [''])[0]
+                except OSError:
+                    _versions[tool] = None
+        return dict(_versions)
+
+def _walk(path):
+    """ Returns the relative paths of all files below path """
+    paths = []
+    for root, dirnames, filenames in os.walk(path):
+        dirnames[:] = sorted([name for name in dirnames if not name in _ignored])
+        for filename in sorted(filenames):
+            paths.append(os.path.relpath(os.path.join(root, filename), path))
+    return paths
+
+def scan(path):
+    """ Returns the state of every file below path by relative path """
+    state = {}
+    for relative in _walk(path):
+        st = os.lstat(os.path.join(path, relative))
+        state[relative] = (st.st_ino, st.st_size, st.st_mtime)
+    return state
+
+
+class AutotoolsCache(object):
+    """
+    Keeps the files autoreconf or autogen.sh generate, keyed by a hash of
+    their inputs (configure.ac, the Makefile.am files, the m4 macros), the
+    command and the versions of the autotools. On a hit, the generated files
+    are copied into the tree instead of running the tools again.
+    """
+
+    def __init__(self, path, enabled=True):
+        self._path = os.path.abspath(path)
+        self._enabled = enabled
+
+    def get_path(self):
+        """ Returns the directory of the cache """
+        return self._path
+
+    def is_enabled(self):
+        """ Returns True if generated build systems are cached """
+        return self._enabled
+
+    def get_key(self, source_path, args):
+        """ Returns the key of the build system generated by args in source_path """
+        inputs = []
+        for relative in _walk(source_path):
+            if not _inputs.match(os.path.basename(relative)): continue
+            full_path = os.path.join(source_path, relative)
+            if os.path.islink(full_path) and not os.path.exists(full_path): continue
+            inputs.append([relative, hash_file(full_path)])
+        return hash_value([args, inputs, tool_versions()])
+
+    def _lock_for(self, key):
+        """ Returns the lock on the entry with key, shared with other runs """
+        return locking.lock_for(os.path.join(self._path, '.' + key + '.lock'))
+
+    def regenerate(self, source_path, args, run):
+        """
+        Regenerates the build system in source_path, which the run callable
+        does by running args there. Returns True if the generated files were
+        restored from the cache instead.
+        """
+        if not self._enabled:
+            run(args)
+            return False
+        key = self.get_key(source_path, args)
+        entry_path = os.path.join(self._path, key)
+        with self._lock_for(key):
+            if os.path.isdir(entry_path):
+                self._restore(entry_path, source_path)
+                # Touching the entry keeps track of its last use
+                os.utime(entry_path, None)
+                print "Restored generated build system:", entry_path
+                return True
+            before = scan(source_path)
+            run(args)
+            self._store(entry_path, source_path, before)
+            print "Stored generated build system:", entry_path
+            return False
+
+    def _store(self, entry_path, source_path, before):
+        """ Stores the files which changed since before into entry_path """
+        after = scan(source_path)
+        generated = sorted([relative for relative in after.keys()
+                            if before.get(relative) != after[relative]],
+                           key=lambda relative: after[relative][2])
+        try:
+            os.makedirs(self._path)
+        except OSError as e:
+            if e.errno != errno.EEXIST: raise
+        work_path = tempfile.mkdtemp(suffix='.tmp', dir=self._path)
+        try:
+            files_path = os.path.join(work_path, 'files')
+            for relative in generated:
+                source = os.path.join(source_path, relative)
+                destination = os.path.join(files_path, relative)
+                if not os.path.isdir(os.path.dirname(destination)):
+                    os.makedirs(os.path.dirname(destination))
+                if os.path.islink(source):
+                    os.symlink(os.readlink(source), destination)
+                else:
+                    shutil.copy2(source, destination)
+            # The order the files were generated in, which make relies on
+            with open(os.path.join(work_path, 'MANIFEST'), 'w') as f:
+                for relative in generated: f.write(relative + '\n')
+            try:
+                os.rename(work_path, entry_path)
+            except OSError as e:
+                # Another qgsmg run stored the same entry first
+                if not e.errno in [errno.EEXIST, errno.ENOTEMPTY]: raise
+        finally:
+            if os.path.exists(work_path): shutil.rmtree(work_path)
+
+    def _restore(self, entry_path, source_path):
+        """
+        Copies the files of entry_path into source_path. They are written
+        in the order they were generated in, so they are newer than their
+        inputs and each other as before.
+        """
+        files_path = os.path.join(entry_path, 'files')
+        with open(os.path.join(entry_path, 'MANIFEST')) as f:
+            generated = [line.rstrip('\n') for line in f if len(line.strip()) > 0]
+        for relative in generated:
+            source = os.path.join(files_path, relative)
+            destination = os.path.join(source_path, relative)
+            if not os.path.isdir(os.path.dirname(destination)):
+                os.makedirs(os.path.dirname(destination))
+            if os.path.lexists(destination): os.remove(destination)
+            if os.path.islink(source):
+                os.symlink(os.readlink(source), destination)
+            else:
+                shutil.copyfile(source, destination)
+                shutil.copymode(source, destination)
@@ -17,10 +17,35 @@
 #
 
 import os, inspect
+import time
+import errno
 import shutil
-import subprocess
-from subprocess import Popen
-import re
+import functools
+import tempfile
+from subprocess import PIPE, STDOUT
+
+from qgis_mobility.generator.standalone_toolchain import StandaloneToolchain
+from qgis_mobility.generator.fingerprint import Fingerprint
+from qgis_mobility.generator.scheduler import run_concurrently
+from qgis_mobility.generator import fingerprint
+from qgis_mobility.generator import archive as archives
+from qgis_mobility.generator import rewrite
+from qgis_mobility.generator import tracing
+from qgis_mobility.generator import placement
+from qgis_mobility.generator import locking
+from qgis_mobility.generator.rewrite import Substitute
+from qgis_mobility.generator.buildlog import spawn
+
+# The directory of this module, the patches and runtime are found relative to it
+_current_path = os.path.realpath(os.path.dirname(
+    inspect.getfile(inspect.currentframe())))
+
+def _makedirs(path):
+    """ Creates path, tolerating concurrent creation by other builders """
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if not (e.errno == errno.EEXIST and os.path.isdir(path)): raise
 
 
 class Builder(object):
@@ -42,6 +67,13 @@ class Builder(object):
                                         self._library_name)
         self._sourcepaths = [source_path]
         self._host_sourcepaths = [host_source_path]
+        # Checkpoints passed by an earlier, failed build with the same
+        # inputs, loaded on first use
+        self._checkpoints = None
+        self._checkpoint_counts = {}
+        self._resuming = True
+        # Resolved paths, flags and the fingerprint, see invalidate
+        self._memo = {}
     
     def set_current_arch(self, arch):
         """
@@ -55,19 +87,134 @@ class Builder(object):
         """
         return self._arch
 
+    def for_arch(self, arch):
+        """
+        Returns a new builder of the same library set to arch. It has its own
+        architecture and source path state, so it can build concurrently.
+        """
+        return self.__class__(self._recon, arch)
+
+    def do_build_for_arches(self, *args):
+        """
+        Runs do_build_for(arch, *args) for all architectures of the library
+        concurrently, each on its own builder from for_arch
+        """
+        run_concurrently([functools.partial(self.for_arch(arch)._build_for,
+                                            arch, *args)
+                          for arch in self.get_arches()])
+
+    def _build_for(self, arch, *args):
+        """
+        Runs do_build_for, unless a resumed build finished arch already. The
+        architecture is recorded as one checkpoint around the whole of it,
+        its source tree may be gone but its results are not.
+        """
+        key = arch + ':built'
+        if key in self.get_checkpoints():
+            print "Skipping, passed checkpoint:", key
+            return
+        self.do_build_for(arch, *args)
+        self._record_checkpoint(key)
+
     def get_recon(self):
         """ Returns the recon object """
         return self._recon
 
+    def get_builder(self, builder_class, arch=None):
+        """
+        Returns the shared builder of builder_class for looking up its paths
+        and flags, set to arch if given
+        """
+        return self._recon.get_builders().get(builder_class, arch)
+
+    def _memoized(self, name, arch, resolve):
+        key = (name, arch)
+        if not key in self._memo: self._memo[key] = resolve()
+        return self._memo[key]
+
+    def invalidate(self):
+        """ Forgets the resolved paths, flags and fingerprint """
+        self._memo = {}
+
+    @classmethod
+    def dependencies(cls):
+        """
+        Returns the builder classes which need to be built before this one.
+        By default, only the standalone toolchain is needed.
+        """
+        return [StandaloneToolchain]
+
     def library_name(self):
         raise ValueError("Should implement the library_name method")
 
+    def prepare(self):
+        """
+        Fetches and prepares the sources ahead of the build, which may still
+        wait for its dependencies. Nothing is done for a build which is up
+        to date, or which resumes or restores an artifact instead.
+        """
+        if len(self.get_stale_reasons()) == 0 or self.is_resumable(): return
+        if (len(self.get_artifact_paths()) > 0 and
+            self._recon.get_artifact_store().contains(
+                self._library_name, self.get_fingerprint().digest())): return
+        with self.trace_phase('prepare'):
+            self.do_prepare()
+
+    def do_prepare(self):
+        """
+        Fetches the sources and creates the snapshots of their trees with
+        prepare_snapshot, using the same preparation as prepare_source in
+        the build. This must not use anything of the dependencies. The
+        default fetches the sources only.
+        """
+        self.fetch_sources()
+
+    def fetch_sources(self):
+        """
+        Brings all sources into the distfiles cache the way the build takes
+        them and returns their paths. This must not use anything of the
+        dependencies.
+        """
+        return [self.fetch(url) for url in self.get_sources()]
+
     def do_build(self):
         raise ValueError("Should implement the do_build method")
 
     def human_name(self):
         raise ValueError("Should implement the human_name method")
 
+    def get_sources(self):
+        """ Returns the URLs of the sources this library is built from """
+        return []
+
+    def get_distfile_names(self):
+        """ Returns the names of the source archives in the distfiles cache """
+        distfiles = self.get_distfiles()
+        return [distfiles.get_name(url) for url in self.get_sources()]
+
+    def get_source_checksums(self):
+        """
+        Returns the SHA-256 checksums of the sources by URL. Sources without
+        a declared checksum are verified against the distfiles manifest.
+        """
+        return {}
+
+    def get_local_sources(self):
+        """ Returns local paths of sources which are not downloaded """
+        return []
+
+    def get_arches(self):
+        """ Returns the architectures this library is built for """
+        return ['android']
+
+    def get_patch_files(self):
+        """ Returns the patch files and directories the build depends on """
+        config_path = os.path.join(self.get_core_patch_path(), 'config')
+        patch_files = [os.path.join(config_path, 'config.sub'),
+                       os.path.join(config_path, 'config.guess')]
+        if self.patch_path != None: patch_files.append(self.patch_path)
+        return patch_files
+
     def get_library_path(self, arch=None):
         """
         Returns the output library path
@@ -109,22 +256,157 @@ class Builder(object):
 
 
     def make(self):
-        print "=" * 80
-        print self.human_name()
-        print "=" * 80
-        if not self.build_finished:
-            self.purge("host")
-            self.purge("android")
-            self._verify_cache()
-            self._verify_build_path()
-            self._verify_source_path()
-            self._verify_include_path()
-            self.do_build()
-        else:
-            print "Already Done"
+        with self.get_lock():
+            print "=" * 80
+            print self.human_name()
+            print "=" * 80
+            # Another qgsmg run may have built it while this one waited
+            self.invalidate()
+            reasons = self.get_stale_reasons()
+            if len(reasons) > 0:
+                print "Building because:", ", ".join(reasons)
+                with self.trace_phase('build'):
+                    resume = self.is_resumable()
+                    if resume:
+                        print "Resuming after:", ", ".join(self.get_checkpoints())
+                    else:
+                        self.reset_checkpoints()
+                        self.purge("host")
+                        self.purge("android")
+                    self._verify_cache()
+                    self._verify_build_path()
+                    self._verify_source_path()
+                    self._verify_include_path()
+                    if resume or not self.restore_artifact():
+                        compiler_cache = self.get_compiler_cache()
+                        compiler_cache.reset_statistics(self._library_name)
+                        self.do_build()
+                        print compiler_cache.report(self._library_name)
+                        self.store_artifact()
+                    self.reset_checkpoints()
+            else:
+                print "Already Done"
     
     def remove(self):
-        os.remove(self.get_build_finished_file()) 
+        with self.get_lock():
+            os.remove(self.get_build_finished_file()) 
+            self.reset_checkpoints()
+
+    def get_lock_file(self):
+        return os.path.join(self.cache_path, '.lock' + self._library_name)
+
+    def get_lock(self):
+        """
+        Returns the lock held while the library is built or removed, by this
+        or any other qgsmg run on the same cache
+        """
+        return locking.lock_for(self.get_lock_file(), self.human_name())
+
+    def supports_checkpoints(self):
+        """
+        Returns True if a failed build may resume after its last checkpoint.
+        Builders doing work outside of checkpoints which cannot be repeated
+        on a partially built tree return False.
+        """
+        return True
+
+    def get_checkpoint_file(self):
+        return os.path.join(self.cache_path, '.ckpt' + self._library_name)
+
+    def get_checkpoints(self):
+        """
+        Returns the checkpoints passed by an earlier build with the same
+        inputs, which a new build may skip
+        """
+        if self._checkpoints == None:
+            self._checkpoints = []
+            if self.supports_checkpoints() and not self._recon.is_from_scratch():
+                record = fingerprint.read_record(self.get_checkpoint_file())
+                if (record != None and
+                    record.get('fingerprint') == self.get_fingerprint().digest()):
+                    self._checkpoints = record['checkpoints']
+        return self._checkpoints
+
+    def is_resumable(self):
+        """ Returns True if the build can resume after checkpoints """
+        return len(self.get_checkpoints()) > 0
+
+    def reset_checkpoints(self):
+        """ Forgets all checkpoints, the next build starts from scratch """
+        if os.path.exists(self.get_checkpoint_file()):
+            os.remove(self.get_checkpoint_file())
+        self._checkpoints = []
+
+    def checkpoint(self, name, function, output=None):
+        """
+        Calls function and records checkpoint name for the current
+        architecture once it returns. A resumed build skips the function
+        instead, as long as all checkpoints before were skipped as well and
+        output, if given, still exists.
+        """
+        key = self._arch + ':' + name
+        count = self._checkpoint_counts.get(key, 0) + 1
+        self._checkpoint_counts[key] = count
+        if count > 1: key += '#' + str(count)
+        if (self._resuming and key in self.get_checkpoints() and
+            (output == None or os.path.exists(output))):
+            print "Skipping, passed checkpoint:", key
+            return
+        self._resuming = False
+        function()
+        self._record_checkpoint(key)
+
+    def _record_checkpoint(self, key):
+        with self.shared_file_lock(self.get_checkpoint_file()):
+            record = fingerprint.read_record(self.get_checkpoint_file())
+            digest = self.get_fingerprint().digest()
+            if record == None or record.get('fingerprint') != digest:
+                record = { 'fingerprint' : digest, 'checkpoints' : [] }
+            if not key in record['checkpoints']: record['checkpoints'].append(key)
+            fingerprint.write_record(self.get_checkpoint_file(), record)
+
+    def get_fingerprint(self):
+        """ Returns the fingerprint over the current inputs of the build """
+        return self._memoized('fingerprint', None, lambda: Fingerprint(self))
+
+    def get_artifact_paths(self):
+        """
+        Returns the output trees of the build, which are kept in the
+        artifact store. An empty list keeps the builder out of the store.
+        """
+        paths = []
+        for arch in self.get_arches():
+            paths.extend([self.get_build_path(arch), self.get_include_path(arch)])
+        return paths
+
+    def restore_artifact(self):
+        """ Restores the build from the artifact store, if it has it """
+        paths = self.get_artifact_paths()
+        if len(paths) == 0: return False
+        store = self._recon.get_artifact_store()
+        digest = self.get_fingerprint().digest()
+        with self.trace_phase('restore artifact'):
+            restored = store.restore(self._library_name, digest, self.cache_path)
+        if not restored: return False
+        self.mark_finished()
+        return True
+
+    def store_artifact(self):
+        """ Packs the outputs of a finished build into the artifact store """
+        paths = self.get_artifact_paths()
+        if len(paths) == 0 or not self.build_finished: return
+        store = self._recon.get_artifact_store()
+        with self.trace_phase('store artifact'):
+            store.store(self._library_name, self.get_fingerprint().digest(),
+                        self.cache_path, paths)
+
+    def get_build_record(self):
+        """ Returns the completion record of the last build, if any """
+        return fingerprint.read_record(self.get_build_finished_file())
+
+    def get_stale_reasons(self):
+        """ Returns why the build is stale, or an empty list if it is not """
+        return self.get_fingerprint().stale_reasons(self.get_build_record())
 
     def purge(self, arch):
         if os.path.exists(self.get_build_path(arch)):
@@ -135,22 +417,21 @@ class Builder(object):
             shutil.rmtree(self.get_include_path(arch))
         
     def _get_current_path(self):
-        return os.path.realpath(os.path.dirname(
-            inspect.getfile(inspect.currentframe())))
+        return _current_path
 
     def get_build_finished_file(self):
         return os.path.join(
             self.cache_path, '.fini' + self._library_name)
     
     def get_build_finished(self):
-        return os.path.exists(self.get_build_finished_file())
+        return len(self.get_stale_reasons()) == 0
     
     build_finished = property(get_build_finished, None, None, 
-                              "True if the build is finished")
+                              "True if the build is finished with the current inputs")
     
     def mark_finished(self):
-        with open(self.get_build_finished_file(), 'w'):
-            pass
+        fingerprint.write_record(self.get_build_finished_file(),
+                                 self.get_fingerprint().record())
 
     def get_home_path(self):
         """ Return the home path """
@@ -188,7 +469,8 @@ class Builder(object):
         """
         arch = self._arch if arch == None else arch
         build_dir = 'build_host' if arch == 'host' else 'build'
-        return os.path.join(self.cache_path, build_dir, self._library_name)
+        return self._memoized('build_path', arch, lambda: os.path.join(
+            self.cache_path, build_dir, self._library_name))
     
     build_path = property(get_build_path, None, None, "The path with the builds")
 
@@ -210,7 +492,18 @@ class Builder(object):
         """
         arch = self._arch if arch == None else arch
         include_dir = 'include_host' if arch == 'host' else 'include'
-        return os.path.join(self.cache_path, include_dir, self._library_name)
+        return self._memoized('include_path', arch, lambda: os.path.join(
+            self.cache_path, include_dir, self._library_name))
+
+    def get_object_path(self, arch=None):
+        """
+        Returns the directory of the build tree kept across rebuilds, by
+        builders which rebuild incrementally. Unlike the source path, it is
+        not purged before a build.
+        """
+        arch = self._arch if arch == None else arch
+        object_dir = 'objects_host' if arch == 'host' else 'objects'
+        return os.path.join(self.cache_path, object_dir, self._library_name)
 
     def get_source_path(self, arch=None):
         """
@@ -235,12 +528,41 @@ class Builder(object):
         """ Returns a GCC tool form the toolchain with the right prefix """
         return self.get_toolchain_prefix() + tool_name
 
+    def get_compiler_cache(self):
+        """ Returns the compiler cache wrapping the compilers """
+        return self._recon.get_compiler_cache()
+
+    def get_config_cache(self):
+        """ Returns the configure results shared between builders """
+        return self._recon.get_config_cache()
+
+    def uses_config_cache(self):
+        """
+        Returns True if configure may use the results shared with other
+        builders. Packages whose configure breaks on them return False.
+        """
+        return True
+
+    def get_config_cache_key(self):
+        """
+        Returns the key of the shared configure results for the current
+        architecture: the toolchain and the compiler
+        """
+        mappings = self.get_default_toolchain_mappings()
+        compiler = self.get_compiler_cache().unwrap(mappings.get('CC', 'gcc'))
+        return fingerprint.hash_value(
+            [self.get_fingerprint().components()['toolchain'], self._arch,
+             compiler])
+
     def get_default_toolchain_mappings(self):
+        compiler_cache = self.get_compiler_cache()
         if self._arch == 'host':
-            return {}
+            if not compiler_cache.is_enabled(): return {}
+            return { 'CC'     : compiler_cache.wrap('gcc'),
+                     'CXX'    : compiler_cache.wrap('g++') }
         else:
-            return { 'CC'     : self.get_tool('gcc'),
-                     'CXX'    : self.get_tool('g++'),
+            return { 'CC'     : compiler_cache.wrap(self.get_tool('gcc')),
+                     'CXX'    : compiler_cache.wrap(self.get_tool('g++')),
                      'LD'     : self.get_tool('ld'),
                      'AR'     : self.get_tool('ar'),
                      'STRIP'  : self.get_tool('strip'),
@@ -259,6 +581,13 @@ class Builder(object):
                  'LDFLAGS'  : ldflags,
                  'CXXFLAGS' : cflags + ' --std=gnu++0x' }
 
+    def get_flags(self):
+        """
+        Returns a copy of the default flags of the current architecture,
+        salted by the builder, resolved once until invalidate is called
+        """
+        return dict(self._memoized('flags', self._arch, self.get_default_flags))
+
     def get_default_configure_flags(self):
         host = (self._arch == 'host')
         if host: return ['--prefix=' + self.get_build_path()]
@@ -276,79 +605,268 @@ class Builder(object):
         
     def _verify_cache(self):
         if not os.path.exists(self.get_cache_path()):
-            os.makedirs(self.get_cache_path())
+            _makedirs(self.get_cache_path())
     
     def _verify_build_path(self):
         if not os.path.exists(self.get_build_path()):
-            os.makedirs(self.get_build_path())
+            _makedirs(self.get_build_path())
         if not os.path.exists(self.get_build_path("host")):
-            os.makedirs(self.get_build_path("host"))
+            _makedirs(self.get_build_path("host"))
 
     def _verify_source_path(self):
         if not os.path.exists(self.get_source_path()):
-            os.makedirs(self.get_source_path())
+            _makedirs(self.get_source_path())
         if not os.path.exists(self.get_source_path("host")):
-            os.makedirs(self.get_source_path("host"))
+            _makedirs(self.get_source_path("host"))
 
     def _verify_include_path(self):
         if not os.path.exists(self.get_include_path()):
-            os.makedirs(self.get_include_path())
+            _makedirs(self.get_include_path())
         if not os.path.exists(self.get_include_path("host")):
-            os.makedirs(self.get_include_path("host"))
+            _makedirs(self.get_include_path("host"))
 
     def verify(self):
         if not 'HOME' in os.environ: 
             raise EnvironmentError("HOME should be defined in the environment")
     
-    def _call_process(self, args):
-        output = subprocess.call(args)
-        if output != 0:
-            raise ValueError("Failed Process: " + args[0])
-
-    def wget(self, url):
-        args = ['wget', '-P', self.get_current_source_path(), url]
-        self._call_process(args)
-        storage = os.path.join(self.get_current_source_path(), url.split('/')[-1])
-        print "File stored at:", storage
-        return storage
+    def shared_file_lock(self, path):
+        """
+        Serializes builders which temporarily alter a file they share, such
+        as the qprocess.sip file installed by PyQt, within this and any other
+        qgsmg run on the same cache
+        """
+        key = fingerprint.hash_value(os.path.realpath(path))[:16]
+        return locking.lock_for(os.path.join(self.cache_path, '.lock-' + key),
+                                path)
+
+    def trace_phase(self, name):
+        """ Returns a context manager recording its block as build phase """
+        return self._recon.get_tracer().phase(self._library_name, name)
+
+    def get_build_log(self):
+        """ Returns the log receiving the output of the child processes """
+        return self._recon.get_build_logs().get(self._library_name)
+
+    def _call_process(self, args, cwd=None, env=None, error=None, phase=None):
+        """
+        Runs a child process on a lease of the global jobserver, so every
+        make started by it draws its additional jobs from the shared budget,
+        no more than the job limit of the library. Tools which do not use
+        the jobserver, like ninja, pass a function for args instead, which
+        gets the amount of slots leased and returns the arguments. The
+        output goes to the build log, the process is traced, within the
+        given build phase if any.
+        """
+        if phase != None:
+            with self.trace_phase(phase):
+                return self._run_process(args, cwd, env, error, phase)
+        return self._run_process(args, cwd, env, error, None)
+
+    def _run_process(self, args, cwd, env, error, description):
+        jobserver = self._recon.get_jobserver()
+        log = self.get_build_log()
+        if env == None: env = dict(os.environ)
+        env = self.get_compiler_cache().environment(env, self._library_name)
+        private = callable(args)
+        with jobserver.lease(self.get_job_limit(), private) as lease:
+            if private: args = args(lease.get_jobs())
+            if description == None: description = os.path.basename(args[0])
+            env = lease.environment(env)
+            start = time.time()
+            process = spawn(args, cwd=cwd, env=env, stdout=PIPE, stderr=STDOUT)
+            tail = log.capture(description, args, cwd, process)
+            usage = tracing.wait_with_usage(process)
+            self._recon.get_tracer().process(self._library_name, args, start,
+                                             time.time(), usage)
+        if process.returncode != 0:
+            log.report_failure(description, process.returncode, tail)
+            if error == None: error = "Failed Process: " + args[0]
+            raise ValueError(error)
+
+    def get_job_limit(self):
+        """
+        Returns how many jobs the child processes of the library may run at
+        once, following the memory their jobs took in earlier runs
+        """
+        return self._recon.get_job_limit(self._library_name)
+
+    def get_distfiles(self):
+        """ Returns the distfiles cache holding the source archives """
+        return self._recon.get_distfiles()
+
+    def fetch(self, url):
+        """
+        Returns the path of the source archive at url in the distfiles cache,
+        downloading it if needed
+        """
+        with self.trace_phase('fetch'):
+            return self.get_distfiles().fetch(
+                url, self._call_process,
+                sha256=self.get_source_checksums().get(url))
+
+    def get_snapshots(self):
+        """ Returns the cache of prepared source trees """
+        return self._recon.get_snapshots()
+
+    def get_snapshot_key(self, output, directory):
+        """
+        Returns the key of the sources of directory prepared from the archive
+        output for the current architecture
+        """
+        distfiles = self.get_distfiles()
+        checksum = None
+        if os.path.dirname(output) == distfiles.get_path():
+            checksum = distfiles.get_checksums().get(os.path.basename(output))
+        if checksum == None: checksum = fingerprint.hash_file(output)
+        return fingerprint.hash_value([self.get_fingerprint().source_digest(),
+                                       self._arch, directory, checksum])
+
+    def prepare_source(self, output, directory, preparation=None, keep=False):
+        """
+        Unpacks the archive output, which has to produce directory, into the
+        current source path and calls preparation with directory as current
+        source path. The prepared tree is kept as snapshot, later builds with
+        the same archive, patches, build script and architecture get a copy.
+        With keep, a working copy of the same snapshot is kept as it is,
+        along with everything built in it. Returns the path of the prepared
+        directory.
+        """
+        destination = os.path.join(self.get_current_source_path(), directory)
+        key = self.get_snapshot_key(output, directory)
+        stamp_file = destination + '.snapshot'
+        if keep and os.path.isdir(destination) and os.path.exists(stamp_file):
+            with open(stamp_file) as f:
+                if f.read().strip() == key:
+                    print "Keeping working copy:", destination
+                    return destination
+        def materialize():
+            if os.path.exists(stamp_file): os.remove(stamp_file)
+            with self.trace_phase('prepare source'):
+                self.get_snapshots().prepare(
+                    self._library_name, key, directory, destination,
+                    self._snapshot_creator(output, directory, preparation),
+                    self._call_process)
+            if keep:
+                with open(stamp_file, 'w') as f: f.write(key + '\n')
+        self.checkpoint('source ' + directory, materialize, output=destination)
+        return destination
+
+    def _snapshot_creator(self, output, directory, preparation):
+        """ Returns the function creating the snapshot of directory """
+        def create(work_path):
+            self.push_current_source_path(work_path)
+            try:
+                self.unpack(output)
+                if preparation != None:
+                    self.push_current_source_path(os.path.join(work_path,
+                                                               directory))
+                    try:
+                        preparation()
+                    finally:
+                        self.pop_current_source_path()
+            finally:
+                self.pop_current_source_path()
+        return create
+
+    def prepare_snapshot(self, output, directory, preparation=None):
+        """
+        Creates the snapshot prepare_source takes its working copy from, for
+        the current architecture, without making a working copy
+        """
+        with self.trace_phase('prepare source'):
+            self.get_snapshots().create(
+                self._library_name, self.get_snapshot_key(output, directory),
+                directory, self._snapshot_creator(output, directory, preparation))
+
+    def prepare_snapshots(self, output, directory, preparation=None, arches=None):
+        """
+        Creates the snapshots of directory for arches, all architectures of
+        the library by default. The preparation is called with each of them
+        set as current architecture.
+        """
+        current_arch = self._arch
+        try:
+            for arch in arches or self.get_arches():
+                self.set_current_arch(arch)
+                self.prepare_snapshot(output, directory, preparation)
+        finally:
+            self.set_current_arch(current_arch)
+
+    def fetch_svn_snapshot(self, url, name):
+        """
+        Returns the path of a snapshot archive of the svn url in the distfiles
+        cache, exporting it into name.tar.gz if needed
+        """
+        distfiles = self.get_distfiles()
+        def create(path):
+            export_path = tempfile.mkdtemp(dir=distfiles.get_path())
+            try:
+                self._call_process(['svn', 'export', '-q', url,
+                                    os.path.join(export_path, name)])
+                self._call_process(['tar', 'czf', path, '-C', export_path, name])
+            finally:
+                shutil.rmtree(export_path)
+        with self.trace_phase('fetch'):
+            return distfiles.fetch(url, self._call_process, name=name + '.tar.gz',
+                                   sha256=self.get_source_checksums().get(url),
+                                   create=create)
 
     def patch(self, patch_name, strip=None):
         patch_file = os.path.join(self.patch_path, patch_name)
         args = ['patch']
         if not strip == None: args.extend(['-p' + str(strip)])
         args.extend(['-d', self.get_current_source_path(), '-i', patch_file])
-        self._call_process(args)
+        self._call_process(args, phase='patch')
         print "Patched path:", self.get_current_source_path()
         print "Patched ( with -i ) using:", patch_file
 
-    def sed(self, sedstring, path, options=None):
-        args = ['sed']
-        if not options == None: args.extend(options)
-        args.extend([sedstring, path])
-        process = Popen(args, cwd=self.get_current_source_path())
-        process.communicate(None)
-        if not process.returncode == 0:
-            raise ValueError("Failed Process: " + args[0])
-        print "Sed finished with:", path
-
-    def sed_i(self, sedstring, path):
-        self.sed(sedstring, path, options=['-i'])        
-
-    def sed_ir(self, sedstring, path):
-        self.sed(sedstring, path, options=['-i', '-r'])
-        
-    def sed_ie(self, sedstring, path):
-        self.sed(sedstring, path, options=['-i', '-e'])
-
-    def unpack(self, archive):
-        extension_groups = re.search("[.]([^.]*)$", archive).groups()
-        unpack_method = 'xzvf'
-        if len(extension_groups) > 0:
-            if extension_groups[0] == "bz2": unpack_method = "xjvf"
-        args = ['tar', unpack_method, archive, '-C', self.get_current_source_path()]
-        print args
-        self._call_process(args)
-        print "Unpacked using:", archive
+    def rewrite(self, path, edits, keep_times=False):
+        """
+        Applies the edits (see the rewrite module) to the file at path,
+        relative to the current source path, in a single pass. With
+        keep_times, the file keeps its modification time, so incremental
+        builds depending on it do not take it as changed.
+        """
+        full_path = os.path.join(self.get_current_source_path(), path)
+        if keep_times: times = os.stat(full_path)
+        self.rewrite_files([(path, edits)])
+        if keep_times: os.utime(full_path, (times.st_atime, times.st_mtime))
+
+    def rewrite_files(self, files):
+        """
+        Applies edits to many files concurrently. Takes a list of (path,
+        edits) pairs, paths being relative to the current source path, and
+        warns about every edit which matched nothing.
+        """
+        source_path = self.get_current_source_path()
+        files = [(os.path.join(source_path, path), edits) for path, edits in files]
+        with self.trace_phase('rewrite'):
+            unmatched = rewrite.rewrite_files(files)
+        for path, edit in unmatched:
+            print "Warning: %r matched nothing in %s" % (edit, path)
+        print "Rewrote:", ", ".join(os.path.relpath(path, source_path)
+                                    for path, edits in files)
+
+    def unpack(self, archive, members=None, excludes=[]):
+        """
+        Extracts archive into the current source path, optionally only the
+        members matching the given patterns
+        """
+        with self.trace_phase('unpack'):
+            with self._recon.get_jobserver().slot():
+                archives.extract(archive, self.get_current_source_path(),
+                                 members=members, excludes=excludes)
+
+    def copy_tree(self, source, destination, link=True):
+        """
+        Places the tree at source into destination, hardlinking its files
+        unless link is False. Files already current in destination are kept.
+        Trees which are written to in place afterwards must not be linked.
+        """
+        with self.trace_phase('copy_tree'):
+            counts = placement.sync_tree(source, destination, link)
+        print "Placed %s: %d linked, %d copied, %d kept" % (
+            destination, counts['linked'], counts['copied'], counts['kept'])
     
     def fix_config_sub_and_guess(self):
         config_sub_path = os.path.join(self.get_current_source_path(), 'config.sub')
@@ -365,32 +883,36 @@ class Builder(object):
     def run_svn_checkout(self, url, path=None):
         args = ['svn', 'checkout', url]
         if not path == None: args.extend([path])
-        process = Popen(args, cwd=self.get_current_source_path())
-        process.communicate(None)
-        if not process.returncode == 0:
-            raise ValueError("Failed Process: " + args[0])
+        self._call_process(args, cwd=self.get_current_source_path(),
+                           phase='svn checkout')
         print "SVN Checkout performed from:", url
         
 
     def run_autogen(self):
-        process = Popen(['bash', 'autogen.sh'], cwd=self.get_current_source_path())
-        process.communicate(None)
-        if not process.returncode == 0:
-            raise ValueError("Failed Process: " + args[0])
+        self._regenerate_build_system(['bash', 'autogen.sh'], 'autogen')
         print "Autogeneration done"
 
     def run_autoreconf(self):
-        process = Popen(['autoreconf', '-i', '-f'], cwd=self.get_current_source_path())
-        process.communicate(None)
-        if not process.returncode == 0:
-            raise ValueError("Failed Process: " + args[0])
+        self._regenerate_build_system(['autoreconf', '-i', '-f'], 'autoreconf')
         print "Auto(re)configuration done"
+
+    def _regenerate_build_system(self, args, phase):
+        """
+        Runs args in the current source path to generate the build system,
+        or restores its output from the autotools cache
+        """
+        source_path = self.get_current_source_path()
+        with self.trace_phase(phase):
+            self._recon.get_autotools_cache().regenerate(
+                source_path, args,
+                lambda args: self._call_process(args, cwd=source_path))
         
 
     def run_autotools_and_make(self, where=None, harness=True, runmakeinstall=True):
         if os.path.exists(os.path.join(self.get_current_source_path(), 'ltmain.sh')):
             print "Bypassing ltmain hardcoding"
-            self.sed_i('s/hardcode_into_libs/leave_me_alone/g', 'ltmain.sh')
+            self.rewrite('ltmain.sh', [Substitute('hardcode_into_libs', 'leave_me_alone',
+                                                  every=True)])
         
         harnessed_source_path = self.get_current_source_path()
         if harness:
@@ -402,39 +924,54 @@ class Builder(object):
 
         environmental = []
         
-        flags = self.get_default_flags()
+        flags = self.get_flags()
         for flag in flags: environmental.extend([flag + '=' + flags[flag]])
 
-        if not self._arch == 'host':
-            mappings = self.get_default_toolchain_mappings()
-            for flag in mappings: environmental.extend([flag + '=' + mappings[flag]])
+        mappings = self.get_default_toolchain_mappings()
+        for flag in mappings: environmental.extend([flag + '=' + mappings[flag]])
         
         if where == None: where = self.get_current_source_path()
         
         args = [os.path.join(where, 'configure')]
         args.extend(environmental)
         args.extend(self.get_default_configure_flags())
-        all_processes = [args]
+
+        config_cache = self.get_config_cache()
+        if config_cache.is_enabled() and self.uses_config_cache():
+            cache_file = os.path.join(harnessed_source_path, 'config.cache')
+            key = self.get_config_cache_key()
+            config_cache.checkout(self._arch, key, cache_file)
+            args.extend(['--cache-file=' + cache_file])
+            def configure():
+                self._call_process(args, cwd=harnessed_source_path, env=our_env,
+                                   phase='configure')
+                config_cache.merge(self._arch, key, cache_file)
+        else:
+            configure = functools.partial(self._call_process, args,
+                                          cwd=harnessed_source_path,
+                                          env=our_env, phase='configure')
+        self.checkpoint('configure', configure)
         # make sure rpath is skipped
         # Only perform this if ltmain.sh is available
-        if runmakeinstall: all_processes.extend([['make'], ['make', 'install']])
-
-        for arguments in all_processes:
-            process = Popen(arguments, cwd=harnessed_source_path, env=our_env)
-            process.communicate(None)
-            if not process.returncode == 0:
-                raise ValueError("Failed Process: " + arguments[0])
+        all_processes = []
+        if runmakeinstall: all_processes.extend([('make', ['make']),
+                                                 ('make install', ['make', 'install'])])
+
+        for phase, arguments in all_processes:
+            self.checkpoint(phase, functools.partial(
+                self._call_process, arguments, cwd=harnessed_source_path,
+                env=our_env, phase=phase))
         
         print "Autotools and Make ended in:", where
         
 
     def run_qmake_and_make(self):
         harnessed_source_path = os.path.join(self.get_current_source_path(), 'harness')
-        os.makedirs(harnessed_source_path)
+        if not os.path.exists(harnessed_source_path): os.makedirs(harnessed_source_path)
         our_env = dict(os.environ).copy()
         our_env['PATH'] = self.get_path()
         
-        flags = self.get_default_flags()
+        flags = self.get_flags()
         for flag in flags: our_env[flag] = flags[flag]
         
         mappings = self.get_default_toolchain_mappings()
@@ -442,23 +979,23 @@ class Builder(object):
         
         args = [os.path.join(self.get_recon().qt_tools_path, 'qmake'), 
                 os.path.join(self.get_current_source_path(), 'qwt.pro')]
+        # qmake takes its compilers from the mkspec, not the environment
+        if self.get_compiler_cache().is_enabled():
+            args.extend(['QMAKE_CC=' + mappings['CC'],
+                         'QMAKE_CXX=' + mappings['CXX']])
         
-        process = Popen(args, cwd=harnessed_source_path, env=our_env)
-        process.communicate(None)
-        if not process.returncode == 0:
-            raise ValueError("Failed Process: " + arguments[0])
-        
-        process = Popen(['make'], cwd=harnessed_source_path, env=our_env)
-        process.communicate(None)
-        if not process.returncode == 0:
-            raise ValueError("Failed Process: " + arguments[0])
+        self.checkpoint('configure', functools.partial(
+            self._call_process, args, cwd=harnessed_source_path, env=our_env,
+            phase='configure'))
+        self.checkpoint('make', functools.partial(
+            self._call_process, ['make'], cwd=harnessed_source_path, env=our_env,
+            phase='make'))
 
         our_env['INSTALL_ROOT'] = self.get_build_path()
         
-        process = Popen(['make', 'install'], cwd=harnessed_source_path, env=our_env)
-        process.communicate(None)
-        if not process.returncode == 0:
-            raise ValueError("Failed Process: " + arguments[0])
+        self.checkpoint('make install', functools.partial(
+            self._call_process, ['make', 'install'], cwd=harnessed_source_path,
+            env=our_env, phase='make install'))
             
     def run_make(self, path=None, makefile=None):
         args = ['make']
@@ -467,18 +1004,14 @@ class Builder(object):
         if path == None:
             path = self.build_path
         
-        for flag in self.get_default_flags():
-            value = self.get_default_flags()[flag]
-            args.extend([flag + '=' + value])
+        flags = self.get_flags()
+        for flag in flags: args.extend([flag + '=' + flags[flag]])
         
         print args
 
         our_env = dict(os.environ).copy()
         our_env['PATH'] = self.get_path()
 
-        process = Popen(args, cwd=path, env=our_env)
-        process.communicate(None)
-        if not process.returncode == 0:
-            raise ValueError("Failed Process: " + args[0])
+        self._call_process(args, cwd=path, env=our_env, phase='make')
 
         print "Make ended in: ", path
@@ -0,0 +1,150 @@
+#
+#  This file is part of QGis Mobility
+#
+#  QGis Mobility is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  QGis Mobility is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with QGis Mobility. If not, see
+#  <http://www.gnu.org/licenses/>.
+#
+
+import os
+import sys
+import gzip
+import time
+import errno
+import fcntl
+import threading
+from subprocess import Popen
+from collections import deque
+
+# Serializes the lines written to the console by concurrent builders
+_console_lock = threading.Lock()
+
+# Serializes starting child processes, see spawn
+_spawn_lock = threading.Lock()
+
+def spawn(args, **kwargs):
+    """
+    Starts a Popen process with args and kwargs. Children are started one
+    at a time and the parent's ends of their pipes are closed on exec, so
+    no other child inherits them: a pipe reaches its end as soon as its own
+    process ends, not once every process started meanwhile ended as well.
+    """
+    with _spawn_lock:
+        process = Popen(args, **kwargs)
+        for pipe in [process.stdin, process.stdout, process.stderr]:
+            if pipe == None: continue
+            flags = fcntl.fcntl(pipe.fileno(), fcntl.F_GETFD)
+            fcntl.fcntl(pipe.fileno(), fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+    return process
+
+def console(line):
+    """ Writes line to the console without interleaving it with others """
+    with _console_lock:
+        sys.stdout.write(line + '\n')
+        sys.stdout.flush()
+
+
+class BuildLog(object):
+    """
+    The compressed log of the child processes of one builder. Only a
+    progress line per process reaches the console, unless verbose is set.
+    The last tail lines of a failing process are printed on the console.
+    """
+
+    def __init__(self, path, name, tail=40, verbose=False):
+        self._path = path
+        self._name = name
+        self._tail = tail
+        self._verbose = verbose
+        self._file = None
+        self._written = False
+        self._lock = threading.Lock()
+
+    def get_path(self):
+        """ Returns the path of the compressed log file """
+        return self._path
+
+    def write(self, text):
+        """ Appends text to the log """
+        with self._lock:
+            if self._file == None:
+                # The first write of a run replaces the log of the last run
+                self._file = gzip.open(self._path, 'ab' if self._written else 'wb')
+                self._written = True
+            self._file.write(text)
+
+    def close(self):
+        """ Closes the log file, a later write appends to it """
+        with self._lock:
+            if self._file != None: self._file.close()
+            self._file = None
+
+    def capture(self, description, args, cwd, process):
+        """
+        Copies the combined output of the Popen process, started with args
+        in cwd, into the log until it closes its output. Returns the last
+        lines of the output.
+        """
+        start = time.time()
+        console("[%s] %s" % (self._name, description))
+        self.write("\n$ cd %s && %s\n" % (cwd or os.getcwd(), ' '.join(args)))
+        tail = deque(maxlen=self._tail)
+        count = 0
+        for line in iter(process.stdout.readline, ''):
+            self.write(line)
+            tail.append(line.rstrip('\n'))
+            count += 1
+            if self._verbose: console("[%s] %s" % (self._name, line.rstrip('\n')))
+        process.stdout.close()
+        self.write("# %d lines in %.1fs\n" % (count, time.time() - start))
+        return list(tail)
+
+    def report_failure(self, description, returncode, tail):
+        """ Prints the tail of the output of a failed process """
+        lines = ["[%s] %s failed with exit status %d, last %d lines of %s:" % (
+            self._name, description, returncode, len(tail), self._path)]
+        lines.extend(["[%s] | %s" % (self._name, line) for line in tail])
+        console('\n'.join(lines))
+
+
+class BuildLogs(object):
+    """ Hands out the build log of every builder, kept in one directory """
+
+    def __init__(self, path, tail=40, verbose=False):
+        self._path = os.path.abspath(path)
+        self._tail = tail
+        self._verbose = verbose
+        self._logs = {}
+        self._lock = threading.Lock()
+
+    def get_path(self):
+        """ Returns the directory of the logs """
+        return self._path
+
+    def get(self, name):
+        """ Returns the build log of the builder with name """
+        with self._lock:
+            if not name in self._logs:
+                try:
+                    os.makedirs(self._path)
+                except OSError as e:
+                    if e.errno != errno.EEXIST: raise
+                self._logs[name] = BuildLog(
+                    os.path.join(self._path, name + '.log.gz'), name,
+                    self._tail, self._verbose)
+            return self._logs[name]
+
+    def close(self):
+        """ Closes all log files, so they are complete on disk """
+        with self._lock:
+            for log in self._logs.values(): log.close()
@@ -0,0 +1,279 @@
+#
+#  This file is part of QGis Mobility
+#
+#  QGis Mobility is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  QGis Mobility is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with QGis Mobility. If not, see
+#  <http://www.gnu.org/licenses/>.
+#
+
+import os
+import re
+import stat
+import errno
+import shutil
+
+_units = { '' : 1, 'K' : 1024, 'M' : 1024 ** 2, 'G' : 1024 ** 3, 'T' : 1024 ** 4 }
+
+# The directories below the cache path holding one tree per builder
+_builder_directories = ['source', 'source_host', 'build', 'build_host',
+                        'include', 'include_host', 'objects', 'objects_host']
+
+
+def parse_size(text):
+    """ Returns the bytes of a size like 500M or 20G, as ccache takes it """
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*$', text, re.I)
+    if match == None: raise ValueError("Not a size: " + text)
+    return int(float(match.group(1)) * _units[match.group(2).upper()])
+
+def format_size(size):
+    """ Returns size in bytes in the largest fitting binary unit """
+    for unit in ['T', 'G', 'M', 'K']:
+        if size >= _units[unit]:
+            return "%.1f %siB" % (float(size) / _units[unit], unit)
+    return "%d B" % size
+
+def _is_below(path, directory):
+    return path == directory or path.startswith(directory + os.sep)
+
+
+class CacheEntry(object):
+    """
+    A file or tree in the cache, owned by a builder or by a part of qgsmg.
+    Entries which are not needed may be removed by the garbage collection,
+    apart from the paths to keep below them.
+    """
+
+    def __init__(self, path, category, owner, needed, reason, keep=[]):
+        self.path = os.path.abspath(path)
+        self.category = category
+        self.owner = owner
+        self.needed = needed
+        self.reason = reason
+        self.keep = [os.path.abspath(kept) for kept in keep]
+        self.size = 0
+        self.last_use = 0
+
+    def measure(self, seen):
+        """
+        Determines the disk usage and the last modification below the entry.
+        Files with several links are only counted for the first entry
+        measuring them, seen holds their devices and inodes.
+        """
+        self.size = 0
+        self.last_use = 0
+        for path in self._walk():
+            try:
+                info = os.lstat(path)
+            except OSError as e:
+                if e.errno != errno.ENOENT: raise
+                continue
+            self.last_use = max(self.last_use, info.st_mtime)
+            if info.st_nlink > 1 and not stat.S_ISDIR(info.st_mode):
+                if (info.st_dev, info.st_ino) in seen: continue
+                seen.add((info.st_dev, info.st_ino))
+            self.size += info.st_blocks * 512
+
+    def _walk(self):
+        """ Yields the paths below the entry, leaving out those to keep """
+        if not os.path.lexists(self.path): return
+        yield self.path
+        if os.path.islink(self.path) or not os.path.isdir(self.path): return
+        for directory, directories, files in os.walk(self.path):
+            for name in list(directories):
+                path = os.path.join(directory, name)
+                if path in self.keep: directories.remove(name)
+                elif os.path.islink(path): files.append(name)
+                else: yield path
+            for name in files:
+                path = os.path.join(directory, name)
+                if not path in self.keep: yield path
+
+    def remove(self):
+        """ Removes the entry, apart from the paths to keep below it """
+        if not os.path.lexists(self.path): return
+        if len(self.keep) == 0:
+            if os.path.isdir(self.path) and not os.path.islink(self.path):
+                shutil.rmtree(self.path)
+            else:
+                os.remove(self.path)
+            return
+        def prune(directory):
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                if path in self.keep: continue
+                if (any(_is_below(kept, path) for kept in self.keep) and
+                    not os.path.islink(path)):
+                    prune(path)
+                elif os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+        prune(self.path)
+
+
+def cache_entries(recon, builders):
+    """
+    Returns the entries of the cache of recon. The given builders decide
+    which of their trees, archives and artifacts current builds still need.
+    Everything unknown in the cache is kept.
+    """
+    cache_path = os.path.abspath(recon.get_cache_path())
+    distfiles = recon.get_distfiles()
+    store = recon.get_artifact_store()
+    entries = []
+    claimed = set()
+    def add(entry):
+        # Trees nested in one already added belong to that one
+        if any(_is_below(entry.path, path) for path in claimed): return
+        claimed.add(entry.path)
+        if os.path.lexists(entry.path): entries.append(entry)
+
+    needed_distfiles = set()
+    current_artifacts = set()
+    for builder in builders:
+        if not hasattr(builder, 'get_stale_reasons'): continue
+        library = builder.library_name()
+        needed_distfiles.update(builder.get_distfile_names())
+        up_to_date = len(builder.get_stale_reasons()) == 0
+        resumable = not up_to_date and builder.is_resumable()
+        if up_to_date: current_artifacts.add((library,
+                                              builder.get_fingerprint().digest()))
+        outputs = [os.path.abspath(path) for path in builder.get_artifact_paths()]
+        for arch in ['android', 'host']:
+            for path in [builder.get_build_path(arch),
+                         builder.get_include_path(arch)]:
+                path = os.path.abspath(path)
+                if not _is_below(path, cache_path): continue
+                if up_to_date: add(CacheEntry(path, 'build', library, True,
+                                              'current build'))
+                elif resumable: add(CacheEntry(path, 'build', library, True,
+                                               'resumable build'))
+                else: add(CacheEntry(path, 'build', library, False,
+                                     'stale build'))
+            add(CacheEntry(os.path.abspath(builder.get_object_path(arch)),
+                           'objects', library, False, 'incremental build tree'))
+            path = os.path.abspath(builder.get_source_path(arch))
+            if resumable:
+                add(CacheEntry(path, 'source', library, True, 'resumable build'))
+                continue
+            keep = []
+            if up_to_date:
+                keep = [output for output in outputs if _is_below(output, path)]
+            add(CacheEntry(path, 'source', library, False,
+                           'intermediate sources', keep))
+            entries.extend([CacheEntry(output, 'build', library, True,
+                                       'current build')
+                            for output in keep if os.path.lexists(output)])
+
+    toolchain_path = os.path.abspath(recon.get_toolchain_path())
+    add(CacheEntry(toolchain_path, 'toolchain', 'toolchain', True, 'toolchain'))
+
+    snapshots_path = recon.get_snapshots().get_path()
+    for library in _list(snapshots_path):
+        for key in _list(os.path.join(snapshots_path, library), False):
+            add(CacheEntry(os.path.join(snapshots_path, library, key),
+                           'snapshot', library, False, 'source snapshot'))
+    claimed.add(os.path.abspath(snapshots_path))
+
+    autotools_path = recon.get_autotools_cache().get_path()
+    for key in _list(autotools_path, False):
+        add(CacheEntry(os.path.join(autotools_path, key), 'autotools', '-',
+                       False, 'generated build system'))
+    claimed.add(os.path.abspath(autotools_path))
+
+    for library in _list(store.get_path()):
+        library_path = os.path.join(store.get_path(), library)
+        if not os.path.isdir(library_path): continue
+        for name in _list(library_path):
+            digest = name.split('.')[0]
+            if (library, digest) in current_artifacts:
+                add(CacheEntry(os.path.join(library_path, name), 'artifact',
+                               library, True, 'current artifact'))
+            else:
+                add(CacheEntry(os.path.join(library_path, name), 'artifact',
+                               library, False, 'old artifact'))
+    claimed.add(os.path.abspath(store.get_path()))
+
+    for name in _list(distfiles.get_path(), False):
+        path = distfiles.get_file_path(name)
+        if path == distfiles.get_manifest_path(): continue
+        if name in needed_distfiles:
+            add(CacheEntry(path, 'distfile', '-', True, 'current source archive'))
+        else:
+            add(CacheEntry(path, 'distfile', '-', False, 'stale source archive'))
+    claimed.add(os.path.abspath(distfiles.get_path()))
+
+    # The host python running qgsmg, along with the tarball and the tree it
+    # was built from by the qgsmg script
+    host_python_path = os.path.join(cache_path, 'hostpython')
+    archives = _list(distfiles.get_path())
+    leftovers = []
+    for name in _list(host_python_path):
+        path = os.path.join(host_python_path, name)
+        if name.startswith('Python-') and os.path.isdir(path):
+            leftovers.append(CacheEntry(path, 'hostpython', 'hostpython', False,
+                                        'host python sources'))
+        elif re.search(r'\.(tgz|tar\.\w+)$', name):
+            if name in archives:
+                leftovers.append(CacheEntry(path, 'hostpython', 'hostpython',
+                                            False, 'copied to the distfiles'))
+            else:
+                leftovers.append(CacheEntry(path, 'hostpython', 'hostpython',
+                                            True, 'only copy of the archive'))
+    add(CacheEntry(host_python_path, 'hostpython', 'hostpython', True,
+                   'runs qgsmg', [leftover.path for leftover in leftovers]))
+    entries.extend(leftovers)
+
+    # Trees of builders which no longer exist, or moved elsewhere
+    for directory in _builder_directories:
+        for name in _list(os.path.join(cache_path, directory)):
+            path = os.path.join(cache_path, directory, name)
+            if not path in claimed:
+                add(CacheEntry(path, 'orphan', '-', False, 'no builder'))
+
+    for name in _list(cache_path):
+        path = os.path.join(cache_path, name)
+        if path in claimed or name in _builder_directories: continue
+        if name in ['ccache', 'logs', 'traces', 'config_cache']:
+            add(CacheEntry(path, name, '-', True, 'kept by qgsmg'))
+        elif name.startswith('.'):
+            add(CacheEntry(path, 'records', '-', True, 'build records'))
+        else:
+            add(CacheEntry(path, 'other', '-', True, 'unknown'))
+
+    # Needed entries are measured first, so files they share with others
+    # count for them
+    seen = set()
+    for entry in sorted(entries, key=lambda entry: not entry.needed):
+        entry.measure(seen)
+    return entries
+
+def _list(path, hidden=True):
+    if not os.path.isdir(path): return []
+    return sorted([name for name in os.listdir(path)
+                   if hidden or not name.startswith('.')])
+
+def collect(entries, budget):
+    """
+    Returns the entries to remove to get the total size of entries down to
+    budget, the least recently used first. Needed entries are never removed.
+    """
+    total = sum(entry.size for entry in entries)
+    candidates = sorted([entry for entry in entries if not entry.needed],
+                        key=lambda entry: entry.last_use)
+    garbage = []
+    for entry in candidates:
+        if total <= budget: break
+        garbage.append(entry)
+        total -= entry.size
+    return garbage
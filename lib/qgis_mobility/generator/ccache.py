@@ -0,0 +1,118 @@
+#
+#  This file is part of QGis Mobility
+#
+#  QGis Mobility is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  QGis Mobility is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with QGis Mobility. If not, see
+#  <http://www.gnu.org/licenses/>.
+#
+
+import os
+import errno
+from distutils.spawn import find_executable
+
+
+class CompilerCache(object):
+    """
+    Wraps the compilers of all builds with ccache. The cache lives in the
+    cache path, so rebuilds after a clean only compile what really changed.
+    """
+
+    def __init__(self, path, base_path, max_size, enabled=True):
+        self._path = os.path.abspath(path)
+        self._base_path = os.path.abspath(base_path)
+        self._max_size = max_size
+        self._executable = find_executable('ccache')
+        self._enabled = enabled and self._executable != None
+
+    def is_enabled(self):
+        """ Returns True if compilers are wrapped with ccache """
+        return self._enabled
+
+    def get_path(self):
+        """ Returns the directory ccache stores its objects in """
+        return self._path
+
+    def get_max_size(self):
+        """ Returns the size limit of the cache, in ccache notation """
+        return self._max_size
+
+    def wrap(self, command):
+        """ Returns the compiler command prefixed with ccache, if enabled """
+        if not self._enabled: return command
+        return ' '.join([self._executable, command])
+
+    def unwrap(self, command):
+        """ Returns the compiler command without the ccache prefix """
+        if self._executable != None and command.startswith(self._executable + ' '):
+            return command[len(self._executable) + 1:]
+        return command
+
+    def get_launcher(self):
+        """ Returns the ccache executable for use as a compiler launcher """
+        return self._executable
+
+    def get_statistics_log(self, library):
+        """ Returns the log ccache records the results of a builder in """
+        return os.path.join(self._path, 'stats', library + '.log')
+
+    def reset_statistics(self, library):
+        """ Forgets the results recorded for the builder of library """
+        log_path = self.get_statistics_log(library)
+        if os.path.exists(log_path): os.remove(log_path)
+
+    def environment(self, env, library):
+        """
+        Returns a copy of env configuring ccache for the builder of library
+        """
+        env = dict(env)
+        if not self._enabled: return env
+        try:
+            os.makedirs(os.path.join(self._path, 'stats'))
+        except OSError as e:
+            if e.errno != errno.EEXIST: raise
+        env['CCACHE_DIR'] = self._path
+        env['CCACHE_MAXSIZE'] = self._max_size
+        env['CCACHE_STATSLOG'] = self.get_statistics_log(library)
+        # Sources are unpacked below the base path, rewriting it to relative
+        # paths lets rebuilds from a fresh unpack hit the cache
+        env['CCACHE_BASEDIR'] = self._base_path
+        return env
+
+    def statistics(self, library):
+        """
+        Returns the hits and misses of the builder of library as a tuple, or
+        None if ccache recorded nothing (ccache before 4.0 has no statistics
+        log)
+        """
+        log_path = self.get_statistics_log(library)
+        if not os.path.exists(log_path): return None
+        hits = 0
+        misses = 0
+        with open(log_path) as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith('#'): continue
+                if line.endswith('_cache_hit'): hits += 1
+                elif line == 'cache_miss': misses += 1
+        return (hits, misses)
+
+    def report(self, library):
+        """ Returns a line describing the cache results of a builder """
+        if not self._enabled: return "Compiler cache: disabled"
+        statistics = self.statistics(library)
+        if statistics == None: return "Compiler cache: hit rate unavailable"
+        hits, misses = statistics
+        rate = 0.0
+        if hits + misses > 0: rate = 100.0 * hits / (hits + misses)
+        return "Compiler cache: %d hits, %d misses (%.1f%% hit rate)" % (
+            hits, misses, rate)
@@ -0,0 +1,97 @@
+#
+#  This file is part of QGis Mobility
+#
+#  QGis Mobility is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  QGis Mobility is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with QGis Mobility. If not, see
+#  <http://www.gnu.org/licenses/>.
+#
+
+import os
+import re
+
+from qgis_mobility.generator import locking
+
+# Results which depend on the flags of the individual builder: the precious
+# variables configure compares against the last run, and the library checks,
+# which depend on the -L flags pointing at the other builders' outputs
+_private_prefixes = ['ac_cv_env_', 'ac_cv_lib_', 'ac_cv_search_']
+
+# A cache variable assignment as written by configure
+_assignment = re.compile(r'^([A-Za-z_][A-Za-z0-9_]*)=')
+
+
+def read_entries(path):
+    """ Returns the cache variable assignments in the file at path by name """
+    entries = {}
+    if not os.path.exists(path): return entries
+    with open(path) as f:
+        for line in f:
+            match = _assignment.match(line)
+            if match != None: entries[match.group(1)] = line.rstrip('\n')
+    return entries
+
+def shareable(name):
+    """ Returns False for results which must not be shared by builders """
+    return not any(name.startswith(prefix) for prefix in _private_prefixes)
+
+def _write_entries(path, entries):
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as f:
+        f.write("# Shared configure results, written by qgsmg\n")
+        for name in sorted(entries.keys()): f.write(entries[name] + '\n')
+    os.rename(temporary, path)
+
+
+class ConfigCache(object):
+    """
+    Shares the results of autoconf configure checks between the builders of
+    one architecture and toolchain. Every configure run gets a private copy
+    of the shared results, its new results are merged back afterwards.
+    """
+
+    def __init__(self, path, enabled=False):
+        self._path = os.path.abspath(path)
+        self._enabled = enabled
+
+    def is_enabled(self):
+        """ Returns True if configure results are shared """
+        return self._enabled
+
+    def get_path(self):
+        """ Returns the directory of the shared cache files """
+        return self._path
+
+    def get_cache_file(self, arch, key):
+        """ Returns the shared cache file for arch and the toolchain key """
+        return os.path.join(self._path, "%s-%s.cache" % (arch, key[:16]))
+
+    def _lock_for(self, cache_file):
+        """ Returns the lock on a shared cache file, shared with other runs """
+        return locking.lock_for(cache_file + '.lock')
+
+    def checkout(self, arch, key, private_path):
+        """ Writes the shared results for arch and key to private_path """
+        cache_file = self.get_cache_file(arch, key)
+        with self._lock_for(cache_file):
+            entries = read_entries(cache_file)
+        _write_entries(private_path, entries)
+
+    def merge(self, arch, key, private_path):
+        """ Adds the shareable results in private_path to the shared ones """
+        private = read_entries(private_path)
+        cache_file = self.get_cache_file(arch, key)
+        with self._lock_for(cache_file):
+            entries = read_entries(cache_file)
+            for name in private.keys():
+                if shareable(name): entries[name] = private[name]
+            _write_entries(cache_file, entries)
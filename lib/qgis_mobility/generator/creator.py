@@ -41,6 +41,8 @@ from qgis_mobility.generator.sip_builder import SipBuilder
 from qgis_mobility.generator.pyqt_builder import PyQtBuilder
 from qgis_mobility.generator.pyqtmobility_builder import PyQtMobilityBuilder
 from qgis_mobility.generator.runtime_builder import RuntimeBuilder
+from qgis_mobility.generator import rewrite
+from qgis_mobility.generator.rewrite import Substitute
         
 import xml.etree.ElementTree as ET
 
@@ -319,9 +321,9 @@ class Creator(object):
         """
         self.__setup(path)
         
-        lib_path = PythonBuilder(self._recon).get_build_path()
-        qgis_path = QGisBuilder(self._recon).get_build_path()
-        runtime_path = RuntimeBuilder(self._recon).get_build_path()
+        lib_path = self._recon.get_builders().get(PythonBuilder).get_build_path()
+        qgis_path = self._recon.get_builders().get(QGisBuilder).get_build_path()
+        runtime_path = self._recon.get_builders().get(RuntimeBuilder).get_build_path()
         qgis_lib_path = os.path.join(qgis_path, 'files', 'share', 'python')
         qgsmsystem_path = os.path.join(runtime_path, 'lib', 'qgis-mobility', 'qgsmsystem')
         resources_path = os.path.join(qgis_path, 'files', 'share', 'resources')
@@ -347,7 +349,7 @@ class Creator(object):
             print("Storing {0}\n    --> [{2}] {1}".format(filename, name, python_zip))
             zf.write(filename, name)
         name = os.path.sep + os.path.join('lib', 'libpython2.7.so')
-        filename = os.path.join(PythonBuilder(self._recon).get_source_path(), 'libpython2.7.so')
+        filename = os.path.join(self._recon.get_builders().get(PythonBuilder).get_source_path(), 'libpython2.7.so')
         zf.write(filename, name)
         zf.writestr('timestamp', str(time.time()))
         zf.close()
@@ -421,15 +423,9 @@ class Creator(object):
         qt_activity_file_name = os.path.join(android_out, 'src', 'org', 'kde',
                                              'necessitas', 'origo', 'QtActivity.java')
         
-        args = ['sed']
-        args.extend(['-i', 
-                     "s/@R@/%s.R/" % self.host_config.package_name(),
-                     qt_activity_file_name])
-        process = Popen(args)
-        process.communicate(None)
-        if not process.returncode == 0:
-            raise ValueError("Failed Process: " + args[0])
-        print "Sed finished with:", path
+        rewrite.rewrite(qt_activity_file_name,
+                        [Substitute(r'@R@', '%s.R' % self.host_config.package_name())])
+        print "Rewrote:", qt_activity_file_name
 
         
     def __run_ant(self, command):
@@ -0,0 +1,213 @@
+#
+#  This file is part of QGis Mobility
+#
+#  QGis Mobility is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  QGis Mobility is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with QGis Mobility. If not, see
+#  <http://www.gnu.org/licenses/>.
+#
+
+import os
+import time
+import errno
+import urllib
+import urlparse
+
+from qgis_mobility.generator.fingerprint import hash_file
+from qgis_mobility.generator.placement import place_file
+from qgis_mobility.generator import locking
+
+
+class Distfiles(object):
+    """
+    A persistent cache of the downloaded source archives, shared by all
+    builders. Every file is verified against its SHA-256 checksum, which is
+    either declared by the builder or recorded in the SHA256SUMS manifest on
+    the first download. Files are looked up on the mirrors first, then at
+    their original location. In offline mode, only the cache and file://
+    mirrors are used. Every location is tried retries times, an interrupted
+    download is resumed where it stopped.
+    """
+
+    def __init__(self, path, mirrors=[], offline=False, retries=3):
+        self._path = os.path.abspath(path)
+        self._mirrors = list(mirrors)
+        self._offline = offline
+        self._retries = max(1, retries)
+
+    def get_path(self):
+        """ Returns the directory of the cache """
+        return self._path
+
+    def get_mirrors(self):
+        """ Returns the mirror URLs searched before the original location """
+        return self._mirrors
+
+    def is_offline(self):
+        """ Returns True if the network must not be used """
+        return self._offline
+
+    def get_name(self, url):
+        """
+        Returns the file name for the given url. For URLs ending in
+        /download, as used by SourceForge, the component before is taken.
+        """
+        parts = [part for part in urlparse.urlparse(url).path.split('/')
+                 if len(part) > 0]
+        if len(parts) > 1 and parts[-1] == 'download': return parts[-2]
+        return parts[-1]
+
+    def get_file_path(self, name):
+        """ Returns the path of the file with the given name in the cache """
+        return os.path.join(self._path, name)
+
+    def get_manifest_path(self):
+        """ Returns the path of the checksum manifest """
+        return os.path.join(self._path, 'SHA256SUMS')
+
+    def get_checksums(self):
+        """ Returns a dictionary mapping file names to recorded checksums """
+        checksums = {}
+        manifest_path = self.get_manifest_path()
+        if not os.path.exists(manifest_path): return checksums
+        with open(manifest_path) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 2: checksums[parts[1]] = parts[0]
+        return checksums
+
+    def _record_checksum(self, name, checksum):
+        """ Adds a checksum to the manifest, called with its lock held """
+        checksums = self.get_checksums()
+        checksums[name] = checksum
+        temporary = self.get_manifest_path() + '.tmp'
+        with open(temporary, 'w') as f:
+            for entry in sorted(checksums.keys()):
+                f.write("%s  %s\n" % (checksums[entry], entry))
+        os.rename(temporary, self.get_manifest_path())
+
+    def verify(self, name, path, sha256=None):
+        """
+        Verifies the file at path against the declared checksum, or the one
+        recorded in the manifest. Files without any known checksum get their
+        checksum recorded.
+        """
+        checksum = hash_file(path)
+        with locking.lock_for(os.path.join(self._path, '.SHA256SUMS.lock')):
+            recorded = self.get_checksums().get(name)
+            expected = sha256 or recorded
+            if recorded == None and expected in [None, checksum]:
+                self._record_checksum(name, checksum)
+        if expected != None and expected != checksum:
+            raise ValueError("Checksum mismatch for %s: expected %s, got %s" %
+                             (name, expected, checksum))
+
+    def _lock_for(self, name):
+        """ Returns the lock on the file with name, shared with other runs """
+        return locking.lock_for(os.path.join(self._path, '.' + name + '.lock'),
+                                name)
+
+    def _makedirs(self):
+        try:
+            os.makedirs(self._path)
+        except OSError as e:
+            if e.errno != errno.EEXIST: raise
+
+    def _candidates(self, name):
+        """ Returns the mirror URLs to try for the file with name """
+        candidates = []
+        for mirror in self._mirrors:
+            if self._offline and not mirror.startswith('file://'): continue
+            candidates.append(mirror.rstrip('/') + '/' + urllib.quote(name))
+        return candidates
+
+    def _retrieve(self, url, partial_path, run):
+        """ Retrieves url into partial_path, returns False on failure """
+        if url.startswith('file://'):
+            local_path = urllib.url2pathname(urlparse.urlparse(url).path)
+            if not os.path.exists(local_path): return False
+            place_file(local_path, partial_path)
+            return True
+        for attempt in range(self._retries):
+            if attempt > 0:
+                print "Retrying download (%d of %d): %s" % (
+                    attempt + 1, self._retries, url)
+                time.sleep(min(2 ** attempt, 30))
+            size = 0
+            if os.path.exists(partial_path):
+                size = os.path.getsize(partial_path)
+            try:
+                # -c resumes a partial file left by an interrupted download,
+                # the retries are made here so the resumption is visible
+                run(['wget', '-c', '-t', '1', '-T', '60', '-O', partial_path, url])
+                return True
+            except ValueError:
+                # A server without range requests refuses to resume, the
+                # next attempt starts over
+                if (os.path.exists(partial_path) and
+                    os.path.getsize(partial_path) == size):
+                    os.remove(partial_path)
+        return False
+
+    def adopt(self, name, path, sha256=None):
+        """ Links or copies an already downloaded file into the cache """
+        with self._lock_for(name):
+            file_path = self.get_file_path(name)
+            if os.path.exists(file_path): return file_path
+            self._makedirs()
+            place_file(path, file_path + '.part')
+            self.verify(name, file_path + '.part', sha256)
+            os.rename(file_path + '.part', file_path)
+            return file_path
+
+    def fetch(self, url, run, name=None, sha256=None, create=None):
+        """
+        Returns the path of the file for url in the cache, downloading it if
+        needed. The run callable runs the download process and raises
+        ValueError on failure. If create is given, it is called with the
+        path to write the file to instead of downloading url.
+        """
+        if name == None: name = self.get_name(url)
+        with self._lock_for(name):
+            file_path = self.get_file_path(name)
+            if os.path.exists(file_path):
+                self.verify(name, file_path, sha256)
+                # Touching the file keeps track of its last use
+                os.utime(file_path, None)
+                print "Found in distfiles:", file_path
+                return file_path
+
+            self._makedirs()
+            partial_path = file_path + '.part'
+            retrieved = False
+            for candidate in self._candidates(name):
+                print "Trying mirror:", candidate
+                if self._retrieve(candidate, partial_path, run):
+                    retrieved = True
+                    break
+            if not retrieved and self._offline:
+                raise EnvironmentError(
+                    "Offline mode: %s is neither in the distfiles cache %s "
+                    "nor on a file:// mirror" % (name, self._path))
+            if not retrieved:
+                if create != None:
+                    create(partial_path)
+                elif not self._retrieve(url, partial_path, run):
+                    raise ValueError("Could not download: " + url)
+            try:
+                self.verify(name, partial_path, sha256)
+            except ValueError:
+                os.remove(partial_path)
+                raise
+            os.rename(partial_path, file_path)
+            print "Stored in distfiles:", file_path
+            return file_path
@@ -20,7 +20,8 @@ import os       # Used for checking existance of the cache path
 import urllib2  # Used for downloading the zip file pointed to by the url
 import tempfile # Used to generate a temporary file for the contents of the zip
                 # file aforementioned.
-import tarfile  # For extracting the archive downloaded from the HTTP channel
+from qgis_mobility.generator import archive # For extracting the archive
+                                             # downloaded from the HTTP channel
 
 from sys import stdout      # The stdout is used to directly write progress 
                             # dots on the terminal
@@ -70,12 +71,9 @@ class Download(object):
                         tgz.flush()
                         break
             
-                # Reset the file read position of the temporary file containing
-                # the tgz data earlier stored
-                tgz.seek(0)
-
-                # Open the tmp_file object as a TgzFile
-                print "Extracting to ", cache_path
-                zf = tarfile.open(name=None, mode="r", fileobj=tgz)
-                counter = 0
-                zf.extractall(cache_path)
+            # Extract the archive earlier stored in the temporary file
+            print "Extracting to ", cache_path
+            try:
+                archive.extract(tmp_file.name, cache_path)
+            finally:
+                os.remove(tmp_file.name)
@@ -17,7 +17,7 @@
 #
 
 from qgis_mobility.generator.builder import Builder
-import distutils.dir_util
+from qgis_mobility.generator.rewrite import Substitute
 import os
 
 class ExpatBuilder(Builder):
@@ -31,19 +31,31 @@ class ExpatBuilder(Builder):
         """ Returns the human readable name of the Expat Builder """
         return 'Expat Build Process'    
 
-    def do_build(self):
-        """ Runs the actual build process """
-        output = self.wget('http://freefr.dl.sourceforge.net/project/expat/expat/2.0.1/expat-2.0.1.tar.gz')
-        self.unpack(output)
-        self.push_current_source_path(os.path.join(self.get_source_path(), self.library_name()))
+    def get_sources(self):
+        """ Returns the URLs of the sources """
+        return ['http://freefr.dl.sourceforge.net/project/expat/expat/2.0.1/expat-2.0.1.tar.gz']
+
+    def prepare_tree(self):
+        """ Prepares the unpacked sources """
         self.push_current_source_path(os.path.join(self.get_current_source_path(), 'conftools'))
         self.fix_config_sub_and_guess()
         self.pop_current_source_path()
         self.patch('expat.patch', strip=1)
-        self.sed_ir('s/(hardcode_into_libs)=.*$/\\1=no/', 'configure')
+        self.rewrite('configure', [Substitute(r'(hardcode_into_libs)=.*$', r'\1=no')])
+
+    def do_prepare(self):
+        """ Prepares the sources ahead of the build """
+        self.prepare_snapshots(self.fetch(self.get_sources()[0]),
+                               self.library_name(), self.prepare_tree)
+
+    def do_build(self):
+        """ Runs the actual build process """
+        output = self.fetch(self.get_sources()[0])
+        self.push_current_source_path(self.prepare_source(output, self.library_name(),
+                                                          self.prepare_tree))
         self.run_autotools_and_make()        
-        distutils.dir_util.copy_tree(os.path.join(self.get_build_path(), 'include'),
-                                     os.path.join(self.get_include_path()))
+        self.copy_tree(os.path.join(self.get_build_path(), 'include'),
+                       os.path.join(self.get_include_path()))
         
         self.mark_finished()
 
@@ -0,0 +1,258 @@
+#
+#  This file is part of QGis Mobility
+#
+#  QGis Mobility is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  QGis Mobility is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with QGis Mobility. If not, see
+#  <http://www.gnu.org/licenses/>.
+#
+
+import os
+import ast
+import json
+import hashlib
+import inspect
+import threading
+
+
+def hash_file(path, algorithm='sha256'):
+    """ Returns the hex digest of the contents of the file at path """
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(1024 * 1024)
+            if len(chunk) == 0: break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def hash_tree(path):
+    """
+    Returns a digest over the names and contents of all files below path.
+    Symbolic links are hashed by their target, not followed.
+    """
+    digest = hashlib.sha256()
+    if not os.path.exists(path): return digest.hexdigest()
+    if not os.path.isdir(path):
+        digest.update(hash_file(path))
+        return digest.hexdigest()
+    for root, dirnames, filenames in os.walk(path):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            full_path = os.path.join(root, filename)
+            digest.update(os.path.relpath(full_path, path) + '\0')
+            if os.path.islink(full_path):
+                digest.update('link:' + os.readlink(full_path))
+            else:
+                digest.update(hash_file(full_path))
+            digest.update('\0')
+    return digest.hexdigest()
+
+# The digests of hash_code by the real path, modification time and size of
+# the modules, every builder hashes the modules of its class hierarchy
+_code_digests = {}
+_code_digests_lock = threading.Lock()
+
+def hash_code(path):
+    """
+    Returns a digest of the code of the Python module at path. Comments,
+    docstrings and formatting do not change it, every other edit does.
+    The digest is computed once per version of the file.
+    """
+    st = os.stat(path)
+    key = (os.path.realpath(path), st.st_mtime, st.st_size)
+    with _code_digests_lock:
+        if not key in _code_digests: _code_digests[key] = _hash_code(path)
+        return _code_digests[key]
+
+def _hash_code(path):
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+    for node in ast.walk(tree):
+        if not isinstance(node, (ast.Module, ast.ClassDef, ast.FunctionDef)):
+            continue
+        if (len(node.body) > 0 and isinstance(node.body[0], ast.Expr) and
+            isinstance(node.body[0].value, ast.Str)):
+            node.body = node.body[1:] or [ast.Pass()]
+    return hashlib.sha256(ast.dump(tree)).hexdigest()
+
+def hash_value(value):
+    """ Returns a digest of any json serializable value """
+    return hashlib.sha256(json.dumps(value, sort_keys=True)).hexdigest()
+
+
+class Fingerprint(object):
+    """
+    The fingerprint of a builder is a hash over all of its inputs: the library
+    version, its sources, patches, build script, flags, the toolchain and the
+    fingerprints of its dependencies. A build whose recorded fingerprint
+    differs from the current one is stale.
+    """
+
+    def __init__(self, builder):
+        self._builder = builder
+        self._components = None
+
+    def _library_component(self):
+        builder = self._builder
+        return hash_value([builder.__class__.__name__, builder.library_name()])
+
+    def _sources_component(self):
+        builder = self._builder
+        parts = list(builder.get_sources())
+        checksums = builder.get_source_checksums()
+        for url in builder.get_sources():
+            if url in checksums: parts.append(checksums[url])
+        for path in builder.get_local_sources():
+            parts.append(hash_tree(path))
+        return hash_value(parts)
+
+    def _patches_component(self):
+        builder = self._builder
+        parts = []
+        for path in builder.get_patch_files():
+            parts.append([os.path.basename(path), hash_tree(path)])
+        return hash_value(parts)
+
+    def _script_component(self):
+        """
+        Hashes the code of the modules defining the build strategy of the
+        builder, builder.py with the generic machinery included. Any change
+        to the code of these modules invalidates the builds using them, even
+        one which does not alter the output; edits to comments and
+        docstrings do not.
+        """
+        from qgis_mobility.generator.builder import Builder
+        parts = []
+        for cls in inspect.getmro(self._builder.__class__):
+            if not issubclass(cls, Builder): continue
+            path = inspect.getsourcefile(cls)
+            if path != None: parts.append([cls.__name__, hash_code(path)])
+        return hash_value(parts)
+
+    def _flags_component(self):
+        """
+        Hashes the flags of every architecture. They hold absolute paths
+        into the cache, which the built libraries embed as well, so builds
+        in caches at different paths never share a fingerprint.
+        """
+        builder = self._builder
+        parts = {}
+        # The compiler cache does not alter the build output
+        compiler_cache = builder.get_compiler_cache()
+        for arch in builder.get_arches():
+            probe = builder.get_builder(builder.__class__, arch)
+            mappings = probe.get_default_toolchain_mappings()
+            for name in mappings.keys():
+                unwrapped = compiler_cache.unwrap(mappings[name])
+                # Host compilers are only named to hook in the cache
+                if arch == 'host' and unwrapped != mappings[name]:
+                    del mappings[name]
+                else:
+                    mappings[name] = unwrapped
+            parts[arch] = [probe.get_flags(),
+                           probe.get_default_configure_flags(),
+                           mappings]
+        return hash_value(parts)
+
+    def _toolchain_component(self):
+        recon = self._builder.get_recon()
+        ndk_path = os.path.realpath(recon.get_ndk_path())
+        release = os.path.join(ndk_path, 'RELEASE.TXT')
+        parts = [ndk_path,
+                 hash_tree(release),
+                 recon.get_android_level(),
+                 os.path.realpath(recon.get_qt_path()),
+                 recon.get_qt_version_triplet(),
+                 self._builder.get_toolchain_prefix()]
+        return hash_value(parts)
+
+    def components(self):
+        """ Returns a dictionary with the digest of every input """
+        if self._components == None:
+            builder = self._builder
+            components = {
+                'library'   : self._library_component(),
+                'sources'   : self._sources_component(),
+                'patches'   : self._patches_component(),
+                'script'    : self._script_component(),
+                'flags'     : self._flags_component(),
+                'toolchain' : self._toolchain_component() }
+            for dependency in builder.dependencies():
+                instance = builder.get_recon().get_builders().get(dependency)
+                if not hasattr(instance, 'get_fingerprint'): continue
+                name = 'dependency:' + instance.library_name()
+                components[name] = instance.get_fingerprint().digest()
+            self._components = components
+        return self._components
+
+    def source_digest(self):
+        """
+        Returns the digest over the inputs which determine the prepared
+        sources: the library, its sources, patches and build script
+        """
+        components = self.components()
+        return hash_value([components[name] for name in
+                           ['library', 'sources', 'patches', 'script']])
+
+    def digest(self):
+        """ Returns the digest over all inputs """
+        return hash_value(self.components())
+
+    def record(self):
+        """ Returns the completion record to store for this fingerprint """
+        return { 'library'     : self._builder.library_name(),
+                 'fingerprint' : self.digest(),
+                 'components'  : self.components() }
+
+    def stale_reasons(self, record):
+        """
+        Returns why a build with the given completion record is stale, an
+        empty list means the build is up to date
+        """
+        if record == None: return ['not built yet']
+        if not 'fingerprint' in record:
+            return ['completion marker predates fingerprints']
+        if record['fingerprint'] == self.digest(): return []
+        recorded = record.get('components', {})
+        current = self.components()
+        reasons = []
+        for name in sorted(set(recorded.keys()) | set(current.keys())):
+            if recorded.get(name) == current.get(name): continue
+            if name.startswith('dependency:'):
+                if not name in current: reasons.append('dropped ' + name)
+                elif not name in recorded: reasons.append('new ' + name)
+                else: reasons.append(name + ' changed')
+            else:
+                reasons.append(name + ' changed')
+        if len(reasons) == 0: reasons.append('fingerprint changed')
+        return reasons
+
+
+def read_record(path):
+    """
+    Reads a completion record. Returns None if there is none, and an empty
+    record for the empty marker files of older versions.
+    """
+    if not os.path.exists(path): return None
+    with open(path) as f:
+        contents = f.read()
+    try:
+        return json.loads(contents)
+    except ValueError:
+        return {}
+
+def write_record(path, record):
+    """ Atomically writes a completion record """
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(record, f, sort_keys=True, indent=2)
+    os.rename(temporary, path)
@@ -17,7 +17,6 @@
 #
 
 from qgis_mobility.generator.builder import Builder
-import distutils.dir_util
 import os
 
 class GDALBuilder(Builder):
@@ -31,6 +30,10 @@ class GDALBuilder(Builder):
         """ Returns the human readable name of the GDAL Builder """
         return 'GDAL Build Process'    
 
+    def get_sources(self):
+        """ Returns the URLs of the sources """
+        return ['http://download.osgeo.org/gdal/' + self.library_name() + '.tar.gz']
+
     def get_default_flags(self):
         flags = Builder.get_default_flags(self)
         flags['LIBS'] = '-lsupc++ -lstdc++'
@@ -40,19 +43,31 @@ class GDALBuilder(Builder):
         flags = Builder.get_default_configure_flags(self)
         flags.extend(['--without-grib'])
         return flags
+
+    def uses_config_cache(self):
+        """ LIBS=-lsupc++ alters the results of the checks GDAL shares """
+        return False
     
 
-    def do_build(self):
-        """ Runs the actual build process """
-        output = self.wget('http://download.osgeo.org/gdal/' + self.library_name() + '.tar.gz')
-        self.unpack(output)
-        self.push_current_source_path(os.path.join(self.get_source_path(), self.library_name()))
+    def prepare_tree(self):
+        """ Prepares the unpacked sources """
         self.fix_config_sub_and_guess()
         self.patch('android.diff', strip=0)
         self.patch('gdal.patch', strip=1)
+
+    def do_prepare(self):
+        """ Prepares the sources ahead of the build """
+        self.prepare_snapshots(self.fetch(self.get_sources()[0]),
+                               self.library_name(), self.prepare_tree)
+
+    def do_build(self):
+        """ Runs the actual build process """
+        output = self.fetch(self.get_sources()[0])
+        self.push_current_source_path(self.prepare_source(output, self.library_name(),
+                                                          self.prepare_tree))
         self.run_autotools_and_make(harness=False)        
-        distutils.dir_util.copy_tree(os.path.join(self.get_build_path(), 'include'),
-                                     os.path.join(self.get_include_path()))
+        self.copy_tree(os.path.join(self.get_build_path(), 'include'),
+                       os.path.join(self.get_include_path()))
         
         self.mark_finished()
 
@@ -17,7 +17,7 @@
 #
 
 from qgis_mobility.generator.builder import Builder
-import distutils.dir_util
+from qgis_mobility.generator.rewrite import Substitute
 import os
 import shutil
 
@@ -32,6 +32,18 @@ class GeosBuilder(Builder):
         """ Returns the human readable name of the GeosBuilder """
         return 'Geos Build Process'
 
+    def get_sources(self):
+        """ Returns the URLs of the sources """
+        return ['http://svn.osgeo.org/geos/tags/3.2.3']
+
+    def get_distfile_names(self):
+        """ The sources are an export of the svn tag """
+        return ['geos-3.2.3.tar.gz']
+
+    def get_arches(self):
+        """ The library is needed on the host as well as on the target """
+        return ['host', 'android']
+
     def sixty_four(self):
         f = open(os.path.join(self.get_current_source_path(), 'sixty_four.h'), 'w+')
         f.write('#define uint64_t unsigned long long\n')
@@ -39,13 +51,16 @@ class GeosBuilder(Builder):
         f.close()
 
     def get_default_flags(self):
-        """ Modify the flags to add the sixty_four business """
+        """
+        Modify the flags to add the sixty_four business, the header is in
+        the tree do_build_for builds, whatever the current source path is
+        """
         flags = Builder.get_default_flags(self)
         if not (self.get_current_arch() == 'host'):
-            flags['CFLAGS'] += ' -imacros ' + os.path.join(
-                self.get_current_source_path(), 'sixty_four.h')
-            flags['CXXFLAGS'] += ' -imacros ' + os.path.join(
-                self.get_current_source_path(), 'sixty_four.h')
+            sixty_four = os.path.join(self.get_source_path(), 'geos-3.2.3',
+                                      'sixty_four.h')
+            flags['CFLAGS'] += ' -imacros ' + sixty_four
+            flags['CXXFLAGS'] += ' -imacros ' + sixty_four
         flags['LIBS'] = '-lsupc++ -lstdc++'
         return flags
     
@@ -80,32 +95,48 @@ class GeosBuilder(Builder):
         self.patch('int64_crosscomp.patch', strip=1)
         self.do_patches()
         self.sixty_four()
-        self.sed_i('s/hardcode_into_libs=.*/hardcode_into_libs=no/g', 'configure')
-        self.sed_ir('s/(\-release \@VERSION_MAJOR\@\.\@VERSION_MINOR\@\.@VERSION_PATCH\@ \\\)/\-avoid\-version \\\/g', 'source/Makefile.am')
-        self.sed_ir('s/(\-version\-info \@CAPI_INTERFACE_CURRENT\@\:\@CAPI_INTERFACE_REVISION\@\:\@CAPI_INTERFACE_AGE\@ \\\)/-avoid\-version \\\/g', 'capi/Makefile.am')
+        self.rewrite_files([
+            ('configure',
+             [Substitute(r'hardcode_into_libs=.*', 'hardcode_into_libs=no', every=True)]),
+            ('source/Makefile.am',
+             [Substitute(r'(-release @VERSION_MAJOR@\.@VERSION_MINOR@\.@VERSION_PATCH@ \\)',
+                         r'-avoid-version \\', every=True)]),
+            ('capi/Makefile.am',
+             [Substitute(r'(-version-info @CAPI_INTERFACE_CURRENT@:@CAPI_INTERFACE_REVISION@:@CAPI_INTERFACE_AGE@ \\)',
+                         r'-avoid-version \\', every=True)])])
         
-    def do_build_for(self, arch):
-        self.set_current_arch(arch)
-        host = (arch == 'host')
-        self.run_svn_checkout('http://svn.osgeo.org/geos/tags/3.2.3', 'geos-3.2.3')
-        base_source_path = os.path.join(self.get_source_path(), 'geos-3.2.3')
-        self.push_current_source_path(base_source_path)
+    def prepare_tree(self):
+        """ Prepares the unpacked sources for the current architecture """
         self.run_autogen()
-        if host:
+        if self.get_current_arch() == 'host':
             self.do_patches()
         else:
             self.do_android()
         self.fix_config_sub_and_guess()
+
+    def fetch_sources(self):
+        """ The sources are an export of the svn tag """
+        return [self.fetch_svn_snapshot(self.get_sources()[0], 'geos-3.2.3')]
+
+    def do_prepare(self):
+        """ Prepares the sources ahead of the build """
+        self.prepare_snapshots(self.fetch_sources()[0], 'geos-3.2.3',
+                               self.prepare_tree)
+
+    def do_build_for(self, arch, output):
+        self.set_current_arch(arch)
+        base_source_path = self.prepare_source(output, 'geos-3.2.3', self.prepare_tree)
+        self.push_current_source_path(base_source_path)
         self.run_autotools_and_make() 
-        distutils.dir_util.copy_tree(os.path.join(self.get_build_path(), 'include'),
-                                     os.path.join(self.get_include_path()))
+        self.copy_tree(os.path.join(self.get_build_path(), 'include'),
+                       os.path.join(self.get_include_path()))
         self.pop_current_source_path()
         shutil.rmtree(base_source_path)
 
 
     def do_build(self):
         """ Runs the actual build process """
-        self.do_build_for('host')
-        self.do_build_for('android')
+        output = self.fetch_sources()[0]
+        self.do_build_for_arches(output)
 
         self.mark_finished()
@@ -0,0 +1,174 @@
+#
+#  This file is part of QGis Mobility
+#
+#  QGis Mobility is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  QGis Mobility is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with QGis Mobility. If not, see
+#  <http://www.gnu.org/licenses/>.
+#
+
+import os
+import time
+import errno
+import select
+import threading
+from contextlib import contextmanager
+
+# The seconds a lease waits for all of its slots
+_lease_timeout = 30
+
+
+class Jobserver(object):
+    """
+    Acts as a GNU make jobserver for the whole qgsmg run. The pipe holds one
+    token less than the job budget, the remaining implicit token is the one
+    every child process owns while it runs. Every child started by a builder
+    first takes a slot, so make processes of concurrently running builders
+    together never exceed the budget.
+    """
+
+    def __init__(self, jobs):
+        self._jobs = max(1, jobs)
+        self._read_fd, self._write_fd = os.pipe()
+        os.write(self._write_fd, '+' * (self._jobs - 1))
+        self._implicit = threading.Lock()
+        self._guard = threading.Lock()
+        self._leasing = threading.Lock()
+        self._waiting = 0
+
+    def get_jobs(self):
+        """ Returns the total job budget """
+        return self._jobs
+
+    def acquire(self):
+        """
+        Takes a slot for a child process, blocking until one is available.
+        Returns the token to hand back to release.
+        """
+        with self._guard:
+            if self._implicit.acquire(False): return None
+            self._waiting += 1
+        try:
+            while True:
+                try:
+                    return os.read(self._read_fd, 1)
+                except OSError as e:
+                    if e.errno != errno.EINTR: raise
+        finally:
+            with self._guard:
+                self._waiting -= 1
+
+    def _acquire_within(self, timeout):
+        """
+        Takes a slot like acquire, unless none frees up within timeout
+        seconds. Returns whether it took one, along with the token.
+        """
+        with self._guard:
+            if self._implicit.acquire(False): return True, None
+        try:
+            ready = select.select([self._read_fd], [], [], max(0, timeout))[0]
+        except select.error as e:
+            if e.args[0] != errno.EINTR: raise
+            return False, None
+        if len(ready) == 0: return False, None
+        # A make may take the token first, it then waits for the next one
+        return True, self.acquire()
+
+    def release(self, token):
+        """ Returns a slot taken with acquire """
+        with self._guard:
+            if token == None and self._waiting == 0:
+                self._implicit.release()
+                return
+        # Waiters block on the pipe, so a freed implicit slot is handed
+        # over to them as a pipe token
+        os.write(self._write_fd, token or '+')
+
+    @contextmanager
+    def slot(self):
+        """ Holds a slot for the duration of the with block """
+        token = self.acquire()
+        try:
+            yield
+        finally:
+            self.release(token)
+
+    @contextmanager
+    def lease(self, jobs, private=False):
+        """
+        Holds up to jobs slots for a child process for the duration of the
+        with block, which gets the lease to take the environment of the
+        child from. A make started with it runs at most jobs jobs at once,
+        all of them drawn from the shared budget. A private lease always
+        holds its slots itself, the amount it got is that of get_jobs, for
+        tools which take a job count instead of using the jobserver.
+        """
+        jobs = min(jobs, self._jobs)
+        if jobs >= self._jobs and not private:
+            with self.slot():
+                yield self
+            return
+        # Leases are taken one after the other, so two of them never wait
+        # for the slots held by the other. Slots which do not free up in
+        # time are left out, rather than stalling the child.
+        with self._leasing:
+            tokens = [self.acquire()]
+            deadline = time.time() + _lease_timeout
+            while len(tokens) < jobs:
+                acquired, token = self._acquire_within(deadline - time.time())
+                if not acquired: break
+                tokens.append(token)
+        lease = _Lease(len(tokens))
+        try:
+            yield lease
+        finally:
+            lease.close()
+            for token in tokens: self.release(token)
+
+    def environment(self, env):
+        """
+        Returns a copy of env which lets make (and everything make starts)
+        draw its additional jobs from this jobserver
+        """
+        return _environment(env, self._read_fd, self._write_fd)
+
+
+class _Lease(object):
+    """ A private jobserver pipe over slots taken from the shared one """
+
+    def __init__(self, jobs):
+        self._jobs = jobs
+        self._read_fd, self._write_fd = os.pipe()
+        os.write(self._write_fd, '+' * (jobs - 1))
+
+    def get_jobs(self):
+        """ Returns the amount of slots held """
+        return self._jobs
+
+    def environment(self, env):
+        """ Returns a copy of env which lets make draw its jobs from the lease """
+        return _environment(env, self._read_fd, self._write_fd)
+
+    def close(self):
+        os.close(self._read_fd)
+        os.close(self._write_fd)
+
+
+def _environment(env, read_fd, write_fd):
+    env = dict(env)
+    flags = [flag for flag in env.get('MAKEFLAGS', '').split()
+             if not (flag.startswith('--jobserver') or
+                     flag.startswith('-j'))]
+    flags.extend(['-j', '--jobserver-fds=%d,%d' % (read_fd, write_fd)])
+    env['MAKEFLAGS'] = ' ' + ' '.join(flags)
+    if 'MFLAGS' in env: del env['MFLAGS']
+    return env
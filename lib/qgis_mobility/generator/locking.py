@@ -0,0 +1,102 @@
+#
+#  This file is part of QGis Mobility
+#
+#  QGis Mobility is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  QGis Mobility is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with QGis Mobility. If not, see
+#  <http://www.gnu.org/licenses/>.
+#
+
+import os
+import fcntl
+import errno
+import threading
+
+# The locks of this process by the real path of their lock file
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+class FileLock(object):
+    """
+    An exclusive lock on a lock file, held by one thread at a time. The
+    lock file is locked with flock, so the lock serializes separate qgsmg
+    runs sharing a cache as well as the threads of one run.
+    """
+
+    def __init__(self, path, description=None):
+        self._path = path
+        self._description = description or path
+        self._thread_lock = threading.Lock()
+        self._file = None
+
+    def get_path(self):
+        """ Returns the path of the lock file """
+        return self._path
+
+    def acquire(self):
+        """ Takes the lock, blocking until no other thread or run holds it """
+        self._thread_lock.acquire()
+        try:
+            try:
+                os.makedirs(os.path.dirname(self._path))
+            except OSError as e:
+                if e.errno != errno.EEXIST: raise
+            lock_file = open(self._path, 'a')
+            try:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except IOError as e:
+                    if not e.errno in [errno.EAGAIN, errno.EACCES]: raise
+                    print "Waiting for another qgsmg run to release:", \
+                        self._description
+                    _flock(lock_file, fcntl.LOCK_EX)
+            except:
+                lock_file.close()
+                raise
+            self._file = lock_file
+        except:
+            self._thread_lock.release()
+            raise
+
+    def release(self):
+        """ Releases the lock taken with acquire """
+        lock_file = self._file
+        self._file = None
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+        finally:
+            lock_file.close()
+            self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+def _flock(lock_file, operation):
+    while True:
+        try:
+            fcntl.flock(lock_file, operation)
+            return
+        except IOError as e:
+            if e.errno != errno.EINTR: raise
+
+def lock_for(path, description=None):
+    """ Returns the lock of this process on the lock file at path """
+    key = os.path.realpath(path)
+    with _locks_guard:
+        if not key in _locks: _locks[key] = FileLock(path, description)
+        return _locks[key]
@@ -18,13 +18,28 @@
 
 import qgis_mobility.generator
 from qgis_mobility.generator.recipe import Recipe
+from qgis_mobility.generator.jobserver import Jobserver
+from qgis_mobility.generator.artifacts import ArtifactStore
+from qgis_mobility.generator.ccache import CompilerCache
+from qgis_mobility.generator.distfiles import Distfiles
+from qgis_mobility.generator.snapshots import SnapshotCache
+from qgis_mobility.generator.tracing import Tracer
+from qgis_mobility.generator.buildlog import BuildLogs
+from qgis_mobility.generator.configcache import ConfigCache
+from qgis_mobility.generator.autotoolscache import AutotoolsCache
+from qgis_mobility.generator.registry import BuilderRegistry
+from qgis_mobility.generator.cacheusage import parse_size
+from qgis_mobility.generator.tracing import load_traces, summarize
+from qgis_mobility.generator.throttle import Throttle, read_meminfo, job_limit
 from shutil import rmtree
+from distutils.spawn import find_executable
 import os
+import multiprocessing
+import threading
 import argparse
 import textwrap
 import inspect
 import re
-import inspect
 
 def _current_necessitas(): 
     return qgis_mobility.generator.current_necessitas()
@@ -45,6 +60,44 @@ class Recon(object):
         self._ndk_platform = os.path.join(self._ndk_path, 'platforms', 'android-' + 
                                           str(self._android_level), 'arch-arm')
         self._cache_path = cache_path
+        self._workers = int(os.environ.get('QGSMG_WORKERS',
+                                           multiprocessing.cpu_count()))
+        self._jobs = int(os.environ.get('QGSMG_JOBS',
+                                        multiprocessing.cpu_count()))
+        self._jobserver = None
+        self._min_free_memory = os.environ.get('QGSMG_MIN_FREE_MEMORY', '1G')
+        self._throttle = None
+        self._job_memory = None
+        self._artifact_store_path = os.environ.get(
+            'QGSMG_ARTIFACT_STORE', os.path.join(cache_path, 'artifacts'))
+        self._ccache = os.environ.get('QGSMG_CCACHE', '1') != '0'
+        self._ccache_size = os.environ.get('QGSMG_CCACHE_SIZE', '5G')
+        self._compiler_cache = None
+        self._ninja = os.environ.get('QGSMG_NINJA', '0') != '0'
+        self._distfiles_path = os.environ.get(
+            'QGSMG_DISTFILES', os.path.join(cache_path, 'distfiles'))
+        self._mirrors = os.environ.get('QGSMG_MIRRORS', '').split()
+        self._offline = os.environ.get('QGSMG_OFFLINE', '0') != '0'
+        self._retries = int(os.environ.get('QGSMG_FETCH_RETRIES', 3))
+        self._fetchers = int(os.environ.get('QGSMG_FETCHERS', 4))
+        self._distfiles = None
+        self._hardlink_snapshots = os.environ.get(
+            'QGSMG_HARDLINK_SNAPSHOTS', '0') != '0'
+        self._snapshots = None
+        self._tracer = None
+        self._log_tail = int(os.environ.get('QGSMG_LOG_TAIL', 40))
+        self._verbose = os.environ.get('QGSMG_VERBOSE', '0') != '0'
+        self._build_logs = None
+        self._shared_config_cache = os.environ.get(
+            'QGSMG_CONFIG_CACHE', '0') != '0'
+        self._config_cache = None
+        self._autotools_cache_enabled = os.environ.get(
+            'QGSMG_AUTOTOOLS_CACHE', '1') != '0'
+        self._autotools_cache = None
+        self._from_scratch = os.environ.get('QGSMG_FROM_SCRATCH', '0') != '0'
+        self._cache_budget = os.environ.get('QGSMG_CACHE_BUDGET', '30G')
+        self._builders = None
+        self._lock = threading.Lock()
         self.verify()
     
     def get_necessitas_path(self): 
@@ -87,6 +140,221 @@ class Recon(object):
     def get_qt_version_triplet(self):
         return self._qt_version_triplet
 
+    def get_workers(self):
+        """ Returns the maximum amount of builders running concurrently """
+        return self._workers
+
+    def set_workers(self, workers):
+        """ Sets the maximum amount of builders running concurrently """
+        self._workers = workers
+
+    def get_jobs(self):
+        """ Returns the global job budget shared by all builders """
+        return self._jobs
+
+    def set_jobs(self, jobs):
+        """ Sets the global job budget, only before the jobserver is used """
+        if self._jobserver != None:
+            raise ValueError("The jobserver is already running")
+        self._jobs = jobs
+
+    def get_artifact_store(self):
+        """ Returns the store of built libraries """
+        return ArtifactStore(self._artifact_store_path)
+
+    def set_artifact_store_path(self, path):
+        """ Sets the directory of the store of built libraries """
+        self._artifact_store_path = path
+
+    def get_compiler_cache(self):
+        """ Returns the compiler cache wrapping all compilers """
+        with self._lock:
+            if self._compiler_cache == None:
+                self._compiler_cache = CompilerCache(
+                    os.path.join(self._cache_path, 'ccache'), self._cache_path,
+                    self._ccache_size, self._ccache)
+        return self._compiler_cache
+
+    def set_ccache(self, enabled=None, size=None):
+        """ Enables or disables the compiler cache and sets its size limit """
+        if enabled != None: self._ccache = enabled
+        if size != None: self._ccache_size = size
+        self._compiler_cache = None
+
+    def get_cmake_generator(self):
+        """
+        Returns the generator of cmake builds, Ninja if enabled and
+        installed, Unix Makefiles otherwise
+        """
+        if self._ninja and find_executable('ninja') != None: return 'Ninja'
+        return 'Unix Makefiles'
+
+    def set_ninja(self, enabled):
+        """ Sets whether cmake builds use Ninja, if installed """
+        self._ninja = enabled
+
+    def get_distfiles(self):
+        """ Returns the cache of downloaded source archives """
+        with self._lock:
+            if self._distfiles == None:
+                self._distfiles = Distfiles(self._distfiles_path, self._mirrors,
+                                            self._offline, self._retries)
+        return self._distfiles
+
+    def set_distfiles(self, path=None, mirrors=None, offline=None, retries=None):
+        """
+        Sets the path, the mirrors, the offline mode and the download retries
+        of the distfiles
+        """
+        if path != None: self._distfiles_path = path
+        if mirrors != None: self._mirrors = mirrors
+        if offline != None: self._offline = offline
+        if retries != None: self._retries = retries
+        self._distfiles = None
+
+    def get_fetchers(self):
+        """ Returns the maximum amount of concurrent downloads of fetch """
+        return self._fetchers
+
+    def set_fetchers(self, fetchers):
+        """ Sets the maximum amount of concurrent downloads of fetch """
+        self._fetchers = fetchers
+
+    def get_snapshots(self):
+        """ Returns the cache of prepared source trees """
+        with self._lock:
+            if self._snapshots == None:
+                self._snapshots = SnapshotCache(
+                    os.path.join(self._cache_path, 'snapshots'),
+                    self._hardlink_snapshots)
+        return self._snapshots
+
+    def set_hardlink_snapshots(self, hardlink):
+        """ Sets whether working copies hardlink the snapshot files """
+        self._hardlink_snapshots = hardlink
+        self._snapshots = None
+
+    def get_tracer(self):
+        """ Returns the tracer recording the timeline of this run """
+        with self._lock:
+            if self._tracer == None:
+                self._tracer = Tracer(os.path.join(self._cache_path, 'traces'))
+        return self._tracer
+
+    def get_build_logs(self):
+        """ Returns the logs receiving the output of the builders """
+        with self._lock:
+            if self._build_logs == None:
+                self._build_logs = BuildLogs(os.path.join(self._cache_path, 'logs'),
+                                             self._log_tail, self._verbose)
+        return self._build_logs
+
+    def set_build_log_options(self, tail=None, verbose=None):
+        """
+        Sets the amount of lines shown of a failing process and whether all
+        output is shown on the console as well
+        """
+        if tail != None: self._log_tail = tail
+        if verbose != None: self._verbose = verbose
+        self._build_logs = None
+
+    def get_config_cache(self):
+        """ Returns the configure results shared between builders """
+        with self._lock:
+            if self._config_cache == None:
+                self._config_cache = ConfigCache(
+                    os.path.join(self._cache_path, 'config_cache'),
+                    self._shared_config_cache)
+        return self._config_cache
+
+    def get_autotools_cache(self):
+        """ Returns the cache of build systems generated by the autotools """
+        with self._lock:
+            if self._autotools_cache == None:
+                self._autotools_cache = AutotoolsCache(
+                    os.path.join(self._cache_path, 'autotools'),
+                    self._autotools_cache_enabled)
+        return self._autotools_cache
+
+    def set_autotools_cache(self, enabled):
+        """ Enables or disables the cache of generated build systems """
+        self._autotools_cache_enabled = enabled
+        self._autotools_cache = None
+
+    def set_shared_config_cache(self, enabled):
+        """ Sets whether builders share their configure results """
+        self._shared_config_cache = enabled
+        self._config_cache = None
+
+    def is_from_scratch(self):
+        """ Returns True if failed builds must not resume at checkpoints """
+        return self._from_scratch
+
+    def set_from_scratch(self, from_scratch):
+        """ Sets whether failed builds start over instead of resuming """
+        self._from_scratch = from_scratch
+
+    def get_cache_budget(self):
+        """ Returns the size in bytes the cache garbage collection aims at """
+        return parse_size(self._cache_budget)
+
+    def set_cache_budget(self, size):
+        """ Sets the size the cache garbage collection aims at, like 20G """
+        parse_size(size)
+        self._cache_budget = size
+
+    def get_builders(self):
+        """ Returns the registry of the builders used for lookups """
+        with self._lock:
+            if self._builders == None: self._builders = BuilderRegistry(self)
+        return self._builders
+
+    def get_jobserver(self):
+        """ Returns the jobserver every child process draws its jobs from """
+        with self._lock:
+            if self._jobserver == None:
+                self._jobserver = Jobserver(self._jobs)
+                min_free = parse_size(self._min_free_memory)
+                if min_free > 0:
+                    self._throttle = Throttle(self._jobserver, min_free)
+                    self._throttle.start()
+        return self._jobserver
+
+    def set_min_free_memory(self, size):
+        """
+        Sets the available memory below which jobs are held back, like 1G,
+        0 disables it. Only before the jobserver is used.
+        """
+        if self._jobserver != None:
+            raise ValueError("The jobserver is already running")
+        parse_size(size)
+        self._min_free_memory = size
+
+    def get_job_memory(self):
+        """
+        Returns the peak memory in bytes of a single job of every library in
+        the recent build traces
+        """
+        path = self.get_tracer().get_path()
+        with self._lock:
+            if self._job_memory == None:
+                builders, phases = summarize([event for events in load_traces(path, 10)
+                                              for event in events])
+                self._job_memory = dict((builder, totals['rss'] * 1024)
+                                        for builder, totals in builders.items())
+        return self._job_memory
+
+    def get_job_limit(self, library):
+        """
+        Returns how many jobs of library fit into the available memory, and
+        into the job budget less the jobs held back by the throttle
+        """
+        jobs = self.get_jobserver().get_jobs()
+        if self._throttle != None: jobs -= self._throttle.get_held()
+        meminfo = read_meminfo()
+        return job_limit(self.get_job_memory().get(library, 0),
+                         None if meminfo == None else meminfo[1], jobs)
+
     def get_script_path(self):
         current_path = os.path.realpath(os.path.dirname(
             inspect.getfile(inspect.currentframe())))
@@ -174,17 +442,130 @@ def run(cache_path):
       -c <PATH>   Instructs the bash script to initiate
                   into the given cache path
     ''')
-    usage = "qgsmg [-c <PATH>] [-h] action"
+    usage = ("qgsmg [-c <PATH>] [-h] [-w <N>] [-j <N>] " +
+             "[--artifact-store <PATH>] [--[no-]ccache] " +
+             "[--ccache-size <SIZE>] [--[no-]autotools-cache] [--ninja] " +
+             "[--distfiles <PATH>] " +
+             "[--mirror <URL>]... [--offline] [--retries <N>] " +
+             "[--fetchers <N>] [--hardlink-snapshots] " +
+             "[--tail <N>] [-v] [--shared-config-cache] [--from-scratch] " +
+             "[--cache-budget <SIZE>] [--min-free-memory <SIZE>] action")
     parser = argparse.ArgumentParser(
         usage=usage,
         epilog=epilog,
         description=describe, prog='qgsmg',
         formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-w', '--workers', action='store', type=int,
+                        metavar='N', default=None,
+                        help='Amount of builders to run concurrently ' +
+                        '(default: $QGSMG_WORKERS or the amount of CPUs)')
+    parser.add_argument('-j', '--jobs', action='store', type=int,
+                        metavar='N', default=None,
+                        help='Global job budget shared by all builders ' +
+                        '(default: $QGSMG_JOBS or the amount of CPUs)')
+    parser.add_argument('--artifact-store', action='store', metavar='PATH',
+                        default=None,
+                        help='Directory of the store of built libraries, ' +
+                        'shared only by machines whose caches have the ' +
+                        'same path, as built libraries embed it (default: ' +
+                        '$QGSMG_ARTIFACT_STORE or <CACHE>/artifacts)')
+    parser.add_argument('--ccache', action='store_true', dest='ccache',
+                        default=None,
+                        help='Wrap all compilers with ccache, if installed ' +
+                        '(default, unless $QGSMG_CCACHE is 0)')
+    parser.add_argument('--no-ccache', action='store_false', dest='ccache',
+                        help='Do not wrap the compilers with ccache')
+    parser.add_argument('--ccache-size', action='store', metavar='SIZE',
+                        default=None,
+                        help='Size limit of the compiler cache in <CACHE>/ccache ' +
+                        '(default: $QGSMG_CCACHE_SIZE or 5G)')
+    parser.add_argument('--autotools-cache', action='store_true',
+                        dest='autotools_cache', default=None,
+                        help='Restore the output of autoreconf and autogen.sh ' +
+                        'from <CACHE>/autotools when their inputs are ' +
+                        'unchanged (default, unless $QGSMG_AUTOTOOLS_CACHE is 0)')
+    parser.add_argument('--no-autotools-cache', action='store_false',
+                        dest='autotools_cache',
+                        help='Always run autoreconf and autogen.sh')
+    parser.add_argument('--ninja', action='store_true', default=None,
+                        help='Build cmake projects with Ninja, if installed ' +
+                        '(default: on if $QGSMG_NINJA is 1)')
+    parser.add_argument('--distfiles', action='store', metavar='PATH',
+                        default=None,
+                        help='Directory of the cache of source archives ' +
+                        '(default: $QGSMG_DISTFILES or <CACHE>/distfiles)')
+    parser.add_argument('--mirror', action='append', metavar='URL',
+                        dest='mirrors', default=None,
+                        help='Mirror searched for source archives before ' +
+                        'their original location, may be a file:// URL and ' +
+                        'may be repeated (default: $QGSMG_MIRRORS)')
+    parser.add_argument('--offline', action='store_true', default=None,
+                        help='Only use the distfiles cache and file:// ' +
+                        'mirrors (default: on if $QGSMG_OFFLINE is 1)')
+    parser.add_argument('--retries', action='store', type=int, metavar='N',
+                        default=None,
+                        help='Attempts to download a source archive from ' +
+                        'each location, resuming the partial file ' +
+                        '(default: $QGSMG_FETCH_RETRIES or 3)')
+    parser.add_argument('--fetchers', action='store', type=int, metavar='N',
+                        default=None,
+                        help='Amount of concurrent downloads of the fetch ' +
+                        'action (default: $QGSMG_FETCHERS or 4)')
+    parser.add_argument('--hardlink-snapshots', action='store_true',
+                        default=None,
+                        help='Hardlink working copies of source snapshots ' +
+                        'instead of copying them (default: on if ' +
+                        '$QGSMG_HARDLINK_SNAPSHOTS is 1)')
+    parser.add_argument('--tail', action='store', type=int, metavar='N',
+                        default=None,
+                        help='Lines of output shown when a process fails, ' +
+                        'all output is in <CACHE>/logs (default: ' +
+                        '$QGSMG_LOG_TAIL or 40)')
+    parser.add_argument('-v', '--verbose', action='store_true', default=None,
+                        help='Show the output of all processes on the ' +
+                        'console as well (default: on if $QGSMG_VERBOSE is 1)')
+    parser.add_argument('--shared-config-cache', action='store_true',
+                        default=None,
+                        help='Share the results of autoconf configure checks ' +
+                        'between the builders of an architecture (default: ' +
+                        'on if $QGSMG_CONFIG_CACHE is 1)')
+    parser.add_argument('--from-scratch', action='store_true', default=None,
+                        help='Start failed builds over instead of resuming ' +
+                        'after their last checkpoint (default: on if ' +
+                        '$QGSMG_FROM_SCRATCH is 1)')
+    parser.add_argument('--cache-budget', action='store', metavar='SIZE',
+                        default=None,
+                        help='Size the cache:gc action prunes the cache down ' +
+                        'to (default: $QGSMG_CACHE_BUDGET or 30G)')
+    parser.add_argument('--min-free-memory', action='store', metavar='SIZE',
+                        default=None,
+                        help='Hold back jobs while less memory is available, ' +
+                        '0 disables it (default: $QGSMG_MIN_FREE_MEMORY or 1G)')
     parser.add_argument('action', action='store', nargs=1,
                         help='Initiates a make routine')
     parser.add_argument('parameters', action='store', nargs='*',
                         help='Parameters for the given action')
     args = parser.parse_args()
+    if args.workers != None: recon.set_workers(args.workers)
+    if args.jobs != None: recon.set_jobs(args.jobs)
+    if args.artifact_store != None:
+        recon.set_artifact_store_path(args.artifact_store)
+    recon.set_ccache(args.ccache, args.ccache_size)
+    if args.autotools_cache != None:
+        recon.set_autotools_cache(args.autotools_cache)
+    if args.ninja != None: recon.set_ninja(args.ninja)
+    recon.set_distfiles(args.distfiles, args.mirrors, args.offline,
+                        args.retries)
+    if args.fetchers != None: recon.set_fetchers(args.fetchers)
+    if args.hardlink_snapshots != None:
+        recon.set_hardlink_snapshots(args.hardlink_snapshots)
+    recon.set_build_log_options(args.tail, args.verbose)
+    if args.shared_config_cache != None:
+        recon.set_shared_config_cache(args.shared_config_cache)
+    if args.from_scratch != None: recon.set_from_scratch(args.from_scratch)
+    if args.cache_budget != None: recon.set_cache_budget(args.cache_budget)
+    if args.min_free_memory != None:
+        recon.set_min_free_memory(args.min_free_memory)
     
     __parsecommand(args.action[0], args.parameters, recipe)
     
@@ -0,0 +1,169 @@
+#
+#  This file is part of QGis Mobility
+#
+#  QGis Mobility is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  QGis Mobility is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with QGis Mobility. If not, see
+#  <http://www.gnu.org/licenses/>.
+#
+
+import os
+import errno
+import shutil
+import filecmp
+
+
+def is_current(source, destination):
+    """
+    Returns True if destination already holds the file at source: it is
+    the same file, or a file of the same size and modification time
+    """
+    try:
+        source_stat = os.stat(source)
+        destination_stat = os.lstat(destination)
+    except OSError as e:
+        if e.errno != errno.ENOENT: raise
+        return False
+    if (source_stat.st_dev, source_stat.st_ino) == (destination_stat.st_dev,
+                                                    destination_stat.st_ino):
+        return True
+    return (os.path.isfile(destination) and not os.path.islink(destination) and
+            source_stat.st_size == destination_stat.st_size and
+            int(source_stat.st_mtime) == int(destination_stat.st_mtime))
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT: raise
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST: raise
+
+def place_file(source, destination, link=True):
+    """
+    Places the file at source at destination, as hardlink if link is set
+    and both are on the same file system, as copy with the modification
+    time of source otherwise. Returns 'kept' if destination was current,
+    'linked' or 'copied'. Hardlinks are only safe for files which are
+    replaced rather than written to in place afterwards.
+    """
+    if is_current(source, destination): return 'kept'
+    _remove(destination)
+    if link:
+        try:
+            os.link(source, destination)
+            return 'linked'
+        except OSError as e:
+            if not e.errno in [errno.EXDEV, errno.EPERM, errno.EMLINK]: raise
+    shutil.copy2(source, destination)
+    return 'copied'
+
+def place_symlink(source, destination):
+    """ Makes destination a symbolic link to source, unless it already is """
+    source = os.path.abspath(source)
+    if os.path.islink(destination) and os.readlink(destination) == source:
+        return 'kept'
+    _remove(destination)
+    os.symlink(source, destination)
+    return 'linked'
+
+def sync_tree(source, destination, link=True):
+    """
+    Makes destination hold every file of the tree at source, placing only
+    the files which are not current yet. Symbolic links are recreated, files
+    in destination which source lacks are left alone, as copy_tree does.
+    Returns the number of files kept, linked and copied by outcome.
+    """
+    if not os.path.isdir(source):
+        raise ValueError("Cannot sync, not a directory: " + source)
+    counts = { 'kept' : 0, 'linked' : 0, 'copied' : 0 }
+    for directory, directories, files in os.walk(source):
+        target = os.path.join(destination,
+                              os.path.relpath(directory, source))
+        _makedirs(target)
+        for name in list(directories):
+            if os.path.islink(os.path.join(directory, name)):
+                # os.walk does not follow them, they are placed as links
+                directories.remove(name)
+                files.append(name)
+        for name in files:
+            path = os.path.join(directory, name)
+            target_path = os.path.join(target, name)
+            if os.path.islink(path):
+                link_target = os.readlink(path)
+                if (os.path.islink(target_path) and
+                    os.readlink(target_path) == link_target):
+                    counts['kept'] += 1
+                    continue
+                if os.path.isdir(target_path) and not os.path.islink(target_path):
+                    shutil.rmtree(target_path)
+                _remove(target_path)
+                os.symlink(link_target, target_path)
+                counts['copied'] += 1
+            else:
+                counts[place_file(path, target_path, link)] += 1
+    return counts
+
+def mirror_tree(source, destination):
+    """
+    Makes destination an exact copy of the tree at source, comparing the
+    files by content. Files with the same contents keep their modification
+    time, so an incremental build in destination only redoes the work for
+    the files which really changed; changed files get the current time.
+    Files in destination which source lacks are removed. Returns the number
+    of files kept, updated and removed.
+    """
+    if not os.path.isdir(source):
+        raise ValueError("Cannot mirror, not a directory: " + source)
+    counts = { 'kept' : 0, 'updated' : 0, 'removed' : 0 }
+    for directory, directories, files in os.walk(source):
+        target = os.path.join(destination, os.path.relpath(directory, source))
+        if os.path.lexists(target) and not os.path.isdir(target): _remove(target)
+        _makedirs(target)
+        for name in list(directories):
+            if os.path.islink(os.path.join(directory, name)):
+                directories.remove(name)
+                files.append(name)
+        for name in files:
+            path = os.path.join(directory, name)
+            target_path = os.path.join(target, name)
+            if os.path.isdir(target_path) and not os.path.islink(target_path):
+                shutil.rmtree(target_path)
+            if os.path.islink(path):
+                if (os.path.islink(target_path) and
+                    os.readlink(target_path) == os.readlink(path)):
+                    counts['kept'] += 1
+                    continue
+                _remove(target_path)
+                os.symlink(os.readlink(path), target_path)
+            elif (os.path.isfile(target_path) and not os.path.islink(target_path)
+                  and filecmp.cmp(path, target_path, shallow=False)):
+                counts['kept'] += 1
+                continue
+            else:
+                _remove(target_path)
+                shutil.copyfile(path, target_path)
+                shutil.copymode(path, target_path)
+            counts['updated'] += 1
+    for directory, directories, files in os.walk(destination, topdown=False):
+        origin = os.path.join(source, os.path.relpath(directory, destination))
+        for name in files + directories:
+            path = os.path.join(directory, name)
+            if os.path.lexists(os.path.join(origin, name)): continue
+            if os.path.isdir(path) and not os.path.islink(path): shutil.rmtree(path)
+            else: _remove(path)
+            counts['removed'] += 1
+    return counts
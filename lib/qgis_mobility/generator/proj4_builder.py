@@ -17,7 +17,6 @@
 #
 
 from qgis_mobility.generator.builder import Builder
-import distutils.dir_util
 import os
 import shutil
 
@@ -32,28 +31,41 @@ class Proj4Builder(Builder):
         """ Returns the human readable name of the Proj4Builder """
         return 'Proj4 Build Process'
 
+    def get_sources(self):
+        """ Returns the URLs of the sources """
+        return ['http://download.osgeo.org/proj/' + self.library_name() + '.tar.gz']
+
+    def get_arches(self):
+        """ The library is needed on the host as well as on the target """
+        return ['host', 'android']
+
+    def prepare_tree(self):
+        """ Prepares the unpacked sources """
+        self.patch('proj4.patch')
+        self.fix_config_sub_and_guess()
+
+    def do_prepare(self):
+        """ Prepares the sources ahead of the build """
+        self.prepare_snapshots(self.fetch(self.get_sources()[0]), 'proj-4.7.0',
+                               self.prepare_tree)
+
     def do_build_for(self, arch, output):
         """
         Builds the Proj4 library for the given architecture using the tarball
         specified as output
         """
         self.set_current_arch(arch)
-        self.unpack(output)
-        base_source_path = os.path.join(self.get_source_path(), 'proj-4.7.0')
+        base_source_path = self.prepare_source(output, 'proj-4.7.0', self.prepare_tree)
         self.push_current_source_path(base_source_path)
-        self.patch('proj4.patch')
-        self.fix_config_sub_and_guess()
         self.run_autotools_and_make()        
-        distutils.dir_util.copy_tree(os.path.join(self.get_build_path(), 'include'),
-                                     os.path.join(self.get_include_path()))
+        self.copy_tree(os.path.join(self.get_build_path(), 'include'),
+                       os.path.join(self.get_include_path()))
         self.pop_current_source_path()
         shutil.rmtree(base_source_path)
 
 
     def do_build(self):
         """ Runs the actual build process """
-        output = self.wget('http://download.osgeo.org/proj/' + 
-                           self.library_name() + '.tar.gz')
-        self.do_build_for('host', output)
-        self.do_build_for('android', output)
+        output = self.fetch(self.get_sources()[0])
+        self.do_build_for_arches(output)
         self.mark_finished()
@@ -17,10 +17,10 @@
 #
 
 from qgis_mobility.generator.pythonian_builder import PythonianBuilder
+from qgis_mobility.generator.rewrite import Substitute
+from qgis_mobility.generator.sip_builder import SipBuilder
 
 import os
-import shutil
-import subprocess
 
 class PyQtBuilder(PythonianBuilder):
     """ Represents the build strategy for the Python Builder """
@@ -37,6 +37,20 @@ class PyQtBuilder(PythonianBuilder):
         """ Returns the human readable name of the PyQt Builder """
         return 'PyQt Build Process'
 
+    @classmethod
+    def dependencies(cls):
+        """ Returns the builders this library is built against """
+        return [SipBuilder]
+
+    def get_sources(self):
+        """ Returns the URLs of the sources """
+        return ['http://sourceforge.net/projects/pyqt/files/PyQt4/' +
+                self.small_version() + '/' + self.library_name() + '.tar.gz/download']
+
+    def get_arches(self):
+        """ PyQt is built for the target and installed into the host python """
+        return ['host', 'android']
+
     def qt_responder(self):
         f = open(os.path.join(self.get_current_source_path(), 'qt_responder.i'), 'w+')
         f.write('#include <Qt/qglobal.h>\n')
@@ -71,10 +85,8 @@ class PyQtBuilder(PythonianBuilder):
         qt_include_path = self.make_qt_path('include')
         self.qt_responder()
         proc_args = ['cpp', '-x', 'c++', 'qt_responder.i', '-I', qt_include_path, '-o', 'qt_responder.out']
-        process = subprocess.Popen(proc_args, cwd=self.get_current_source_path())
-        process.communicate(None)
-        if process.returncode != 0:
-            raise ValueError("Could not run the precompiler for the responder file")
+        self._call_process(proc_args, cwd=self.get_current_source_path(),
+                           error="Could not run the precompiler for the responder file")
         
         # Read the responder files last two entries
         f = open(os.path.join(self.get_current_source_path(), 'qt_responder.out'))
@@ -101,23 +113,29 @@ class PyQtBuilder(PythonianBuilder):
         self.patch('disable_KeyboardModifiers_qguiapplication.patch', strip=1)
         self.patch('disable_KeyboardModifiers_qapplication.patch', strip=1)
 
+    def do_prepare(self):
+        """ Prepares the sources of both builds ahead of them """
+        self.prepare_snapshots(self.fetch(self.get_sources()[0]),
+                               self.library_name())
+
     def do_build(self):
         """ Starts the build process of Android PyQt """
 
 
-        output = self.wget('http://sourceforge.net/projects/pyqt/files/PyQt4/' + 
-                           self.small_version() + '/' + self.library_name() + '.tar.gz/download')
-
-        self.unpack(output)
+        output = self.fetch(self.get_sources()[0])
 
-        self.push_current_source_path(os.path.join(self.get_source_path(), self.library_name()))
+        # The host build has a tree of its own, which persists between target
+        # rebuilds and is only made incrementally while unchanged
+        self.set_current_arch('host')
+        self.push_current_source_path(self.prepare_source(output, self.library_name(),
+                                                          keep=True))
         self.run_py_configure_and_make(options=['--confirm-license'], host=True)
 
         self.pop_current_source_path()
-        shutil.rmtree(os.path.join(self.get_source_path(), self.library_name()))
+        self.set_current_arch('android')
 
-        self.unpack(output)
-        self.push_current_source_path(os.path.join(self.get_source_path(), self.library_name()))
+        # The target build starts from a fresh copy of the sources
+        self.push_current_source_path(self.prepare_source(output, self.library_name()))
 
         qt_version, qt_edition = self.use_preprocessor_determination()
         fname = self.qtdirs_responder(qt_version, qt_edition)
@@ -132,7 +150,7 @@ class PyQtBuilder(PythonianBuilder):
                  'INCDIR+=' + self.make_qt_path(os.path.join('mkspecs', 'android-g++'))]
 
         mappings = self.get_default_toolchain_mappings()
-        flags = self.get_default_flags()
+        flags = self.get_flags()
         sysroot = os.path.join(self.get_recon().get_toolchain_path(), 'sysroot')
         options.extend(['CC=' + mappings['CC'],
                         'CFLAGS+=--sysroot=' + sysroot + ' -mthumb',
@@ -144,30 +162,28 @@ class PyQtBuilder(PythonianBuilder):
 
         self.run_py_configure(options)
         
+        # Windows commands to replace in all Makefiles
+        portability = [Substitute(r'copy /y', 'cp -f'),
+                       Substitute(r'@if not exist[^|]*[|][|] mkdir', 'mkdir -p')]
+        module_edits = [
+            Substitute(r'INCPATH[^=]*=', r'\g<0> -I' + self.get_include_path() + ' '),
+            Substitute(r'CPPFLAGS[^=]*=', r'\g<0> -I' + self.get_include_path() + ' '),
+            Substitute(r'LIBS[^=]*=', r'\g<0> -L' + self.get_output_library_path() +
+                       ' -lpython2.7 -llog -lz -lm -ldl -lc ')] + portability
+
+        makefiles = []
         for main_path in ['qpy', '.']:
             qpy_path = os.path.join(self.get_current_source_path(), main_path)
             directory = os.listdir(qpy_path)
             for path in directory:
                 makefile = os.path.join(qpy_path, path, 'Makefile')
                 if os.path.exists(makefile):
-                    sedstring = 's|INCPATH[^=]*=|& -I' + self.get_include_path() + ' |'
-                    self.sed_i(sedstring, makefile)
-                    sedstring = 's|CPPFLAGS[^=]*=|& -I' + self.get_include_path() + ' |'
-                    self.sed_i(sedstring, makefile)
-                    sedstring = 's|LIBS[^=]*=|& -L' + self.get_output_library_path() + ' -lpython2.7 -llog -lz -lm -ldl -lc |'
-                    self.sed_i(sedstring, makefile)
-                    sedstring = 's|copy /y|cp -f|'
-                    self.sed_i(sedstring, makefile)
-                    sedstring = 's/\@if not exist[^|]*[|][|] mkdir/mkdir -p/'
-                    self.sed_ie(sedstring, makefile)
+                    makefiles.append((makefile, module_edits))
 
         main_makefile = os.path.join(self.get_current_source_path(), 'Makefile')
-        sedstring = 's/@(cd pyrcc.*$//'
-        self.sed_i(sedstring, main_makefile)
-        sedstring = 's|copy /y|cp -f|'
-        self.sed_i(sedstring, main_makefile)
-        sedstring = 's/\@if not exist[^|]*[|][|] mkdir/mkdir -p/'                    
-        self.sed_ie(sedstring, main_makefile)
+        makefiles.append((main_makefile,
+                          [Substitute(r'@\(cd pyrcc.*$', '')] + portability))
+        self.rewrite_files(makefiles)
         
         self.run_make()
         self.run_make(install=True, makeopts=['INSTALL_ROOT=' + self.get_build_path()])
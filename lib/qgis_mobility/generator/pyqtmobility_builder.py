@@ -17,9 +17,9 @@
 #
 
 from qgis_mobility.generator.pyqt_builder import PyQtBuilder
+from qgis_mobility.generator.rewrite import Substitute
 
 import os
-import shutil
 import subprocess
 
 class PyQtMobilityBuilder(PyQtBuilder):
@@ -37,20 +37,32 @@ class PyQtMobilityBuilder(PyQtBuilder):
         """ Returns the human readable name of the PyQt Builder """
         return 'PyQt-Mobility Build Process'
 
+    @classmethod
+    def dependencies(cls):
+        """ Returns the builders this library is built against """
+        return [PyQtBuilder]
+
+    def get_sources(self):
+        """ Returns the URLs of the sources """
+        return ['http://www.riverbankcomputing.co.uk/static/Downloads/PyQtMobility/' +
+                self.library_name() + '.tar.gz']
+
+    def get_arches(self):
+        """ PyQt Mobility is only built for the target """
+        return ['android']
+
+
+    def do_prepare(self):
+        """ Prepares the sources ahead of the build """
+        self.prepare_snapshots(self.fetch(self.get_sources()[0]),
+                               self.library_name())
 
     def do_build(self):
         """ Starts the build process of Android PyQt """
 
-        output = self.wget('http://www.riverbankcomputing.co.uk/static/Downloads/PyQtMobility/' +
-                           self.library_name() + '.tar.gz')
-
-        self.unpack(output)
+        output = self.fetch(self.get_sources()[0])
 
-        self.push_current_source_path(os.path.join(self.get_source_path(), self.library_name()))
-        self.pop_current_source_path()
-        shutil.rmtree(os.path.join(self.get_source_path(), self.library_name()))
-        self.unpack(output)
-        self.push_current_source_path(os.path.join(self.get_source_path(), self.library_name()))
+        self.push_current_source_path(self.prepare_source(output, self.library_name()))
 
         qt_version, qt_edition = self.use_preprocessor_determination()
         fname = self.qtdirs_responder(qt_version, qt_edition)
@@ -65,38 +77,42 @@ class PyQtMobilityBuilder(PyQtBuilder):
 
         sip_path = os.path.join(self.get_build_path(), 'share', 'sip')
 
-        self.sed_ie('s|flags.append.pyqt.pyqt_sip_dir.|flags.append(\'' + sip_path + '\')|', 'configure.py')
+        self.rewrite('configure.py',
+                     [Substitute(r'flags.append.pyqt.pyqt_sip_dir.',
+                                 "flags.append('" + sip_path + "')")])
 
 
         # Need to remove Q_PID declaration in the source files temporarily
         qprocess_sip_path = os.path.join(
-            PyQtBuilder(self.get_recon()).get_build_path(),
+            self.get_builder(PyQtBuilder).get_build_path(),
             'share', 'sip', 'QtCore', 'qprocess.sip')            
         
-        try:
-            self.sed_ir('s/%If \(WS_X11 \|\| WS_MACX\)/%If \(WS_WIN\)/',
-                        qprocess_sip_path)
-            self.run_py_configure(options, binaries=False)
+        with self.shared_file_lock(qprocess_sip_path):
+            try:
+                self.rewrite(qprocess_sip_path,
+                             [Substitute(r'%If \(WS_X11 \|\| WS_MACX\)', '%If (WS_WIN)')])
+                self.run_py_configure(options, binaries=False)
             
             
-            makeopts = ['CC=' + mappings['CC'],
-                        'CFLAGS+=--sysroot=' + sysroot + ' -mthumb' + ' -I' + self.get_include_path() + ' -I' + os.path.join(self.get_recon().get_qt_path(), 'include'),
-                        'CXXFLAGS+= -fpermissive --sysroot=' + sysroot + ' -mthumb' + ' -I' + self.get_include_path() + ' -I' + os.path.join(self.get_recon().get_qt_path(), 'include'),
-                        'CXX=' + mappings['CXX'],
-                        'LINK=' + mappings['CC'],
-                        'LIBS=-L' + os.path.join(self.get_recon().get_qt_path(), 'lib') + ' -L' + self.get_output_library_path() + ' -lQtSensors -lQtLocation -lQtCore -lQtGui -lpython2.7',
-                        'INSTALL_ROOT=' + self.get_build_path()]
+                makeopts = ['CC=' + mappings['CC'],
+                            'CFLAGS+=--sysroot=' + sysroot + ' -mthumb' + ' -I' + self.get_include_path() + ' -I' + os.path.join(self.get_recon().get_qt_path(), 'include'),
+                            'CXXFLAGS+= -fpermissive --sysroot=' + sysroot + ' -mthumb' + ' -I' + self.get_include_path() + ' -I' + os.path.join(self.get_recon().get_qt_path(), 'include'),
+                            'CXX=' + mappings['CXX'],
+                            'LINK=' + mappings['CC'],
+                            'LIBS=-L' + os.path.join(self.get_recon().get_qt_path(), 'lib') + ' -L' + self.get_output_library_path() + ' -lQtSensors -lQtLocation -lQtCore -lQtGui -lpython2.7',
+                            'INSTALL_ROOT=' + self.get_build_path()]
             
-            self.run_make(makeopts=makeopts)
+                self.run_make(makeopts=makeopts)
             
             
-            self.sed_ie('s|strip|' + self.get_tool('strip') + '|', 'QtLocation/Makefile')
-            self.sed_ie('s|strip|' + self.get_tool('strip') + '|', 'QtSensors/Makefile')
+                strip = [Substitute(r'strip', self.get_tool('strip'))]
+                self.rewrite_files([('QtLocation/Makefile', strip),
+                                    ('QtSensors/Makefile', strip)])
             
-            self.run_make(makeopts=makeopts, install=True)
+                self.run_make(makeopts=makeopts, install=True)
 
-        finally:
-            self.sed_ir('s/%If \(WS_WIN\)/%If \(WS_X11 \|\| WS_MACX\)/',
-                        qprocess_sip_path)
+            finally:
+                self.rewrite(qprocess_sip_path,
+                             [Substitute(r'%If \(WS_WIN\)', '%If (WS_X11 || WS_MACX)')])
 
         self.mark_finished()
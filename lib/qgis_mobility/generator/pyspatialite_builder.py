@@ -18,6 +18,7 @@
 
 from qgis_mobility.generator.pythonian_builder import PythonianBuilder
 from qgis_mobility.generator.geos_builder import GeosBuilder
+from qgis_mobility.generator.python_builder import PythonBuilder
 from qgis_mobility.generator.proj4_builder import Proj4Builder
 
 import os
@@ -39,27 +40,46 @@ class PySpatialiteBuilder(PythonianBuilder):
         """ Returns the human readable name of the PySpatialite Builder """
         return 'PySpatialite Build Process (HOST Only)'
 
+    @classmethod
+    def dependencies(cls):
+        """ Returns the builders this library is built against """
+        return [PythonBuilder, GeosBuilder, Proj4Builder]
+
+    def get_sources(self):
+        """ Returns the URLs of the sources """
+        return ["https://pypi.python.org/packages/source/p/pyspatialite/%s.tar.gz" %
+                self.library_name()]
+
+    def get_arches(self):
+        """ PySpatialite is only built for the host """
+        return ['host']
+
     def get_default_toolchain_mappings(self):
         mappings = PythonianBuilder.get_default_toolchain_mappings(self)
         arch = self.get_current_arch()
-        geos_lib_path = GeosBuilder(self.get_recon(), arch).get_library_path()
-        proj_lib_path = Proj4Builder(self.get_recon(), arch).get_library_path()
+        geos_lib_path = self.get_builder(GeosBuilder, arch).get_library_path()
+        proj_lib_path = self.get_builder(Proj4Builder, arch).get_library_path()
         flags = "-L%s -L%s" % (geos_lib_path, proj_lib_path)
         mappings['LDFLAGS'] = flags
         return mappings
 
+    def prepare_tree(self):
+        """ Prepares the unpacked sources """
+        self.patch("pyspatialite.patch", strip=1)
+
+    def do_prepare(self):
+        """ Prepares the sources ahead of the build """
+        self.prepare_snapshots(self.fetch(self.get_sources()[0]),
+                               self.library_name(), self.prepare_tree)
+
     def do_build(self):
         """ Starts the build process of the HOST Only PySpatialite """
 
-        url = "https://pypi.python.org/packages/source/p/pyspatialite/%s.tar.gz" % self.library_name()
-        output = self.wget(url)
+        output = self.fetch(self.get_sources()[0])
         self.set_current_arch('host')
-        self.unpack(output)
-
-        base_source_path = os.path.join(self.get_source_path(), 
-                                        self.library_name())
+        base_source_path = self.prepare_source(
+            output, self.library_name(), self.prepare_tree)
         self.push_current_source_path(base_source_path)
-        self.patch("pyspatialite.patch", strip=1)
         self.run_py_setup_build_and_install()
         self.pop_current_source_path()
         shutil.rmtree(os.path.join(base_source_path))
@@ -17,10 +17,9 @@
 #
 
 from qgis_mobility.generator.builder import Builder
+from qgis_mobility.generator.rewrite import Change
+from qgis_mobility.generator import placement
 import os
-import subprocess
-import multiprocessing
-import shutil
 import collections
 import sys
 
@@ -41,6 +40,15 @@ class PythonBuilder(Builder):
     def human_name(self):
         """ Returns the human readable name of the Python Builder """
         return 'Python Build Process'
+
+    @classmethod
+    def dependencies(cls):
+        """ Returns the builders this library is built against """
+        return [SQLiteBuilder]
+
+    def get_sources(self):
+        """ Returns the URLs of the sources """
+        return ['http://www.python.org/ftp/python/2.7.2/' + self.library_name() + '.tgz']
     
     def get_path(self):
         """ Also return the path of the ndk itself """
@@ -57,6 +65,16 @@ class PythonBuilder(Builder):
                 os.remove(os.path.join(self.cache_path, fn))
 
 
+    def get_artifact_paths(self):
+        """ The built libpython is picked up from the source path as well """
+        paths = Builder.get_artifact_paths(self)
+        paths.append(os.path.join(self.get_source_path(), 'libpython2.7.so'))
+        return paths
+
+    def supports_checkpoints(self):
+        """ The target build reconfigures with make distclean in between """
+        return False
+
     def get_include_path(self, arch=None):
         """ The library path is in the build path """
         host = (arch == 'host')
@@ -67,25 +85,23 @@ class PythonBuilder(Builder):
         else:
             return os.path.join(self.get_build_path(arch), 'include', 'python2.7')
     
+    def fetch_sources(self):
+        """ The tarball may be taken over from the host python """
+        return [self.do_download_cache()]
+
     def do_download_cache(self):
         """
-        Performs a check whether the library has been downloaded,
-        otherwise, downloads it. When available, copy it to the
-        qgis path
+        Returns the Python tarball from the distfiles cache. The tarball
+        qgsmg downloaded to build the host python is taken over if present.
         """
-        python_packed_library = self.library_name() + '.tgz'
-        excursion_path = os.path.join(self.get_recon().get_cache_path(), 'hostpython')
-        download_path = os.path.join(excursion_path, python_packed_library)
-        if not os.path.exists(download_path):
-            if not os.path.exists(excursion_path): os.makedirs(excursion_path)
-            self.push_current_source_path(os.path.join(excursion_path))
-            self.wget('http://www.python.org/ftp/python/2.7.2/' + 
-                      self.library_name() + '.tgz')
-            self.pop_current_source_path()
-        python_packed_path = os.path.join(self.get_current_source_path(), 
-                                        python_packed_library)
-        shutil.copyfile(download_path, python_packed_path)
-        return python_packed_path
+        url = self.get_sources()[0]
+        distfiles = self.get_distfiles()
+        name = distfiles.get_name(url)
+        host_download_path = os.path.join(self.get_host_python_prefix(), name)
+        if os.path.exists(host_download_path):
+            distfiles.adopt(name, host_download_path,
+                            self.get_source_checksums().get(url))
+        return self.fetch(url)
 
     def get_default_configure_flags(self):
         """ Overrides the default configure flags for the specifics of Python """
@@ -105,16 +121,19 @@ class PythonBuilder(Builder):
         return ' '.join(['-mandroid -O2 -fomit-frame-pointer --sysroot',
                          self.get_recon().ndk_platform,
                          '-DNO_MALLINFO=1',
-                         '-I' + SQLiteBuilder(self.get_recon()).get_include_path()])
+                         '-I' + self.get_builder(SQLiteBuilder).get_include_path()])
 
     def current_build_shared(self):
         return self._build_shared
 
     def get_default_toolchain_mappings(self):
         """ Overrides the toolchain mappings for a number of things"""
+        compiler_cache = self.get_compiler_cache()
         return { 
-            'CC'        : ' '.join([self.get_tool('gcc'), self.get_cflags()]),
-            'CXX'       : ' '.join([self.get_tool('g++'), self.get_cflags()]),
+            'CC'        : compiler_cache.wrap(' '.join([self.get_tool('gcc'),
+                                                        self.get_cflags()])),
+            'CXX'       : compiler_cache.wrap(' '.join([self.get_tool('g++'),
+                                                        self.get_cflags()])),
             'AR'        : self.get_tool('ar'),
             'RANLIB'    : self.get_tool('ranlib'),
             'STRIP'     : ' '.join([self.get_tool('strip'), '--strip-unneeded']),
@@ -127,18 +146,32 @@ class PythonBuilder(Builder):
 
     def autotools_cleanse(self):
         if os.path.exists(os.path.join(self.get_current_source_path(), 'Makefile')):
-            process = subprocess.Popen(['make', 'distclean'],
-                                       cwd=self.get_current_source_path())
-            process.communicate(None)
-            if process.returncode != 0:
-                raise ValueError("could not perform distclean")
+            self._call_process(['make', 'distclean'],
+                               cwd=self.get_current_source_path(),
+                               error="could not perform distclean",
+                               phase='make distclean')
         self.run_autotools_and_make(harness=False, runmakeinstall=False)
         
         pyconfig_path = 'pyconfig.h'
-        self.sed_ie('/HAVE_FDATASYNC/ c#undef HAVE_FDATASYNC', pyconfig_path)
-        self.sed_ie('/HAVE_KILLPG/ c#undef HAVE_KILLPG', pyconfig_path)
-        self.sed_ie('/HAVE_GETHOSTBYNAME_R/ c#undef HAVE_GETHOSTBYNAME_R', pyconfig_path)
-        self.sed_ie('/HAVE_DECL_ISFINITE/ c#undef HAVE_DECL_ISFINITE', pyconfig_path)
+        self.rewrite(pyconfig_path,
+                     [Change(r'HAVE_FDATASYNC', '#undef HAVE_FDATASYNC'),
+                      Change(r'HAVE_KILLPG', '#undef HAVE_KILLPG'),
+                      Change(r'HAVE_GETHOSTBYNAME_R', '#undef HAVE_GETHOSTBYNAME_R'),
+                      Change(r'HAVE_DECL_ISFINITE', '#undef HAVE_DECL_ISFINITE')])
+
+    def prepare_tree(self):
+        """ Prepares the unpacked sources """
+        for name in ['Python-2.7.2-xcompile.patch', 
+                     'Python-2.7.2-android.patch',
+                     'Python-2.7.2-site-relax-include-config.patch',
+                     'Python-2.7.2-enable_ipv6.patch',
+                     'Python-2.7.2-filesystemdefaultencoding.patch']:
+            self.patch(name, strip=1)
+
+    def do_prepare(self):
+        """ Prepares the sources ahead of the build """
+        self.prepare_snapshots(self.do_download_cache(), self.library_name(),
+                               self.prepare_tree)
 
     def do_build(self):
         """ Starts the build process of Android Python """
@@ -146,9 +179,7 @@ class PythonBuilder(Builder):
         host_source_path = os.path.join(self.get_current_source_path(), 'host')
         android_source_path = os.path.join(self.get_current_source_path(), 'android')
 
-
-        self.unpack(output)
-        os.rename(os.path.join(self.get_current_source_path(), self.library_name()),
+        os.rename(self.prepare_source(output, self.library_name(), self.prepare_tree),
                   android_source_path)
 
         host_python_prefix = self.get_host_python_prefix()
@@ -165,19 +196,12 @@ class PythonBuilder(Builder):
         our_env['ARCH'] = 'armeabi'
         our_env['NDKPLATFORM'] = self.get_recon().ndk_platform
 
-        for name in ['Python-2.7.2-xcompile.patch', 
-                     'Python-2.7.2-android.patch',
-                     'Python-2.7.2-site-relax-include-config.patch',
-                     'Python-2.7.2-enable_ipv6.patch',
-                     'Python-2.7.2-filesystemdefaultencoding.patch']:
-            self.patch(name, strip=1)
-        
         
         self.autotools_cleanse()
         
         module = 'libpython2.7.so'
 
-        module_make_args = ['make', '-j' + str(multiprocessing.cpu_count()),
+        module_make_args = ['make',
                             'HOSTPYTHON=' + host_python_vars.python,
                             'HOSTPGEN=' + host_python_vars.pgen,
                             'CROSS_COMPILE=' + 'arm-eabi-',
@@ -187,14 +211,14 @@ class PythonBuilder(Builder):
                             'INSTSONAME=libpython2.7.so',
                             module]
 
-        process = subprocess.Popen(module_make_args, env=our_env, 
-                                   cwd=self.get_current_source_path())
-        process.communicate(None)
-        if process.returncode != 0:
-            raise ValueError(' '.join(["Could not make the module with "] + run))
+        self._call_process(module_make_args, env=our_env,
+                           cwd=self.get_current_source_path(),
+                           error=' '.join(["Could not make the module with "] +
+                                          module_make_args),
+                           phase='make')
         
-        shutil.copyfile(os.path.join(self.get_current_source_path(), 'libpython2.7.so'),
-                        os.path.join(self.get_current_source_path(), '..', 'libpython2.7.so'))
+        placement.place_file(os.path.join(self.get_current_source_path(), 'libpython2.7.so'),
+                             os.path.join(self.get_current_source_path(), '..', 'libpython2.7.so'))
         
 
         
@@ -204,18 +228,16 @@ class PythonBuilder(Builder):
                                            self.get_current_source_path(), 
                                            '..'),
                                        '-L' + os.path.join(
-                                           SQLiteBuilder(self.get_recon()).get_build_path(),
+                                           self.get_builder(SQLiteBuilder).get_build_path(),
                                            'lib'),
                                        '-lpython2.7', '-Wl,--no-undefined'])
 
         self.autotools_cleanse()
 
         # Get the current architecture
-        process = subprocess.Popen(['uname', '-m'], stdout=subprocess.PIPE)
-        out, err = process.communicate(None)
-        machine = out.strip()
+        machine = os.uname()[4]
         
-        make_args = ['make', '-n', '-j' + str(multiprocessing.cpu_count()), 
+        make_args = ['make', '-n',
                      'HOSTPYTHON=' + host_python_vars.python,
                      'HOSTPGEN=' + host_python_vars.pgen,
                      'CROSS_COMPILE=' + 'arm-eabi-',
@@ -236,19 +258,14 @@ class PythonBuilder(Builder):
                              'INSTSONAME=libpython2.7.so']
 
         
-        for run in [make_args, make_install_args]:
-            process = subprocess.Popen(run, env=our_env, 
-                                       cwd=self.get_current_source_path())
-            process.communicate(None)
-            if process.returncode != 0:
-                raise ValueError("Could not make the finish")
+        for phase, run in [('make', make_args), ('make install', make_install_args)]:
+            self._call_process(run, env=our_env,
+                               cwd=self.get_current_source_path(),
+                               error="Could not make the finish", phase=phase)
         
         dest_path = os.path.join(self.get_build_path(), 'lib', 'libpython2.7.so')
-        if os.path.exists(dest_path):
-            os.remove(dest_path)
-
-        shutil.copyfile(os.path.join(self.get_current_source_path(), 'libpython2.7.so'),
-                        dest_path)
+        placement.place_file(os.path.join(self.get_current_source_path(), 'libpython2.7.so'),
+                             dest_path)
         
         print "Python Build Job finished"
         
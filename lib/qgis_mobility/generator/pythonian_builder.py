@@ -17,9 +17,9 @@
 #
 
 from qgis_mobility.generator.builder import Builder
+from qgis_mobility.generator import fingerprint
 
 import os
-import subprocess
 import shutil
 
 from qgis_mobility.generator.python_builder import PythonBuilder
@@ -29,14 +29,35 @@ class PythonianBuilder(Builder):
     
     def __init__(self, recon):
         Builder.__init__(self, recon)
-        self._python_builder = PythonBuilder(recon)
+        self._python_builder = recon.get_builders().get(PythonBuilder)
         self._host_python_vars = self._python_builder.get_host_python_vars()
+
+    @classmethod
+    def dependencies(cls):
+        """ Pythonian builders at least need the android python build """
+        return [PythonBuilder]
     
     def purge(self, arch):
+        """
+        Host trees are kept, they are reused while their sources and their
+        configuration stay the same
+        """
+        if arch == 'host': return
         if os.path.exists(self.get_source_path(arch)):
             shutil.rmtree(self.get_source_path(arch))
 
 
+    def get_artifact_paths(self):
+        """
+        Pythonian builders install into the python build and the host
+        python, so their outputs can not be kept apart in the store
+        """
+        return []
+
+    def supports_checkpoints(self):
+        """ configure.py builds start with make clean if there is a Makefile """
+        return False
+
     def get_build_finished_file(self):
         """
         The build finished file is altered, so the python builder can purge the
@@ -71,10 +92,8 @@ class PythonianBuilder(Builder):
         return os.path.join(self._python_builder.get_build_path(),
                             'share', 'sip')
 
-    def run_py_configure(self, options=[], host=False, binaries=True):
-        """ Adds the python configure.py runner, akin autoconf """
-
-        
+    def get_py_configure_command(self, options=[], host=False, binaries=True):
+        """ Returns the arguments and the environment to run configure.py """
         our_env = dict(os.environ).copy()
         if not host: 
             mappings = self.get_default_toolchain_mappings()
@@ -96,16 +115,24 @@ class PythonianBuilder(Builder):
 
         args.extend(options)
 
+        # configure.py takes its compilers from the spec, unless overridden
+        if self.get_compiler_cache().is_enabled():
+            mappings = self.get_default_toolchain_mappings()
+            for name in ['CC', 'CXX']:
+                if not any(option.startswith(name + '=') for option in options):
+                    args.extend([name + '=' + mappings[name]])
+        return args, our_env
+
+    def run_py_configure(self, options=[], host=False, binaries=True):
+        """ Adds the python configure.py runner, akin autoconf """
+        args, our_env = self.get_py_configure_command(options, host, binaries)
+
         print "PATH:", our_env['PATH']
         
         print "Process arguments:", args
         
-        process = subprocess.Popen(args, 
-                                   cwd=self.get_current_source_path(),
-                                   env=our_env)
-        process.communicate(None)
-        if process.returncode != 0:
-            raise ValueError("Python Configure failed")
+        self._call_process(args, cwd=self.get_current_source_path(), env=our_env,
+                           error="Python Configure failed", phase='configure')
             
         print "Python Configure Done"
         
@@ -129,12 +156,8 @@ class PythonianBuilder(Builder):
         
         print "Process arguments:", args
         
-        process = subprocess.Popen(args, 
-                                   cwd=self.get_current_source_path(),
-                                   env=our_env)
-        process.communicate(None)
-        if process.returncode != 0:
-            raise ValueError("Setup.py failed")
+        self._call_process(args, cwd=self.get_current_source_path(), env=our_env,
+                           error="Setup.py failed", phase='setup.py ' + option)
             
         print "Setup.py Done"
     
@@ -144,11 +167,15 @@ class PythonianBuilder(Builder):
 
     def run_make(self, install=False, host=False, command=None, makeopts=[]):
         args = ['make']
+        phase = 'make'
         
-        if install: args.extend(['install'])
+        if install:
+            args.extend(['install'])
+            phase = 'make install'
 
         if command != None and (not install):
             args.extend([command])
+            phase = 'make ' + command
 
         args.extend(makeopts)
 
@@ -158,21 +185,46 @@ class PythonianBuilder(Builder):
 
         print args
 
-        process = subprocess.Popen(args,
-                                   cwd=self.get_current_source_path(), 
-                                   env=our_env)
-        process.communicate(None)
-        if not process.returncode == 0:
-            raise ValueError("Make failed: ")
+        self._call_process(args, cwd=self.get_current_source_path(), env=our_env,
+                           error="Make failed: ",
+                           phase=phase)
+
 
+    def get_configure_stamp_file(self):
+        """ Returns the file recording the configuration of the current tree """
+        return os.path.join(self.get_current_source_path(), '.qgsmg-configure')
+
+    def get_configure_stamp(self, options=[], host=False):
+        """
+        Returns a digest over the configure.py arguments, the environment
+        they run in and the builds this one depends on
+        """
+        args, our_env = self.get_py_configure_command(options, host)
+        overrides = dict((name, our_env[name]) for name in our_env.keys()
+                         if os.environ.get(name) != our_env[name])
+        components = self.get_fingerprint().components()
+        dependencies = dict((name, components[name]) for name in components.keys()
+                            if name.startswith('dependency:'))
+        return fingerprint.hash_value([args, overrides, dependencies])
 
     def run_py_configure_and_make(self, options=[], host=False, makeopts=[]):
-        """ Runs the python configure.py runner and the make process """
-        if os.path.exists(
-                os.path.join(self.get_current_source_path(),
-                             'Makefile')):
-            self.run_make(command='clean')
-        
-        self.run_py_configure(options=options, host=host)
+        """
+        Runs the python configure.py runner and the make process. A tree
+        configured the same way before is only made incrementally.
+        """
+        stamp = self.get_configure_stamp(options, host)
+        stamp_file = self.get_configure_stamp_file()
+        recorded = None
+        if os.path.exists(stamp_file):
+            with open(stamp_file) as f: recorded = f.read().strip()
+        makefile = os.path.join(self.get_current_source_path(), 'Makefile')
+        if recorded == stamp and os.path.exists(makefile):
+            print "Configuration unchanged, making incrementally"
+        else:
+            if os.path.exists(stamp_file): os.remove(stamp_file)
+            if os.path.exists(makefile):
+                self.run_make(command='clean')
+            self.run_py_configure(options=options, host=host)
+            with open(stamp_file, 'w') as f: f.write(stamp + '\n')
         self.run_make(host=host, makeopts=makeopts)
         self.run_make(install=True, host=host, makeopts=makeopts)
@@ -17,11 +17,11 @@
 #
 
 from qgis_mobility.generator.builder import Builder
-import distutils.dir_util
+from qgis_mobility.generator.rewrite import Substitute, Insert
+from qgis_mobility.generator import placement
 import os
 import shutil
-import subprocess
-import multiprocessing
+import functools
 
 from qgis_mobility.generator.sqlite_builder import SQLiteBuilder
 from qgis_mobility.generator.geos_builder import GeosBuilder
@@ -45,6 +45,23 @@ class QGisBuilder(Builder):
         """ Returns the human readable name of the Spatialite Builder """
         return 'QGis Build Process'
 
+    @classmethod
+    def dependencies(cls):
+        """ Returns the builders this library is built against """
+        return [SQLiteBuilder, GeosBuilder, Proj4Builder, SpatialiteBuilder,
+                ExpatBuilder, GDALBuilder, QWTBuilder, SpatialindexBuilder,
+                PythonBuilder, PyQtBuilder]
+
+    def get_sources(self):
+        """ Returns the URLs of the sources """
+        return ['http://qgis.org/downloads/' + self.library_name() + '.tar.bz2']
+
+    def get_patch_files(self):
+        """ QGis additionally depends on the cmake toolchain file """
+        patch_files = Builder.get_patch_files(self)
+        patch_files.append(os.path.join(self.get_core_patch_path(), 'cmake'))
+        return patch_files
+
 
     def get_default_flags(self):
         """ Returns the default flags salted with dependencies """
@@ -58,25 +75,12 @@ class QGisBuilder(Builder):
         return flags
 
 
-    def do_download_cache(self):
-        """
-        Performs a check whether the library has been downloaded,
-        otherwise, downloads it. When available, copy it to the
-        qgis path
-        """
-        qgis_packed_library = self.library_name() + '.tar.bz2'
-        excursion_path = os.path.join(self.get_source_path(), '..', 'qgis_download')
-        download_path = os.path.join(excursion_path, qgis_packed_library)
-        if not os.path.exists(download_path):
-            if not os.path.exists(excursion_path): os.makedirs(excursion_path)
-            self.push_current_source_path(os.path.join(excursion_path))
-            self.wget('http://qgis.org/downloads/' + self.library_name() + '.tar.bz2')
-            self.pop_current_source_path()
-        
-        qgis_packed_path = os.path.join(self.get_current_source_path(), 
-                                        qgis_packed_library)
-        shutil.copyfile(download_path, qgis_packed_path)
-        return qgis_packed_path
+    def get_artifact_paths(self):
+        """ The runtime uses the sip files from the QGis sources """
+        paths = Builder.get_artifact_paths(self)
+        paths.append(os.path.join(self.get_source_path(), self.library_name(),
+                                  'python'))
+        return paths
 
     def add_definitions(self):
         source_path = self.get_current_source_path()
@@ -96,6 +100,25 @@ class QGisBuilder(Builder):
         os.rename(os.path.join(source_path, 'new.txt'),
                   os.path.join(source_path, 'CMakeLists.txt'))
 
+    def reuse_cmake_cache(self, build_path, source_path, generator):
+        """
+        Keeps the cmake build tree at build_path for another build, unless
+        it was configured for another source tree or generator, in which
+        case cmake would refuse it
+        """
+        cache_file = os.path.join(build_path, 'CMakeCache.txt')
+        if not os.path.exists(cache_file): return
+        expected = { 'CMAKE_GENERATOR:INTERNAL' : generator,
+                     'CMAKE_HOME_DIRECTORY:INTERNAL' : source_path }
+        with open(cache_file) as f:
+            for line in f:
+                name, separator, value = line.rstrip('\n').partition('=')
+                if name in expected and value != expected[name]:
+                    print "Starting over in", build_path, "due to", name
+                    shutil.rmtree(build_path)
+                    return
+        print "Reusing cmake build tree:", build_path
+
     def do_target_patches(self):
         """
         Patches the build infrastructure so it reduced the amount of auxiliary
@@ -114,20 +137,20 @@ class QGisBuilder(Builder):
         self.patch("gui_python.patch", strip=1)
         self.patch("gui_doc.patch", strip=1)
 
+    def do_prepare(self):
+        """ Prepares the sources ahead of the build """
+        self.prepare_snapshots(self.fetch(self.get_sources()[0]),
+                               self.library_name(), self.do_target_patches)
+
     def do_build(self):
         """ Runs the actual build process """
-        # Downloading qgis is a big process. We escape to another directory
-        # and see if it is downloaded already
-        output = self.do_download_cache()
+        # Downloading qgis is a big process, the distfiles cache keeps it
+        output = self.fetch(self.get_sources()[0])
         
-        # Unpack again for the target build
-        self.unpack(output)
-
         # We need qgis both on the base system as well as the target systen
-        self.push_current_source_path(os.path.join(self.get_source_path(), 
-                                                   self.library_name()))
+        self.push_current_source_path(self.prepare_source(
+            output, self.library_name(), self.do_target_patches))
 
-        self.do_target_patches()
         recon = self.get_recon()
 
         # QGis uses (as only library in this whole project) cmake. We need to set up a number
@@ -147,22 +170,23 @@ class QGisBuilder(Builder):
         our_env['PATH'] = self.get_path()
         our_env['INSTALL_DIR'] = self.get_build_path()
         
-        # We need to add some definitions
-        self.add_definitions()
+        # The build runs out of source, in a tree kept across rebuilds. The
+        # prepared sources are mirrored next to it by content, so a rebuild
+        # only recompiles what the changed files affect
+        mirror_path = os.path.join(self.get_object_path(), 'src')
+        cmake_build_path = os.path.join(self.get_object_path(), 'build')
+        generator = recon.get_cmake_generator()
 
-        self.sed_i('s/SPATIALITE_INCLUDE_DIR/\\SPATIALITE_INCLUDE_DIR\\} \\$\\{SQLITE3_INCLUDE_DIR/',
-                   'src/providers/spatialite/CMakeLists.txt')
-        
         # Do the argument dance
         toolchain_src = os.path.join(self.get_core_patch_path(), 
                                      'cmake', 'android.toolchain.cmake')
-        toolchain_file = os.path.join(self.get_current_source_path(), 
-                                      'android.toolchain.cmake')
-        shutil.copyfile(toolchain_src, toolchain_file)
+        shutil.copyfile(toolchain_src, os.path.join(self.get_current_source_path(),
+                                                    'android.toolchain.cmake'))
+        toolchain_file = os.path.join(mirror_path, 'android.toolchain.cmake')
         
-        python_builder = PythonBuilder(self.get_recon())
+        python_builder = self.get_builder(PythonBuilder)
         host_python_vars = python_builder.get_host_python_vars()
-        cmake_path = os.path.join(self.get_current_source_path(), 'cmake')
+        cmake_path = os.path.join(mirror_path, 'cmake')
         python_syspath = os.path.join(python_builder.get_host_python_prefix(),
                                       'site-packages')
         our_env["PYTHONPATH"] = python_syspath
@@ -175,38 +199,38 @@ class QGisBuilder(Builder):
                       'CMAKE_TOOLCHAIN_FILE' : toolchain_file,
                       'QT_MKSPECS_DIR'       : os.path.join(recon.qt_path, 'mkspecs'),
                       'QT_QMAKE_EXECUTABLE'  : os.path.join(recon.qt_tools_path, 'qmake'),
-                      'GDAL_CONFIG'          : os.path.join(GDALBuilder(recon).get_build_path(),
+                      'GDAL_CONFIG'          : os.path.join(self.get_builder(GDALBuilder).get_build_path(),
                                                             'bin', 'gdal-config'),
-                      'GDAL_INCLUDE_DIR'     : GDALBuilder(recon).get_include_path(),
-                      'GDAL_LIBRARY'         : os.path.join(GDALBuilder(recon).get_build_path(),
+                      'GDAL_INCLUDE_DIR'     : self.get_builder(GDALBuilder).get_include_path(),
+                      'GDAL_LIBRARY'         : os.path.join(self.get_builder(GDALBuilder).get_build_path(),
                                                             'lib', 'libgdal.so'),
-                      'GEOS_CONFIG'          : os.path.join(GeosBuilder(recon).get_build_path(),
+                      'GEOS_CONFIG'          : os.path.join(self.get_builder(GeosBuilder).get_build_path(),
                                                             'bin', 'geos-config'),
-                      'GEOS_INCLUDE_DIR'     : GeosBuilder(recon).get_include_path(),
-                      'GEOS_LIBRARY'         : os.path.join(GeosBuilder(recon).get_build_path(),
+                      'GEOS_INCLUDE_DIR'     : self.get_builder(GeosBuilder).get_include_path(),
+                      'GEOS_LIBRARY'         : os.path.join(self.get_builder(GeosBuilder).get_build_path(),
                                                             'lib', 'libgeos_c.so'),
-                      'EXPAT_INCLUDE_DIR'    : ExpatBuilder(recon).get_include_path(),
-                      'EXPAT_LIBRARY'        : os.path.join(ExpatBuilder(recon).get_build_path(),
+                      'EXPAT_INCLUDE_DIR'    : self.get_builder(ExpatBuilder).get_include_path(),
+                      'EXPAT_LIBRARY'        : os.path.join(self.get_builder(ExpatBuilder).get_build_path(),
                                                             'lib', 'libexpat.so'),
-                      'PROJ_INCLUDE_DIR'     : Proj4Builder(recon).get_include_path(),
-                      'PROJ_LIBRARY'         : os.path.join(Proj4Builder(recon).get_build_path(),
+                      'PROJ_INCLUDE_DIR'     : self.get_builder(Proj4Builder).get_include_path(),
+                      'PROJ_LIBRARY'         : os.path.join(self.get_builder(Proj4Builder).get_build_path(),
                                                             'lib', 'libproj.so'),
-                      'QWT_INCLUDE_DIR'      : QWTBuilder(recon).get_include_path(),
-                      'QWT_LIBRARY'          : os.path.join(QWTBuilder(recon).get_build_path(),
+                      'QWT_INCLUDE_DIR'      : self.get_builder(QWTBuilder).get_include_path(),
+                      'QWT_LIBRARY'          : os.path.join(self.get_builder(QWTBuilder).get_build_path(),
                                                             'libs', 'armeabi', 'libqwt.a'),
                       'QT_MOBILITY_INCLUDE_DIR' : os.path.join(recon.qt_path, 'include',
                                                                'QtMobility'),
-                      'SQLITE3_LIBRARY'      : os.path.join(SQLiteBuilder(recon).get_build_path(),
+                      'SQLITE3_LIBRARY'      : os.path.join(self.get_builder(SQLiteBuilder).get_build_path(),
                                                             'lib', 'libsqlite3.so'),
-                      'SQLITE3_INCLUDE_DIR'  : SQLiteBuilder(recon).get_include_path(),
-                      'SPATIALITE_LIBRARY'   : os.path.join(SpatialiteBuilder(recon).get_build_path(),
+                      'SQLITE3_INCLUDE_DIR'  : self.get_builder(SQLiteBuilder).get_include_path(),
+                      'SPATIALITE_LIBRARY'   : os.path.join(self.get_builder(SpatialiteBuilder).get_build_path(),
                                                             'lib', 'libspatialite.so'),
-                      'SPATIALITE_INCLUDE_DIR'   : os.path.join(SpatialiteBuilder(
-                          recon).get_include_path()),
+                      'SPATIALITE_INCLUDE_DIR'   : os.path.join(self.get_builder(
+                          SpatialiteBuilder).get_include_path()),
                       'FLEX_EXECUTABLE'      : '/usr/bin/flex',
                       'BISON_EXECUTABLE'     : '/usr/bin/bison',
-                      'SPATIALINDEX_INCLUDE_DIR' : SpatialindexBuilder(recon).get_include_path(),
-                      'SPATIALINDEX_LIBRARY' :  os.path.join(SpatialindexBuilder(recon).get_build_path(),
+                      'SPATIALINDEX_INCLUDE_DIR' : self.get_builder(SpatialindexBuilder).get_include_path(),
+                      'SPATIALINDEX_LIBRARY' :  os.path.join(self.get_builder(SpatialindexBuilder).get_build_path(),
                                                              'lib', 'libspatialindex.so'),
                       'NO_SWIG' : 'true', 
                       'PEDANTIC' : 'OFF',
@@ -234,95 +258,111 @@ class QGisBuilder(Builder):
                       'PYUIC4_PROGRAM' : os.path.join(host_python_vars.bin, 'pyuic4'),
                       'PYRCC4_PROGRAM' : os.path.join(host_python_vars.bin, 'pyrcc4')}
 
-        # Need to prepend CMAKE_C(XX)_FLAGS to the already set flags
-        self.sed_ie('1iinclude_directories("%s")' % 
-                   python_builder.get_include_path(), 'CMakeLists.txt')
-        self.sed_ie('1iinclude_directories("%s")' % 
-                   SQLiteBuilder(self.get_recon()).get_include_path(), 'CMakeLists.txt')
-        self.sed_ie('1iinclude_directories("%s")' % 
-                   SpatialiteBuilder(self.get_recon()).get_include_path(), 'CMakeLists.txt')
-
-        # There appears not to be a good (sane) argument to have qgsapplication
-        # exported as something instantiatable, as most likely, the 
-        # provider/plugin will not be at the wanted location.
-
-        # The runtime catches this through specific configuration elements and
-        # uses QApplication (which can be retrieved) as it's normal 
-        # instantiation routine.
-
-        self.sed_ie('s/%Include qgsapplication.sip//',
-                    os.path.join(self.get_current_source_path(), 
-                                 'python', 'core', 'core.sip'))
-
-        # In order to fix a number of compilation problems due to unsupported 
-        # types, most likely "doubles".
-        #
-        # In ARM-Qt, these need to be "floats" and should be encoded as qreal
-
-        self.sed_ie('s/void adjustBoxSize.*$//',
-                    os.path.join(self.get_current_source_path(), 
-                                 'python', 'core', 'qgscomposerscalebar.sip'))
-        self.sed_ie('s/void segmentPositions.*$//',
-                    os.path.join(self.get_current_source_path(), 
-                                 'python', 'core', 'qgscomposerscalebar.sip'))
-        self.sed_ie('s/^.*encodeRealVector.*$//',
-                    os.path.join(self.get_current_source_path(), 
-                                 'python', 'core', 'symbology-ng-core.sip'))
-        self.sed_ie('s/^.*decodeRealVector.*$//',
-                    os.path.join(self.get_current_source_path(), 
-                                 'python', 'core', 'symbology-ng-core.sip'))
-
-
-        self.sed_ie('s/^.*simpleMeasure.*$//',
-                    os.path.join(self.get_current_source_path(), 
-                                 'python', 'analysis', 'qgsgeometryanalyzer.sip'))
-        self.sed_ie('s/^.*perimeterMeasure.*$//',
-                    os.path.join(self.get_current_source_path(), 
-                                 'python', 'analysis', 'qgsgeometryanalyzer.sip'))
-
-        self.sed_i('1i typedef qint64 Q_PID;',
-                   os.path.join(self.get_current_source_path(), 
-                                'python', 'core', 'core.sip'))
-        
+        # The toolchain file forces the compilers, ccache is hooked in as
+        # compiler launcher instead
+        compiler_cache = self.get_compiler_cache()
+        if compiler_cache.is_enabled():
+            arguments['CMAKE_C_COMPILER_LAUNCHER'] = compiler_cache.get_launcher()
+            arguments['CMAKE_CXX_COMPILER_LAUNCHER'] = compiler_cache.get_launcher()
+
+        def patch_sources():
+            # We need to add some definitions
+            self.add_definitions()
+
+            self.rewrite_files([
+                ('src/providers/spatialite/CMakeLists.txt',
+                 [Substitute(r'SPATIALITE_INCLUDE_DIR',
+                             'SPATIALITE_INCLUDE_DIR} ${SQLITE3_INCLUDE_DIR')]),
+
+                # Need to prepend CMAKE_C(XX)_FLAGS to the already set flags
+                ('CMakeLists.txt',
+                 [Insert(1, 'include_directories("%s")' %
+                         python_builder.get_include_path()),
+                  Insert(1, 'include_directories("%s")' %
+                         self.get_builder(SQLiteBuilder).get_include_path()),
+                  Insert(1, 'include_directories("%s")' %
+                         self.get_builder(SpatialiteBuilder).get_include_path())]),
+
+                # There appears not to be a good (sane) argument to have
+                # qgsapplication exported as something instantiatable, as most
+                # likely, the provider/plugin will not be at the wanted location.
+
+                # The runtime catches this through specific configuration elements
+                # and uses QApplication (which can be retrieved) as it's normal
+                # instantiation routine.
+                ('python/core/core.sip',
+                 [Substitute(r'%Include qgsapplication.sip', ''),
+                  Insert(1, 'typedef qint64 Q_PID;')]),
+
+                # In order to fix a number of compilation problems due to
+                # unsupported types, most likely "doubles".
+                #
+                # In ARM-Qt, these need to be "floats" and should be encoded as qreal
+                ('python/core/qgscomposerscalebar.sip',
+                 [Substitute(r'void adjustBoxSize.*$', ''),
+                  Substitute(r'void segmentPositions.*$', '')]),
+                ('python/core/symbology-ng-core.sip',
+                 [Substitute(r'^.*encodeRealVector.*$', ''),
+                  Substitute(r'^.*decodeRealVector.*$', '')]),
+                ('python/analysis/qgsgeometryanalyzer.sip',
+                 [Substitute(r'^.*simpleMeasure.*$', ''),
+                  Substitute(r'^.*perimeterMeasure.*$', '')])])
+
+
+            os.remove(os.path.join(self.get_current_source_path(), 
+                                   'python', 'core', 'qgsapplication.sip'))
+
+        # The edits above cannot be repeated on an already edited tree
+        self.checkpoint('patch', patch_sources)
 
-        os.remove(os.path.join(self.get_current_source_path(), 
-                                 'python', 'core', 'qgsapplication.sip'))
+        with self.trace_phase('mirror sources'):
+            counts = placement.mirror_tree(self.get_current_source_path(),
+                                           mirror_path)
+        print "Mirrored %s: %d updated, %d removed, %d kept" % (
+            mirror_path, counts['updated'], counts['removed'], counts['kept'])
+        self.reuse_cmake_cache(cmake_build_path, mirror_path, generator)
+        if not os.path.exists(cmake_build_path): os.makedirs(cmake_build_path)
 
+        if generator == 'Ninja':
+            # Ninja ignores the jobserver, it runs as many jobs as its lease
+            # holds slots
+            build_args = lambda jobs: ['ninja', '-v', '-j', str(jobs), 'install']
+        else:
+            build_args = ['make', 'VERBOSE=1', 'install']
 
 
         # Need to remove Q_PID declaration in the source files temporarily
         qprocess_sip_path = os.path.join(
-            PyQtBuilder(self.get_recon()).get_build_path(),
+            self.get_builder(PyQtBuilder).get_build_path(),
             'share', 'sip', 'QtCore', 'qprocess.sip')            
 
-        try:
-            self.sed_ir('s|typedef qint64 Q_PID;|//typedef qint64 Q_PID;|',
-                        qprocess_sip_path)
-            args = ['cmake']        
-            for arg in arguments:
-                args.extend(['-D' + arg + '=' + arguments[arg]])
-            args.extend(['.'])
-            process = subprocess.Popen(args, cwd=self.get_current_source_path(), env=our_env)
-            process.communicate(None)
-            if process.returncode != 0:
-                raise ValueError("Failed Process:", args[0])
-            cpuflag = '-j' + str(multiprocessing.cpu_count())
-            process = subprocess.Popen(['make',
-                                        'VERBOSE=1', cpuflag, 'install'],
-                                       cwd=self.get_current_source_path(), env=our_env)
-            process.communicate(None)
-            if process.returncode != 0:
-                raise ValueError("Failed Process:", args[0])
-            print 'Done building QGis Base'
+        # The modification time of qprocess.sip is kept, so the bindings
+        # depending on it are not rebuilt every time
+        with self.shared_file_lock(qprocess_sip_path):
+            try:
+                self.rewrite(qprocess_sip_path,
+                             [Substitute(r'typedef qint64 Q_PID;', '//typedef qint64 Q_PID;')],
+                             keep_times=True)
+                args = ['cmake', '-G', generator]
+                for arg in arguments:
+                    args.extend(['-D' + arg + '=' + arguments[arg]])
+                args.extend([mirror_path])
+                self.checkpoint('configure', functools.partial(
+                    self._call_process, args, cwd=cmake_build_path,
+                    env=our_env, phase='configure'))
+                self.checkpoint('make install', functools.partial(
+                    self._call_process, build_args, cwd=cmake_build_path,
+                    env=our_env, phase='make install'))
+                print 'Done building QGis Base'
         
-            distutils.dir_util.copy_tree(os.path.join(self.get_build_path(), 'include'),
-                                         os.path.join(self.get_include_path()))
+                self.copy_tree(os.path.join(self.get_build_path(), 'include'),
+                               os.path.join(self.get_include_path()))
         
-            self.sed_i('s/typedef qint64 Q_PID;//',
-                       os.path.join(self.get_current_source_path(), 
-                                    'python', 'core', 'core.sip'))
-        finally:
-            self.sed_ir('s|//typedef qint64 Q_PID;|typedef qint64 Q_PID;|',
-                        qprocess_sip_path)
+                self.rewrite('python/core/core.sip',
+                             [Substitute(r'typedef qint64 Q_PID;', '')])
+            finally:
+                self.rewrite(qprocess_sip_path,
+                             [Substitute(r'//typedef qint64 Q_PID;', 'typedef qint64 Q_PID;')],
+                             keep_times=True)
         
         self.mark_finished()
@@ -17,7 +17,7 @@
 #
 
 from qgis_mobility.generator.builder import Builder
-import distutils.dir_util
+from qgis_mobility.generator.rewrite import Substitute
 import os
 
 class QWTBuilder(Builder):
@@ -31,25 +31,38 @@ class QWTBuilder(Builder):
         """ Returns the human readable name of the QWT Builder """
         return 'QWT Build Process'        
 
+    def get_sources(self):
+        """ Returns the URLs of the sources """
+        return ['http://downloads.sourceforge.net/project/qwt/qwt/5.2.0/' +
+                self.library_name() + '.tar.bz2']
+
     def get_default_flags(self):
         """ Returns the default flags salted with dependencies """
         flags  = Builder.get_default_flags(self)
         flags['ANDROID_NDK_ROOT'] = self.get_recon().get_ndk_path()
         return flags
 
+    def prepare_tree(self):
+        """ Prepares the unpacked sources """
+        self.rewrite('qwtconfig.pri',
+                     [Substitute(r'^CONFIG\s*\+=\s*QwtDesigner', '#CONFIG += QwtDesigner'),
+                      Substitute(r'^CONFIG\s*\+=\s*QwtDll', '#CONFIG += QwtDll plugin'),
+                      Substitute(r'^INSTALLBASE.*', 'CONFIG += $INSTALL_DIR')])
+
+    def do_prepare(self):
+        """ Prepares the sources ahead of the build """
+        self.prepare_snapshots(self.fetch(self.get_sources()[0]),
+                               self.library_name(), self.prepare_tree)
+
     def do_build(self):
         """ Runs the actual build process """
-        output = self.wget('http://downloads.sourceforge.net/project/qwt/qwt/5.2.0/' + 
-                           self.library_name() + '.tar.bz2')
-        self.unpack(output)
-        self.push_current_source_path(os.path.join(self.get_source_path(), self.library_name()))
-        self.sed_ie('s/^CONFIG\\s*+=\\s*QwtDesigner/#CONFIG += QwtDesigner/', 'qwtconfig.pri')
-        self.sed_ie('s/^CONFIG\\s*+=\\s*QwtDll/#CONFIG += QwtDll plugin/', 'qwtconfig.pri')
-        self.sed_ie('s/^INSTALLBASE.*/CONFIG += $INSTALL_DIR/', 'qwtconfig.pri')
+        output = self.fetch(self.get_sources()[0])
+        self.push_current_source_path(self.prepare_source(output, self.library_name(),
+                                                          self.prepare_tree))
         self.run_qmake_and_make()
-        distutils.dir_util.copy_tree(os.path.join(self.get_build_path(),
-                                                  'usr', 'local', self.library_name(), 'include'),
-                                     os.path.join(self.get_include_path()))
+        self.copy_tree(os.path.join(self.get_build_path(),
+                                    'usr', 'local', self.library_name(), 'include'),
+                       os.path.join(self.get_include_path()))
         self.mark_finished()
 
 
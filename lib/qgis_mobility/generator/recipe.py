@@ -34,13 +34,21 @@ from qgis_mobility.generator.pyqtmobility_builder import PyQtMobilityBuilder
 from qgis_mobility.generator.runtime_builder import RuntimeBuilder
 from qgis_mobility.generator.creator import Creator
 from qgis_mobility.generator.download import Download
+from qgis_mobility.generator.scheduler import Scheduler, run_concurrently
+from qgis_mobility.generator.buildlog import console
+from qgis_mobility.generator.cacheusage import cache_entries, collect, format_size
+from qgis_mobility.generator.tracing import load_traces, summarize, format_summary
+from qgis_mobility.generator.tracing import estimate_build_times, format_duration
+from qgis_mobility.generator.tracing import estimate_phase_times
 
 import sys
 import os
 
 from collections import namedtuple
 
-__dependency_class_chain = [
+# The builders known to the recipe. The order is only used for presentation,
+# the build order follows from the dependencies each builder declares.
+__builder_classes = [
     StandaloneToolchain,
     SQLiteBuilder,
     GeosBuilder,
@@ -72,7 +80,7 @@ def __resolve_names():
     
     if __resolved_names == None:
         name_dict = {}
-        for dependency_class in __dependency_class_chain:
+        for dependency_class in __builder_classes:
             mod = sys.modules[dependency_class.__module__]
             for obj_name in mod.__dict__.keys():
                 if mod.__dict__[obj_name] == dependency_class:
@@ -91,19 +99,34 @@ def all_values():
 def all_names():
     return __resolved_names.keys()
 
-def get_dependency_class_chain(builder):
+def all_classes():
+    return list(__builder_classes)
+
+def class_for(name):
+    """ Returns the builder class of the target with the given name """
+    names = dict(zip(all_names(), all_values()))
+    if not name in names:
+        raise ValueError("Unknown target: %s, use one of: %s" %
+                         (name, ", ".join(sorted(names.keys()))))
+    return names[name]
+
+def remaining_build_time(builder, duration, phase_times):
     """
-    Resolves the dependency class chain upto now
+    Returns the part of duration a resumed build of builder still takes,
+    leaving out the mean times of the phases its checkpoints passed. A
+    finished architecture leaves out its share of the whole build.
     """
-    global __dependency_class_chain
-    
-    elems = []
-    for dependency in __dependency_class_chain:
-        elems.extend([dependency])
-        if builder.__class__ == dependency:
-            return elems
+    library = builder.library_name()
+    passed = 0.0
+    for checkpoint in builder.get_checkpoints():
+        name = checkpoint.split(':', 1)[-1].split('#')[0]
+        if name == 'built':
+            passed += duration / len(builder.get_arches())
+            continue
+        if name.startswith('source '): name = 'prepare source'
+        passed += phase_times.get((library, name), 0.0)
+    return max(0.0, duration - passed)
 
-    return elems
 
 class Recipe(object):
     class _Target(object):
@@ -113,15 +136,13 @@ class Recipe(object):
             """
             self._recipe = recipe
             self._recon = recon
-            self._builder = target(recon)
+            self._builder = recon.get_builders().get(target)
 
         def build(self):
             """
-            Builds the target
+            Builds the target and its transitive dependencies
             """
-            
-            for dependency_class in get_dependency_class_chain(self._builder):
-                dependency_class(self._recon).make()
+            Scheduler(self._recon).run([self._builder.__class__])
             
         
         def rebuild(self):
@@ -135,7 +156,7 @@ class Recipe(object):
             """
             Cleans up the mess
             """
-            if self._builder.get_build_finished():
+            if self._builder.get_build_record() != None:
                 print '='*80
                 print "Cleaning", self._builder.human_name() 
                 print '='*80
@@ -146,8 +167,9 @@ class Recipe(object):
                 print '='*80
     
     class _All(object):
-        def __init__(self, targets):
+        def __init__(self, targets, recon):
             self._targets = targets
+            self._recon = recon
         
         def clean(self):
             for target in self._targets:
@@ -155,18 +177,239 @@ class Recipe(object):
             
         
         def build(self):
-            self._targets.runtime.build()
+            Scheduler(self._recon).run(all_classes())
+
+    class _Artifacts(object):
+        def __init__(self, recon):
+            self._recon = recon
+
+        def stats(self):
+            """
+            Shows the hit, miss and store counts of the artifact store
+            """
+            store = self._recon.get_artifact_store()
+            statistics = store.statistics()
+            print "Artifact store:", store.get_path()
+            totals = { 'hit' : 0, 'miss' : 0, 'store' : 0 }
+            for library in sorted(statistics.keys()):
+                counts = statistics[library]
+                print "%-40s hits: %5d misses: %5d stored: %5d" % (
+                    library, counts['hit'], counts['miss'], counts['store'])
+                for event in totals: totals[event] += counts[event]
+            lookups = totals['hit'] + totals['miss']
+            rate = 0.0
+            if lookups > 0: rate = 100.0 * totals['hit'] / lookups
+            print "%-40s hits: %5d misses: %5d stored: %5d (%.1f%% hit rate)" % (
+                'Total', totals['hit'], totals['miss'], totals['store'], rate)
+
+    class _Cache(object):
+        def __init__(self, recon):
+            self._recon = recon
+
+        def _entries(self):
+            builders = self._recon.get_builders()
+            return cache_entries(self._recon, [builders.get(builder_class)
+                                               for builder_class in all_classes()])
+
+        def du(self):
+            """
+            Shows the disk usage of the cache by category and by builder
+            """
+            entries = self._entries()
+            def show(title, key):
+                totals = {}
+                for entry in entries:
+                    used, prunable = totals.get(key(entry), (0, 0))
+                    if not entry.needed: prunable += entry.size
+                    totals[key(entry)] = (used + entry.size, prunable)
+                print title
+                for name in sorted(totals.keys(), key=lambda name: totals[name][0],
+                                   reverse=True):
+                    if totals[name][0] == 0: continue
+                    print "  %-40s %12s %12s prunable" % (
+                        name, format_size(totals[name][0]),
+                        format_size(totals[name][1]))
+            total = sum(entry.size for entry in entries)
+            print "Cache %s: %s, budget %s" % (
+                self._recon.get_cache_path(), format_size(total),
+                format_size(self._recon.get_cache_budget()))
+            show("By category:", lambda entry: entry.category)
+            show("By builder:", lambda entry: entry.owner)
+
+        def gc(self):
+            """
+            Removes the least recently used entries of the cache which current
+            builds do not need, until the cache fits into its budget
+            """
+            entries = self._entries()
+            budget = self._recon.get_cache_budget()
+            total = sum(entry.size for entry in entries)
+            garbage = collect(entries, budget)
+            for entry in garbage:
+                print "Removing %s (%s, %s)" % (entry.path, entry.reason,
+                                                format_size(entry.size))
+                entry.remove()
+            freed = sum(entry.size for entry in garbage)
+            print "Cache %s: %s, freed %s, budget %s" % (
+                self._recon.get_cache_path(), format_size(total - freed),
+                format_size(freed), format_size(budget))
+            if total - freed > budget:
+                print "The entries current builds need exceed the budget"
 
     def __init__(self, recon):
         names = all_names()
         targets = namedtuple('_Targets', names)
         self.recipe = targets(*map (lambda v: Recipe._Target(self, v, recon), 
                                     all_values()))
-        self.all = Recipe._All(self.recipe)
+        self.all = Recipe._All(self.recipe, recon)
         self.creator = Creator(recon)
         self.download = Download(recon)
+        self.artifacts = Recipe._Artifacts(recon)
+        self.cache = Recipe._Cache(recon)
         self.__recon = recon
     
+    def status(self):
+        """ Shows for every builder why it is stale or up to date """
+        recon = self.__recon
+        for builder_class in all_classes():
+            builder = recon.get_builders().get(builder_class)
+            if not hasattr(builder, 'get_stale_reasons'):
+                if os.path.exists(recon.get_toolchain_path()): state = 'up to date'
+                else: state = 'stale: not built yet'
+                print "%-48s %s" % (builder_class.__name__, state)
+                continue
+            reasons = builder.get_stale_reasons()
+            if len(reasons) == 0: state = 'up to date'
+            else: state = 'stale: ' + ', '.join(reasons)
+            print "%-48s %s" % (builder.human_name(), state)
+
+    def fetch(self):
+        """
+        Downloads the sources of all builders into the distfiles cache,
+        several at once, so the builds do not need the network
+        """
+        recon = self.__recon
+        failed = []
+        def fetcher(builder_class):
+            def fetch():
+                try:
+                    builder_class(recon).fetch_sources()
+                except Exception as e:
+                    console("[%s] Fetching failed: %s" % (builder_class.__name__, e))
+                    failed.append(builder_class.__name__)
+            return fetch
+        try:
+            run_concurrently([fetcher(builder_class)
+                              for builder_class in all_classes()
+                              if hasattr(builder_class, 'fetch_sources')],
+                             recon.get_fetchers())
+        finally:
+            recon.get_build_logs().close()
+            recon.get_tracer().write()
+        if len(failed) > 0:
+            raise ValueError("Could not fetch the sources of: " + ", ".join(failed))
+        print "All sources are in:", recon.get_distfiles().get_path()
+
+    def plan(self, target):
+        """
+        Shows which builders a build of target would skip, restore from the
+        artifact store, resume or build, and why, without building anything.
+        The estimate is the wall time of the build on the scheduler's workers,
+        from the earlier builds traced.
+        """
+        recon = self.__recon
+        builders = recon.get_builders()
+        store = recon.get_artifact_store()
+        estimates = estimate_build_times(recon.get_tracer().get_path(), 10)
+        phase_times = estimate_phase_times(recon.get_tracer().get_path(), 10)
+        scheduler = Scheduler(recon)
+        counts = {}
+        durations = {}
+        unknown = 0
+        for builder_class in scheduler.resolve([class_for(target)]):
+            builder = builders.get(builder_class)
+            if not hasattr(builder, 'get_stale_reasons'):
+                name = builder_class.__name__
+                library = 'toolchain'
+                if os.path.exists(recon.get_toolchain_path()):
+                    decision, reason = 'skip', 'up to date'
+                else:
+                    decision, reason = 'build', 'not built yet'
+            else:
+                name = builder.human_name()
+                library = builder.library_name()
+                reasons = builder.get_stale_reasons()
+                digest = builder.get_fingerprint().digest()
+                if len(reasons) == 0:
+                    decision, reason = 'skip', 'up to date'
+                elif builder.is_resumable():
+                    decision = 'resume'
+                    reason = "after %s, %s" % (builder.get_checkpoints()[-1],
+                                               ', '.join(reasons))
+                elif (len(builder.get_artifact_paths()) > 0 and
+                      store.contains(library, digest)):
+                    decision = 'restore'
+                    reason = "artifact %s, %s" % (digest[:12], ', '.join(reasons))
+                else:
+                    decision, reason = 'build', ', '.join(reasons)
+            estimate = ''
+            if decision in ['build', 'resume']:
+                if library in estimates:
+                    duration = estimates[library]
+                    if decision == 'resume':
+                        duration = remaining_build_time(builder, duration,
+                                                        phase_times)
+                    durations[builder_class] = duration
+                    estimate = '~' + format_duration(duration)
+                else:
+                    unknown += 1
+                    estimate = '?'
+            counts[decision] = counts.get(decision, 0) + 1
+            print "%-8s %-48s %9s  %s" % (decision, name, estimate, reason)
+        summary = ', '.join(["%d to %s" % (counts[outcome], outcome)
+                             for outcome in ['build', 'resume', 'restore', 'skip']
+                             if outcome in counts])
+        if counts.get('build', 0) + counts.get('resume', 0) == 0:
+            print "Plan for %s: %s, nothing to build" % (target, summary)
+        else:
+            wall = scheduler.estimate([class_for(target)], durations)
+            workers = scheduler.get_workers()
+            estimated = "estimated %s along the critical path with %d %s" % (
+                format_duration(wall), workers,
+                'worker' if workers == 1 else 'workers')
+            if unknown > 0: estimated += ", %d without earlier runs" % unknown
+            print "Plan for %s: %s, %s" % (target, summary, estimated)
+
+    def flags(self, target):
+        """ Shows the flags, configure flags and tools a target builds with """
+        builders = self.__recon.get_builders()
+        target_class = class_for(target)
+        if not hasattr(target_class, 'get_flags'):
+            raise ValueError("The target %s has no build flags" % target)
+        for arch in builders.get(target_class).get_arches():
+            builder = builders.get(target_class, arch)
+            print "%s (%s)" % (builder.human_name(), arch)
+            flags = builder.get_flags()
+            mappings = builder.get_default_toolchain_mappings()
+            for name in sorted(flags.keys()):
+                print "  %-16s %s" % (name, flags[name])
+            for name in sorted(mappings.keys()):
+                print "  %-16s %s" % (name, mappings[name])
+            print "  %-16s %s" % ('configure', ' '.join(
+                builder.get_default_configure_flags()))
+
+    def report(self):
+        """ Shows the slowest builders and phases of the recent builds """
+        path = self.__recon.get_tracer().get_path()
+        traces = load_traces(path, 10)
+        if len(traces) == 0:
+            print "No build traces in:", path
+            return
+        builders, phases = summarize([event for events in traces
+                                      for event in events])
+        print "Build traces in %s, the last %d runs" % (path, len(traces))
+        for line in format_summary(builders, phases): print line
+
     def distclean(self):
         """ Removes everything """
         
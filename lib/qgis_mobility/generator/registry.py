@@ -0,0 +1,53 @@
+#
+#  This file is part of QGis Mobility
+#
+#  QGis Mobility is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  QGis Mobility is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with QGis Mobility. If not, see
+#  <http://www.gnu.org/licenses/>.
+#
+
+import threading
+
+
+class BuilderRegistry(object):
+    """
+    Hands out one builder per class and architecture, for looking up the
+    paths, flags and fingerprints of other builders. These instances are
+    shared, so they must not be altered: builds run on instances of their
+    own, which change their architecture and source paths as they go.
+    """
+
+    def __init__(self, recon):
+        self._recon = recon
+        self._builders = {}
+        # Builders look up other builders while being constructed
+        self._lock = threading.RLock()
+
+    def get(self, builder_class, arch=None):
+        """
+        Returns the builder of builder_class set to arch, or to its default
+        architecture if arch is None
+        """
+        key = (builder_class, arch)
+        with self._lock:
+            if not key in self._builders:
+                builder = builder_class(self._recon)
+                if arch != None: builder.set_current_arch(arch)
+                self._builders[key] = builder
+            return self._builders[key]
+
+    def invalidate(self):
+        """ Makes all builders resolve their paths and flags again """
+        with self._lock:
+            for builder in self._builders.values():
+                if hasattr(builder, 'invalidate'): builder.invalidate()
@@ -0,0 +1,118 @@
+#
+#  This file is part of QGis Mobility
+#
+#  QGis Mobility is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  QGis Mobility is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with QGis Mobility. If not, see
+#  <http://www.gnu.org/licenses/>.
+#
+
+import os
+import re
+import shutil
+import tempfile
+import functools
+
+from qgis_mobility.generator.scheduler import run_concurrently
+
+
+class Substitute(object):
+    """
+    Replaces pattern by replacement within each line, like sed's s command.
+    Only the first match of a line is replaced, unless every is set (sed's
+    g flag). The replacement uses the syntax of re.sub.
+    """
+
+    def __init__(self, pattern, replacement, every=False):
+        self._pattern = re.compile(pattern)
+        self._replacement = replacement
+        self._count = 0 if every else 1
+
+    def apply(self, number, line):
+        """ Returns the edited lines and whether the edit matched """
+        result, matches = self._pattern.subn(self._replacement, line,
+                                             self._count)
+        return [result], matches > 0
+
+    def __repr__(self):
+        return "Substitute(%r, %r)" % (self._pattern.pattern, self._replacement)
+
+
+class Insert(object):
+    """ Inserts text as a line before the given line number, like sed's i """
+
+    def __init__(self, number, text):
+        self._number = number
+        self._text = text
+
+    def apply(self, number, line):
+        if number != self._number: return [line], False
+        return [self._text + '\n', line], True
+
+    def __repr__(self):
+        return "Insert(%d, %r)" % (self._number, self._text)
+
+
+class Change(object):
+    """ Replaces every line matching pattern by text, like sed's c command """
+
+    def __init__(self, pattern, text):
+        self._pattern = re.compile(pattern)
+        self._text = text
+
+    def apply(self, number, line):
+        if self._pattern.search(line) == None: return [line], False
+        return [self._text + '\n'], True
+
+    def __repr__(self):
+        return "Change(%r, %r)" % (self._pattern.pattern, self._text)
+
+
+def rewrite(path, edits):
+    """
+    Applies the edits to every line of the file at path, in the given order,
+    with a single read and a single atomic write. Returns the edits which
+    matched nothing.
+    """
+    with open(path) as f:
+        lines = f.readlines()
+    matched = [False] * len(edits)
+    for index, edit in enumerate(edits):
+        result = []
+        for number, line in enumerate(lines):
+            edited, hit = edit.apply(number + 1, line)
+            result.extend(edited)
+            matched[index] = matched[index] or hit
+        lines = result
+
+    descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path) or '.')
+    try:
+        with os.fdopen(descriptor, 'w') as f:
+            f.writelines(lines)
+        shutil.copymode(path, temporary)
+        os.rename(temporary, path)
+    finally:
+        if os.path.exists(temporary): os.remove(temporary)
+    return [edit for index, edit in enumerate(edits) if not matched[index]]
+
+def rewrite_files(files):
+    """
+    Applies rewrite to many files concurrently. Takes a list of (path,
+    edits) pairs and returns a list of (path, edit) pairs of the edits which
+    matched nothing.
+    """
+    unmatched = []
+    def work(path, edits):
+        for edit in rewrite(path, edits): unmatched.append((path, edit))
+    run_concurrently([functools.partial(work, path, edits)
+                      for path, edits in files])
+    return unmatched
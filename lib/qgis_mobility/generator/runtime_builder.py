@@ -17,13 +17,14 @@
 #
 
 from qgis_mobility.generator.builder import Builder
-import distutils.dir_util
+from qgis_mobility.generator.rewrite import Substitute
+from qgis_mobility.generator import placement
 import os
 import glob
-import shutil
 from qgis_mobility.generator.python_builder import PythonBuilder
 from qgis_mobility.generator.qgis_builder import QGisBuilder
 from qgis_mobility.generator.pyqt_builder import PyQtBuilder
+from qgis_mobility.generator.pyqtmobility_builder import PyQtMobilityBuilder
 
 
 class RuntimeBuilder(Builder):
@@ -37,6 +38,15 @@ class RuntimeBuilder(Builder):
         """ Returns the human readable name of the Runtime """
         return 'Runtime Build Process'
 
+    @classmethod
+    def dependencies(cls):
+        """ Returns the builders this library is built against """
+        return [QGisBuilder, PythonBuilder, PyQtBuilder, PyQtMobilityBuilder]
+
+    def get_local_sources(self):
+        """ The runtime is built from the runtime submodule """
+        return [self.get_runtime_path()]
+
 
     def pyqt4_override_flags(self):
         return "-x QSETINT_CONVERSION -x QSETTYPE_CONVERSION -x VendorID -t WS_UNKOWN -x PyQt_NoPrintRangeBug -t Qt_4_8_0 -x Py_v3 -g"
@@ -53,6 +63,14 @@ class RuntimeBuilder(Builder):
         flags['LD_RUN_PATH'] = os.path.join(self.get_recon().get_qt_path(), 'lib')
         return flags
 
+    def uses_config_cache(self):
+        """ The regenerated configure checks against the Qt libraries """
+        return False
+
+    def supports_checkpoints(self):
+        """ The runtime sources are copied in and edited outside checkpoints """
+        return False
+
     def get_default_flags(self):
         cflags = '-Wno-psabi -fsigned-char -mthumb'
         ldflags = '-Wl,--fix-cortex-a8'
@@ -63,8 +81,8 @@ class RuntimeBuilder(Builder):
 
     def get_default_configure_flags(self):
         flags = Builder.get_default_configure_flags(self)
-        flags.extend(['--with-qgis-base-path=' + QGisBuilder(self.get_recon()).get_build_path(),
-                      '--with-python-base-path=' + PythonBuilder(self.get_recon()).get_build_path(),
+        flags.extend(['--with-qgis-base-path=' + self.get_builder(QGisBuilder).get_build_path(),
+                      '--with-python-base-path=' + self.get_builder(PythonBuilder).get_build_path(),
                       '--with-qt-base-path=' + self.get_recon().get_qt_path(),
                       '--with-qt-library-path=' + os.path.join(self.get_source_path(), 'lib'),
                       '--with-qt-include-path=' + os.path.join(self.get_recon().get_qt_path(), 'include'),
@@ -74,7 +92,7 @@ class RuntimeBuilder(Builder):
                       '--with-sip-binary-path=' + self.host_python_binary_path(),
                       '--with-preconfig-path=/data/data/org.kde.necessitas.example.QGisMobility/files',
                       '--with-project-code-path=/data/data/org.kde.necessitas.example.QGisMobility/files/application',
-                      '--with-xtra-sip-dirs=' + os.path.join(QGisBuilder(self.get_recon()).get_source_path(),
+                      '--with-xtra-sip-dirs=' + os.path.join(self.get_builder(QGisBuilder).get_source_path(),
                                                              'qgis-1.8.0/python'),
                       '--disable-silent-rules'])
         return flags
@@ -90,31 +108,35 @@ class RuntimeBuilder(Builder):
 
     def do_build(self):
         """ Runs the actual build process """
-        distutils.dir_util.copy_tree(self.get_runtime_path(), self.get_source_path())
+        # autoreconf writes into the tree, so it must not share the files
+        self.copy_tree(self.get_runtime_path(), self.get_source_path(), link=False)
         os.mkdir(os.path.join(self.get_source_path(), 'lib'))
         for libname in glob.glob(os.path.join(self.get_recon().get_qt_path(), 'lib', '*.so')):
             outlibname = os.path.join(self.get_source_path(), 'lib', os.path.split(libname)[-1])
-            print "Copying for libtool's sake %s to %s" % (libname, outlibname)
-            shutil.copyfile(libname, outlibname)
+            print "Linking for libtool's sake %s to %s" % (libname, outlibname)
+            placement.place_symlink(libname, outlibname)
         self.run_autoreconf()
-        self.sed_ir('s/(hardcode_into_libs)=.*$/\\1=no/', 'configure')
+        self.rewrite('configure', [Substitute(r'(hardcode_into_libs)=.*$', r'\1=no')])
         self.fix_config_sub_and_guess()
 
         # Need to remove Q_PID declaration in the source files temporarily
         qprocess_sip_path = os.path.join(
-            PyQtBuilder(self.get_recon()).get_build_path(),
+            self.get_builder(PyQtBuilder).get_build_path(),
             'share', 'sip', 'QtCore', 'qprocess.sip')            
 
-        try:
-            self.sed_ir('s|typedef qint64 Q_PID;|//typedef qint64 Q_PID;|',
-                        qprocess_sip_path)
-            self.run_autotools_and_make()
-        finally:
-            self.sed_ir('s|//typedef qint64 Q_PID;|typedef qint64 Q_PID;|',
-                        qprocess_sip_path)
+        with self.shared_file_lock(qprocess_sip_path):
+            try:
+                self.rewrite(qprocess_sip_path,
+                             [Substitute(r'typedef qint64 Q_PID;', '//typedef qint64 Q_PID;')],
+                             keep_times=True)
+                self.run_autotools_and_make()
+            finally:
+                self.rewrite(qprocess_sip_path,
+                             [Substitute(r'//typedef qint64 Q_PID;', 'typedef qint64 Q_PID;')],
+                             keep_times=True)
             
         source_include_path = os.path.join(self.get_build_path(), 'include')
         if os.path.exists(source_include_path):
-            distutils.dir_util.copy_tree(
+            self.copy_tree(
                 source_include_path, self.get_include_path())
         self.mark_finished()
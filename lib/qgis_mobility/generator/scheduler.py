@@ -0,0 +1,207 @@
+#
+#  This file is part of QGis Mobility
+#
+#  QGis Mobility is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  QGis Mobility is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with QGis Mobility. If not, see
+#  <http://www.gnu.org/licenses/>.
+#
+
+import sys
+import threading
+
+from qgis_mobility.generator.buildlog import console
+
+
+def run_concurrently(functions, limit=None):
+    """
+    Runs every function given on its own thread and waits for all of them
+    to finish, with at most limit of them running at once if given. If any
+    of the functions raised, the first exception is raised again once all
+    threads have ended.
+    """
+    failures = []
+    slots = threading.BoundedSemaphore(limit or max(1, len(functions)))
+    def work(function):
+        try:
+            with slots:
+                function()
+        except Exception:
+            failures.append(sys.exc_info())
+
+    threads = [threading.Thread(target=work, args=(function,))
+               for function in functions]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        while thread.is_alive(): thread.join(1.0)
+
+    if len(failures) > 0:
+        exc_type, exc_value, exc_traceback = failures[0]
+        raise exc_type, exc_value, exc_traceback
+
+
+class Scheduler(object):
+    """
+    Builds targets and their transitive dependencies, running every builder
+    whose dependencies are satisfied concurrently on a bounded pool of workers.
+    Meanwhile, preparers download, unpack and patch the sources of the
+    builders still waiting for their dependencies.
+    """
+
+    def __init__(self, recon, workers=None, preparers=2):
+        self._recon = recon
+        if workers == None: workers = recon.get_workers()
+        self._workers = max(1, workers)
+        self._preparers = max(0, preparers)
+
+    def dependencies_of(self, dependency_class):
+        """ Returns the builder classes the given class directly depends on """
+        return dependency_class.dependencies()
+
+    def resolve(self, classes):
+        """
+        Returns the transitive dependency closure of the given classes in a
+        topological order, dependencies first
+        """
+        ordered = []
+        visiting = []
+        def visit(dependency_class):
+            if dependency_class in ordered: return
+            if dependency_class in visiting:
+                raise ValueError("Dependency cycle detected at: " +
+                                 dependency_class.__name__)
+            visiting.append(dependency_class)
+            for dependency in self.dependencies_of(dependency_class):
+                visit(dependency)
+            visiting.remove(dependency_class)
+            ordered.append(dependency_class)
+
+        for dependency_class in classes: visit(dependency_class)
+        return ordered
+
+    def estimate(self, classes, durations):
+        """
+        Returns the wall time in seconds run would take for classes, given
+        the durations of the classes in seconds, missing ones take none. The
+        classes start in the order run starts them, each once its
+        dependencies finished and a worker is free.
+        """
+        pending = self.resolve(classes)
+        finished = []
+        running = []
+        now = 0.0
+        while len(pending) > 0 or len(running) > 0:
+            for dependency_class in list(pending):
+                if len(running) >= self._workers: break
+                dependencies = self.dependencies_of(dependency_class)
+                if all(d in finished for d in dependencies):
+                    pending.remove(dependency_class)
+                    running.append((now + durations.get(dependency_class, 0.0),
+                                    dependency_class))
+            running.sort(key=lambda entry: entry[0])
+            now, dependency_class = running.pop(0)
+            finished.append(dependency_class)
+        return now
+
+    def get_workers(self):
+        """ Returns the amount of builders run makes at once """
+        return self._workers
+
+    def instantiate(self, dependency_class):
+        """
+        Returns the builder instance used to make the given class. Builds
+        alter their instance, so it is not the shared one of the registry.
+        """
+        return dependency_class(self._recon)
+
+    def run(self, classes):
+        """
+        Makes every class in the dependency closure of classes. When a
+        builder fails, no new builders are started, the running ones are
+        waited for and the first failure is raised. The build logs and the
+        build trace are written in any case.
+        """
+        try:
+            self._run(classes)
+        finally:
+            self._recon.get_build_logs().close()
+            self._recon.get_tracer().write()
+
+    def _run(self, classes):
+        pending = self.resolve(classes)
+        finished = []
+        running = []
+        failures = []
+        condition = threading.Condition()
+        # The builders whose sources are not prepared ahead yet, the
+        # distfiles and snapshot locks keep a build from redoing the work
+        # of a preparer running at the same time
+        preparing = [dependency_class for dependency_class in pending
+                     if hasattr(dependency_class, 'prepare')]
+
+        def prepare():
+            while True:
+                with condition:
+                    if len(failures) > 0 or len(preparing) == 0: return
+                    dependency_class = preparing.pop(0)
+                try:
+                    self.instantiate(dependency_class).prepare()
+                except Exception as e:
+                    # The build prepares the sources again and fails properly
+                    console("[%s] Preparing ahead failed: %s" % (
+                        dependency_class.__name__, e))
+
+        preparers = [threading.Thread(target=prepare)
+                     for index in range(min(self._preparers, len(preparing)))]
+        for preparer in preparers:
+            preparer.daemon = True
+            preparer.start()
+
+        def work(dependency_class):
+            failure = None
+            try:
+                self.instantiate(dependency_class).make()
+            except Exception:
+                failure = sys.exc_info()
+            with condition:
+                running.remove(dependency_class)
+                if failure == None: finished.append(dependency_class)
+                else: failures.append(failure)
+                condition.notify_all()
+
+        with condition:
+            while len(running) > 0 or (len(pending) > 0 and len(failures) == 0):
+                if len(failures) == 0:
+                    for dependency_class in list(pending):
+                        if len(running) >= self._workers: break
+                        dependencies = self.dependencies_of(dependency_class)
+                        if all(d in finished for d in dependencies):
+                            pending.remove(dependency_class)
+                            if dependency_class in preparing:
+                                preparing.remove(dependency_class)
+                            running.append(dependency_class)
+                            thread = threading.Thread(target=work,
+                                                      args=(dependency_class,))
+                            thread.daemon = True
+                            thread.start()
+                # A timeout keeps the main thread responsive to interrupts
+                condition.wait(1.0)
+            del preparing[:]
+
+        for preparer in preparers:
+            while preparer.is_alive(): preparer.join(1.0)
+
+        if len(failures) > 0:
+            exc_type, exc_value, exc_traceback = failures[0]
+            raise exc_type, exc_value, exc_traceback
@@ -32,17 +32,32 @@ class SipBuilder(PythonianBuilder):
         """ Returns the human readable name of the Python Builder """
         return 'SIP (Binding Processor for Python) Build Process'
 
-    def do_build(self):
-        """ Starts the build process of Android SIP """
-
-        output = self.wget('http://sourceforge.net/projects/pyqt/files/sip/' + 
-                           self.library_name() + '/' + self.library_name() + '.tar.gz/download')
+    def get_sources(self):
+        """ Returns the URLs of the sources """
+        return ['http://sourceforge.net/projects/pyqt/files/sip/' +
+                self.library_name() + '/' + self.library_name() + '.tar.gz/download']
 
-        self.unpack(output)
+    def get_arches(self):
+        """ SIP is built for the target and installed into the host python """
+        return ['host', 'android']
 
-        self.push_current_source_path(os.path.join(self.get_source_path(), self.library_name()))
+    def prepare_tree(self):
+        """ Prepares the unpacked sources """
         shutil.copyfile(os.path.join(self.get_patch_path(), 'android-g++'),
                         os.path.join(self.get_current_source_path(), 'specs', 'android-g++'))
+
+    def do_prepare(self):
+        """ Prepares the sources of both builds ahead of them """
+        self.prepare_snapshots(self.fetch(self.get_sources()[0]),
+                               self.library_name(), self.prepare_tree)
+
+    def do_build(self):
+        """ Starts the build process of Android SIP """
+
+        output = self.fetch(self.get_sources()[0])
+
+        self.push_current_source_path(self.prepare_source(output, self.library_name(),
+                                                          self.prepare_tree))
         
         options=['-e' + self.get_include_path(), 
                  '-pandroid-g++', 'INCDIR=' + self.get_include_path(),
@@ -52,9 +67,17 @@ class SipBuilder(PythonianBuilder):
                  'STRIP=']
 
         self.run_py_configure_and_make(options=options)
+        self.pop_current_source_path()
+
+        # Need to install SIP to host python. The host build has a tree of
+        # its own, which is kept and only made incrementally while unchanged
+        self.set_current_arch('host')
+        self.push_current_source_path(self.prepare_source(output, self.library_name(),
+                                                          self.prepare_tree, keep=True))
         self.run_py_configure_and_make(host=True)
-        # Need to install SIP to host python
-        
+        self.pop_current_source_path()
+        self.set_current_arch('android')
+
 
         self.mark_finished()
 
@@ -0,0 +1,103 @@
+#
+#  This file is part of QGis Mobility
+#
+#  QGis Mobility is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  QGis Mobility is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with QGis Mobility. If not, see
+#  <http://www.gnu.org/licenses/>.
+#
+
+import os
+import errno
+import shutil
+import tempfile
+
+from qgis_mobility.generator import locking
+
+
+class SnapshotCache(object):
+    """
+    Keeps pristine source trees, as they are after unpacking, patching and
+    regenerating the build system, so later builds only need to copy them.
+    Working copies are reflink copies where the file system supports it. With
+    hardlinks, working copies share the files of the snapshot, which is only
+    safe as long as builds replace files instead of writing into them.
+    """
+
+    def __init__(self, path, hardlink=False):
+        self._path = os.path.abspath(path)
+        self._hardlink = hardlink
+
+    def get_path(self):
+        """ Returns the directory of the cache """
+        return self._path
+
+    def get_snapshot_path(self, library, key):
+        """ Returns the directory holding the snapshot of library with key """
+        return os.path.join(self._path, library, key)
+
+    def _lock_for(self, library, key):
+        """ Returns the lock on the snapshot, shared with other runs """
+        return locking.lock_for(os.path.join(self._path, library,
+                                             '.' + key + '.lock'))
+
+    def _materialize(self, tree, destination, run):
+        """ Creates destination as a working copy of tree """
+        if os.path.exists(destination): shutil.rmtree(destination)
+        if self._hardlink: args = ['cp', '-al', tree, destination]
+        else: args = ['cp', '-a', '--reflink=auto', tree, destination]
+        run(args)
+
+    def prepare(self, library, key, directory, destination, create, run):
+        """
+        Makes destination a working copy of the snapshot of directory for
+        library with key, creating the snapshot first if needed. The run
+        callable runs the copy process and raises ValueError on failure.
+        """
+        self._materialize(self.create(library, key, directory, create),
+                          destination, run)
+        return destination
+
+    def create(self, library, key, directory, create):
+        """
+        Returns the tree of the snapshot of directory for library with key.
+        If there is no snapshot yet, create is called with an empty directory
+        and has to produce directory within it.
+        """
+        snapshot_path = self.get_snapshot_path(library, key)
+        tree = os.path.join(snapshot_path, directory)
+        with self._lock_for(library, key):
+            if not os.path.exists(tree):
+                parent = os.path.dirname(snapshot_path)
+                try:
+                    os.makedirs(parent)
+                except OSError as e:
+                    if e.errno != errno.EEXIST: raise
+                work_path = tempfile.mkdtemp(suffix='.tmp', dir=parent)
+                try:
+                    create(work_path)
+                    if not os.path.isdir(os.path.join(work_path, directory)):
+                        raise ValueError("Source preparation did not produce: " +
+                                         directory)
+                    try:
+                        os.rename(work_path, snapshot_path)
+                    except OSError as e:
+                        # Another qgsmg run stored the same snapshot first
+                        if not e.errno in [errno.EEXIST, errno.ENOTEMPTY]: raise
+                finally:
+                    if os.path.exists(work_path): shutil.rmtree(work_path)
+                print "Stored source snapshot:", snapshot_path
+            else:
+                # Touching the snapshot keeps track of its last use
+                os.utime(snapshot_path, None)
+                print "Using source snapshot:", snapshot_path
+        return tree
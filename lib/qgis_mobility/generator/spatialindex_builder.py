@@ -17,9 +17,9 @@
 #
 
 from qgis_mobility.generator.builder import Builder
-import distutils.dir_util
+from qgis_mobility.generator.rewrite import Substitute
+from qgis_mobility.generator import placement
 import os
-import shutil
 
 class SpatialindexBuilder(Builder):
     """ Represents the build strategy for the SpatialIndex library """
@@ -32,6 +32,10 @@ class SpatialindexBuilder(Builder):
         """ Returns the human readable name of the Spatialite Builder """
         return 'SpatialIndex Build Process'
 
+    def get_sources(self):
+        """ Returns the URLs of the sources """
+        return ['http://download.osgeo.org/libspatialindex/spatialindex-src-1.7.1.tar.gz']
+
 
     def get_default_flags(self):
         """ Returns the default flags salted with dependencies """
@@ -46,25 +50,34 @@ class SpatialindexBuilder(Builder):
         return flags
 
 
-    def do_build(self):
-        """ Runs the actual build process """
-        output = self.wget('http://download.osgeo.org/libspatialindex/spatialindex-src-1.7.1.tar.gz')
-        self.unpack(output)
-        self.push_current_source_path(os.path.join(self.get_source_path(), 'spatialindex-src-1.7.1'))
+    def prepare_tree(self):
+        """ Prepares the unpacked sources """
         self.fix_config_sub_and_guess()
         self.patch('spatialindex.patch', strip=1)
-        self.sed_ir('s/(hardcode_into_libs)=.*$/\\1=no/', 'configure')
+        self.rewrite('configure', [Substitute(r'(hardcode_into_libs)=.*$', r'\1=no')])
+
+    def do_prepare(self):
+        """ Prepares the sources ahead of the build """
+        self.prepare_snapshots(self.fetch(self.get_sources()[0]),
+                               'spatialindex-src-1.7.1', self.prepare_tree)
+
+    def do_build(self):
+        """ Runs the actual build process """
+        output = self.fetch(self.get_sources()[0])
+        self.push_current_source_path(self.prepare_source(output, 'spatialindex-src-1.7.1',
+                                                          self.prepare_tree))
         self.run_autotools_and_make(harness=False)        
-        distutils.dir_util.copy_tree(os.path.join(self.get_build_path(), 'include'),
-                                     os.path.join(self.get_include_path()))
-        # Fix header weirdness
+        self.copy_tree(os.path.join(self.get_build_path(), 'include'),
+                       os.path.join(self.get_include_path()))
+        # Fix header weirdness, the headers are expected one level up as well
         src = os.path.join(self.get_include_path(), 'spatialindex')
         src_files = os.listdir(src)
         for file_name in src_files:
             full_file_name = os.path.join(src, file_name)
             if (os.path.isfile(full_file_name)):
-                shutil.copy(full_file_name, self.get_include_path())
-        shutil.copytree(os.path.join(src, 'tools'), os.path.join(self.get_include_path(), 'tools'))
+                placement.place_file(full_file_name,
+                                     os.path.join(self.get_include_path(), file_name))
+        self.copy_tree(os.path.join(src, 'tools'), os.path.join(self.get_include_path(), 'tools'))
         self.mark_finished()
 
 
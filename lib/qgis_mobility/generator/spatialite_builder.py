@@ -17,7 +17,7 @@
 #
 
 from qgis_mobility.generator.builder import Builder
-import distutils.dir_util
+from qgis_mobility.generator.rewrite import Substitute
 import os
 import shutil
 
@@ -37,16 +37,29 @@ class SpatialiteBuilder(Builder):
         """ Returns the human readable name of the Spatialite Builder """
         return 'SpatiaLite Build Process'
 
+    @classmethod
+    def dependencies(cls):
+        """ Returns the builders this library is built against """
+        return [SQLiteBuilder, GeosBuilder, Proj4Builder]
+
+    def get_sources(self):
+        """ Returns the URLs of the sources """
+        return ['http://www.gaia-gis.it/gaia-sins/libspatialite-sources/lib' +
+                self.library_name() + '.tar.gz']
+
+    def get_arches(self):
+        """ The library is needed on the host as well as on the target """
+        return ['host', 'android']
+
 
     def get_default_flags(self):
         """ Returns the default flags salted with dependencies """
         default_flags = Builder.get_default_flags(self)
         arch = self.get_current_arch()
-        flags = SQLiteBuilder(self.get_recon(), arch).salt_flags(default_flags)
-        flags = GeosBuilder(self.get_recon(), arch).salt_flags(flags)
-        flags = Proj4Builder(self.get_recon(), arch).salt_flags(flags)
+        flags = self.get_builder(SQLiteBuilder, arch).salt_flags(default_flags)
+        flags = self.get_builder(GeosBuilder, arch).salt_flags(flags)
+        flags = self.get_builder(Proj4Builder, arch).salt_flags(flags)
         flags['LDFLAGS'] += ' -lm'
-        print flags
         return flags
 
     def get_default_configure_flags(self):
@@ -59,40 +72,47 @@ class SpatialiteBuilder(Builder):
         If arch is set to "host", the build is done for the host environment.
         If arch is set to "target", the build is done for the target environment.
         """
-        host = (arch == "host")
         self.set_current_arch(arch)
         
-        self.unpack(output)
-        
-        base_source_path = os.path.join(self.get_source_path(), 
-                                        'lib' + self.library_name())
-        
-        if not os.path.exists(base_source_path + '/m4'): 
-              os.makedirs(base_source_path + '/m4')
-
+        base_source_path = self.prepare_source(output, 'lib' + self.library_name(),
+                                               self.prepare_tree)
         self.push_current_source_path(base_source_path)
-        self.fix_config_sub_and_guess()
-        self.sed_ir('s/(\-version\-info 4\:0\:2)/\-avoid\-version/g', 'src/Makefile.am')
-        self.sed_ir('s/#include <freexl.h>//', 'src/shapefiles/shapefiles.c')
-        self.run_autoreconf()
-        if not host:
-            self.sed_i("s/@MINGW_FALSE@am__append_1 = -lpthread -ldl/@MINGW_FALSE@am_append_1 = -ldl/", 
-                   'src/Makefile.in')
-        self.sed_ir('s/(hardcode_into_libs)=.*$/\\1=no/', 'configure')
         self.run_autotools_and_make()
-        distutils.dir_util.copy_tree(os.path.join(self.get_build_path(), 'include'),
-                                     os.path.join(self.get_include_path()))
+        self.copy_tree(os.path.join(self.get_build_path(), 'include'),
+                       os.path.join(self.get_include_path()))
 
         self.pop_current_source_path()
         shutil.rmtree(base_source_path)
         
+    def prepare_tree(self):
+        """ Prepares the unpacked sources for the current architecture """
+        m4_path = os.path.join(self.get_current_source_path(), 'm4')
+        if not os.path.exists(m4_path): os.makedirs(m4_path)
+        self.fix_config_sub_and_guess()
+        self.rewrite_files([
+            ('src/Makefile.am',
+             [Substitute(r'(-version-info 4:0:2)', '-avoid-version', every=True)]),
+            ('src/shapefiles/shapefiles.c',
+             [Substitute(r'#include <freexl.h>', '')])])
+        self.run_autoreconf()
+        files = [('configure',
+                  [Substitute(r'(hardcode_into_libs)=.*$', r'\1=no')])]
+        if self.get_current_arch() != 'host':
+            files.append(('src/Makefile.in',
+                          [Substitute(r'@MINGW_FALSE@am__append_1 = -lpthread -ldl',
+                                      '@MINGW_FALSE@am_append_1 = -ldl')]))
+        self.rewrite_files(files)
+
+    def do_prepare(self):
+        """ Prepares the sources of every architecture ahead of the build """
+        self.prepare_snapshots(self.fetch(self.get_sources()[0]),
+                               'lib' + self.library_name(), self.prepare_tree)
+
     def do_build(self):
         """ Runs the actual build process """
-        output = self.wget('http://www.gaia-gis.it/gaia-sins/libspatialite-sources/lib' + 
-                           self.library_name() + '.tar.gz')
+        output = self.fetch(self.get_sources()[0])
 
-        self.do_build_for('host', output)
-        self.do_build_for('android', output)
+        self.do_build_for_arches(output)
         self.mark_finished()
 
 
@@ -17,7 +17,6 @@
 #
 
 from qgis_mobility.generator.builder import Builder
-import distutils.dir_util
 import os
 import shutil
 
@@ -32,6 +31,14 @@ class SQLiteBuilder(Builder):
         """ Returns the human readable name of the GeosBuilder """
         return 'SQLite Build Process'
 
+    def get_sources(self):
+        """ Returns the URLs of the sources """
+        return ["http://www.sqlite.org/%s.tar.gz" % self.library_name()]
+
+    def get_arches(self):
+        """ The library is needed on the host as well as on the target """
+        return ['host', 'android']
+
     def salt_flags(self, flags):
         flags = Builder.salt_flags(self, flags)
         self.insert_config_path_flag(flags)
@@ -42,35 +49,36 @@ class SQLiteBuilder(Builder):
         If arch is set to "host", the build is done for the host environment.
         If arch is set to "target", the build is done for the target environment.
         """
-        host = (arch == "host")
         self.set_current_arch(arch)
-        
-        self.unpack(output)
-        
-        base_source_path = os.path.join(self.get_source_path(), 
-                                        self.library_name())
+
+        base_source_path = self.prepare_source(output, self.library_name(),
+                                               self.prepare_tree)
         
         self.push_current_source_path(base_source_path)
-        self.fix_config_sub_and_guess()
-        
-        if not host:
-            self.patch('sqlite.patch', strip=1)
-        
         self.run_autotools_and_make()
         
         includes_from = os.path.join(self.get_build_path(), 'include')
         includes_to = self.get_include_path()
         
-        distutils.dir_util.copy_tree(includes_from, includes_to)
+        self.copy_tree(includes_from, includes_to)
 
         self.pop_current_source_path()
         shutil.rmtree(base_source_path)
         
 
+    def prepare_tree(self):
+        """ Prepares the unpacked sources for the current architecture """
+        self.fix_config_sub_and_guess()
+        if self.get_current_arch() != 'host':
+            self.patch('sqlite.patch', strip=1)
+
+    def do_prepare(self):
+        """ Prepares the sources of every architecture ahead of the build """
+        self.prepare_snapshots(self.fetch(self.get_sources()[0]),
+                               self.library_name(), self.prepare_tree)
+
     def do_build(self):
         """ Runs the actual build process """
-        tarball_url = "http://www.sqlite.org/%s.tar.gz" % self.library_name()
-        output = self.wget(tarball_url)
-        self.do_build_for("host", output)
-        self.do_build_for("android", output)
+        output = self.fetch(self.get_sources()[0])
+        self.do_build_for_arches(output)
         self.mark_finished()
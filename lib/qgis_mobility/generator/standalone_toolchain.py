@@ -16,30 +16,53 @@
 #  <http://www.gnu.org/licenses/>.
 #
 
-import subprocess
 import os
+import time
 import shutil
+from subprocess import PIPE, STDOUT
+
+from qgis_mobility.generator import locking
+from qgis_mobility.generator import tracing
+from qgis_mobility.generator.buildlog import spawn
 
 class StandaloneToolchain(object):
 
     def __init__(self, recon):
         self._recon = recon
 
+    @classmethod
+    def dependencies(cls):
+        """ The toolchain is the root of every build """
+        return []
+
     def clean(self): pass   
  
     def make(self):
-        if not os.path.exists(self._recon.get_toolchain_path()):
-            standalone_chain = os.path.join(
-                self._recon.ndk_path,
-                'build', 'tools', 'make-standalone-toolchain.sh')
-            os.makedirs(self._recon.get_toolchain_path())
-            args = ['bash',
-                    standalone_chain, 
-                    '--platform=android-' + str(self._recon.android_level), 
-                    '--install-dir=' + self._recon.get_toolchain_path()]
-            print args
-            process = subprocess.Popen(args)
-            process.communicate(None)
-            if not process.returncode == 0:
-                shutil.rmtree(self._recon.get_toolchain_path())
-                raise ValueError("Toolchain didn't compile successfully")
+        # Other qgsmg runs on the same cache wait for the toolchain as well
+        lock = locking.lock_for(os.path.join(self._recon.get_cache_path(),
+                                             '.locktoolchain'), 'toolchain')
+        with lock:
+            if not os.path.exists(self._recon.get_toolchain_path()):
+                standalone_chain = os.path.join(
+                    self._recon.ndk_path,
+                    'build', 'tools', 'make-standalone-toolchain.sh')
+                os.makedirs(self._recon.get_toolchain_path())
+                args = ['bash',
+                        standalone_chain, 
+                        '--platform=android-' + str(self._recon.android_level), 
+                        '--install-dir=' + self._recon.get_toolchain_path()]
+                # The output goes to the build log like that of the builders
+                log = self._recon.get_build_logs().get('toolchain')
+                tracer = self._recon.get_tracer()
+                with tracer.phase('toolchain', 'build'):
+                    start = time.time()
+                    process = spawn(args, stdout=PIPE, stderr=STDOUT)
+                    tail = log.capture('make-standalone-toolchain.sh', args,
+                                       None, process)
+                    usage = tracing.wait_with_usage(process)
+                    tracer.process('toolchain', args, start, time.time(), usage)
+                if not process.returncode == 0:
+                    log.report_failure('make-standalone-toolchain.sh',
+                                       process.returncode, tail)
+                    shutil.rmtree(self._recon.get_toolchain_path())
+                    raise ValueError("Toolchain didn't compile successfully")
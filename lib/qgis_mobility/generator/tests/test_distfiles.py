@@ -0,0 +1,136 @@
+#
+#  This file is part of QGis Mobility
+#
+#  QGis Mobility is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  QGis Mobility is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with QGis Mobility. If not, see
+#  <http://www.gnu.org/licenses/>.
+#
+
+import os
+import shutil
+import hashlib
+import tempfile
+import threading
+import unittest
+import subprocess
+import BaseHTTPServer
+import SimpleHTTPServer
+from distutils.spawn import find_executable
+
+from qgis_mobility.generator.distfiles import Distfiles
+
+
+def run(args):
+    """ Runs a download process like Builder._call_process does """
+    with open(os.devnull, 'w') as devnull:
+        if subprocess.call(args, stdout=devnull, stderr=devnull) != 0:
+            raise ValueError("Failed Process: " + args[0])
+
+
+class Server(object):
+    """ Serves the files in a directory over HTTP on a free local port """
+
+    def __init__(self, path):
+        requests = self.requests = []
+        class Handler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+            def translate_path(self, url_path):
+                requests.append(url_path)
+                return os.path.join(path, url_path.lstrip('/'))
+            def log_message(self, *args):
+                pass
+        self._server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def url(self, name):
+        return "http://127.0.0.1:%d/%s" % (self._server.server_port, name)
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@unittest.skipIf(find_executable('wget') == None, "wget is not installed")
+class DistfilesTest(unittest.TestCase):
+
+    def setUp(self):
+        self._path = tempfile.mkdtemp()
+        self._served = os.path.join(self._path, 'served')
+        self._cache = os.path.join(self._path, 'distfiles')
+        os.makedirs(os.path.join(self._served, 'mirror'))
+        self._contents = 'source archive\n' * 1000
+        self.serve('lib-1.0.tar.gz', self._contents)
+        self._server = Server(self._served)
+
+    def tearDown(self):
+        self._server.close()
+        shutil.rmtree(self._path)
+
+    def serve(self, name, contents):
+        with open(os.path.join(self._served, name), 'w') as f: f.write(contents)
+
+    def distfiles(self, mirrors=[], offline=False):
+        return Distfiles(self._cache, mirrors, offline, retries=1)
+
+    def test_download_records_and_verifies_the_checksum(self):
+        url = self._server.url('lib-1.0.tar.gz')
+        path = self.distfiles().fetch(url, run)
+        with open(path) as f: self.assertEqual(f.read(), self._contents)
+        checksum = hashlib.sha256(self._contents).hexdigest()
+        self.assertEqual(self.distfiles().get_checksums(),
+                         { 'lib-1.0.tar.gz' : checksum })
+        # A cached file which no longer matches the manifest is refused
+        with open(path, 'a') as f: f.write('tampered')
+        self.assertRaises(ValueError, self.distfiles().fetch, url, run)
+
+    def test_declared_checksum_mismatch_is_refused(self):
+        url = self._server.url('lib-1.0.tar.gz')
+        self.assertRaises(ValueError, self.distfiles().fetch, url, run,
+                          sha256='0' * 64)
+        self.assertFalse(os.path.exists(os.path.join(self._cache,
+                                                     'lib-1.0.tar.gz')))
+        self.assertFalse(os.path.exists(os.path.join(self._cache,
+                                                     'lib-1.0.tar.gz.part')))
+
+    def test_mirrors_are_tried_before_the_original_location(self):
+        self.serve(os.path.join('mirror', 'lib-1.0.tar.gz'), self._contents)
+        distfiles = self.distfiles([self._server.url('missing'),
+                                    self._server.url('mirror')])
+        distfiles.fetch(self._server.url('lib-1.0.tar.gz'), run)
+        self.assertEqual(self._server.requests, ['/missing/lib-1.0.tar.gz',
+                                                 '/mirror/lib-1.0.tar.gz'])
+
+    def test_original_location_is_the_last_resort(self):
+        distfiles = self.distfiles([self._server.url('missing')])
+        distfiles.fetch(self._server.url('lib-1.0.tar.gz'), run)
+        self.assertEqual(self._server.requests, ['/missing/lib-1.0.tar.gz',
+                                                 '/lib-1.0.tar.gz'])
+
+    def test_offline_mode_refuses_to_download(self):
+        distfiles = self.distfiles([self._server.url('mirror')], offline=True)
+        self.assertRaises(EnvironmentError, distfiles.fetch,
+                          self._server.url('lib-1.0.tar.gz'), run)
+        self.assertEqual(self._server.requests, [])
+
+    def test_offline_mode_uses_the_cache(self):
+        url = self._server.url('lib-1.0.tar.gz')
+        self.distfiles().fetch(url, run)
+        del self._server.requests[:]
+        path = self.distfiles(offline=True).fetch(url, run)
+        with open(path) as f: self.assertEqual(f.read(), self._contents)
+        self.assertEqual(self._server.requests, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
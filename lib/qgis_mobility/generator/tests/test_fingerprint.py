@@ -0,0 +1,85 @@
+#
+#  This file is part of QGis Mobility
+#
+#  QGis Mobility is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  QGis Mobility is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with QGis Mobility. If not, see
+#  <http://www.gnu.org/licenses/>.
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from qgis_mobility.generator import fingerprint
+from qgis_mobility.generator.fingerprint import hash_code
+
+
+class HashCodeTest(unittest.TestCase):
+
+    def setUp(self):
+        self._path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._path)
+
+    def digest(self, source):
+        path = os.path.join(self._path, 'module.py')
+        with open(path, 'w') as f: f.write(source)
+        return hash_code(path)
+
+    def test_comments_and_docstrings_are_ignored(self):
+        plain = self.digest("class A(object):\n"
+                            "    def f(self):\n"
+                            "        return 'x'\n")
+        documented = self.digest('""" Module """\n'
+                                 "# A comment\n"
+                                 "class A(object):\n"
+                                 '    """ Class """\n'
+                                 "    def f(self):\n"
+                                 '        """ Method """\n'
+                                 "        # Another comment\n"
+                                 "        return 'x'   # trailing\n")
+        self.assertEqual(plain, documented)
+
+    def test_code_changes_are_not_ignored(self):
+        self.assertNotEqual(self.digest("def f():\n    return 'x'\n"),
+                            self.digest("def f():\n    return 'y'\n"))
+
+    def test_docstring_only_body_is_still_code(self):
+        self.assertNotEqual(self.digest('def f():\n    """ Doc """\n'),
+                            self.digest('def g():\n    """ Doc """\n'))
+
+    def test_unchanged_module_is_parsed_once(self):
+        parsed = []
+        parse = fingerprint.ast.parse
+        def counting_parse(*args, **kwargs):
+            parsed.append(args)
+            return parse(*args, **kwargs)
+        fingerprint.ast.parse = counting_parse
+        try:
+            path = os.path.join(self._path, 'module.py')
+            with open(path, 'w') as f: f.write("def f():\n    return 'x'\n")
+            first = hash_code(path)
+            self.assertEqual(hash_code(path), first)
+            self.assertEqual(len(parsed), 1)
+            # Another version of the file is parsed again
+            with open(path, 'w') as f: f.write("def f():\n    return 'xy'\n")
+            self.assertNotEqual(hash_code(path), first)
+            self.assertEqual(len(parsed), 2)
+        finally:
+            fingerprint.ast.parse = parse
+
+
+if __name__ == '__main__':
+    unittest.main()
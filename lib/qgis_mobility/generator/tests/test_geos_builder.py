@@ -0,0 +1,139 @@
+#
+#  This file is part of QGis Mobility
+#
+#  QGis Mobility is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  QGis Mobility is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with QGis Mobility. If not, see
+#  <http://www.gnu.org/licenses/>.
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from qgis_mobility.generator.main import Recon
+from qgis_mobility.generator.geos_builder import GeosBuilder
+
+
+def imacros(flags):
+    """ Returns the header -imacros includes in the CFLAGS """
+    words = flags['CFLAGS'].split()
+    return words[words.index('-imacros') + 1]
+
+
+def make_recon(path):
+    """ Returns a recon on an empty necessitas and cache in path """
+    for tools in ['android-ndk', 'android-sdk',
+                  os.path.join('Android', 'Qt', '482', 'armeabi', 'bin')]:
+        os.makedirs(os.path.join(path, tools))
+    return Recon(path, os.path.join(path, 'cache'))
+
+
+class StubGeosBuilder(GeosBuilder):
+    """
+    Goes through the checkpoints of the GEOS build, with the fetch, the
+    preparation and make stubbed. Records the architectures it made.
+    """
+    made = []
+    failing = []
+
+    def fetch_sources(self):
+        return ['geos-3.2.3.tar.gz']
+
+    def prepare_source(self, output, directory, preparation=None, keep=False):
+        destination = os.path.join(self.get_current_source_path(), directory)
+        self.checkpoint('source ' + directory,
+                        lambda: os.makedirs(destination), output=destination)
+        return destination
+
+    def run_autotools_and_make(self):
+        if self.get_current_arch() in self.failing:
+            raise EnvironmentError("make failed")
+        self.made.append(self.get_current_arch())
+
+    def copy_tree(self, source, destination):
+        pass
+
+
+class GeosFlagsTest(unittest.TestCase):
+
+    def setUp(self):
+        self._path = tempfile.mkdtemp()
+        self._recon = make_recon(self._path)
+
+    def tearDown(self):
+        shutil.rmtree(self._path)
+
+    def build_flags(self, arch):
+        """
+        Runs do_build_for with the preparation and the build stubbed, returns
+        the flags the build ran with and the tree it ran in
+        """
+        builder = GeosBuilder(self._recon)
+        seen = {}
+        def prepare_source(output, directory, preparation=None, keep=False):
+            seen['tree'] = os.path.join(builder.get_current_source_path(),
+                                        directory)
+            os.makedirs(seen['tree'])
+            return seen['tree']
+        def run_autotools_and_make():
+            seen['flags'] = builder.get_flags()
+            seen['current'] = builder.get_current_source_path()
+        builder.prepare_source = prepare_source
+        builder.run_autotools_and_make = run_autotools_and_make
+        builder.copy_tree = lambda source, destination: None
+        builder.do_build_for(arch, 'geos-3.2.3.tar.gz')
+        return seen
+
+    def test_flags_agree_with_the_build(self):
+        shown = GeosBuilder(self._recon, 'android').get_flags()
+        seen = self.build_flags('android')
+        self.assertEqual(shown, seen['flags'])
+        self.assertEqual(imacros(seen['flags']),
+                         os.path.join(seen['tree'], 'sixty_four.h'))
+        self.assertEqual(seen['tree'], seen['current'])
+
+    def test_host_has_no_imacros(self):
+        flags = GeosBuilder(self._recon, 'host').get_flags()
+        self.assertFalse('-imacros' in flags['CFLAGS'])
+
+
+
+class GeosResumeTest(unittest.TestCase):
+
+    def setUp(self):
+        self._path = tempfile.mkdtemp()
+        self._recon = make_recon(self._path)
+        StubGeosBuilder.made = []
+
+    def tearDown(self):
+        StubGeosBuilder.failing = []
+        shutil.rmtree(self._path)
+
+    def test_finished_arch_is_not_built_again(self):
+        StubGeosBuilder.failing = ['android']
+        builder = StubGeosBuilder(self._recon)
+        self.assertRaises(EnvironmentError, builder.do_build)
+        self.assertEqual(['host'], StubGeosBuilder.made)
+        self.assertFalse(os.path.exists(
+            os.path.join(builder.get_source_path('host'), 'geos-3.2.3')))
+
+        StubGeosBuilder.failing = []
+        builder = StubGeosBuilder(self._recon)
+        self.assertTrue(builder.is_resumable())
+        builder.do_build()
+        self.assertEqual(['host', 'android'], StubGeosBuilder.made)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+#
+#  This file is part of QGis Mobility
+#
+#  QGis Mobility is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  QGis Mobility is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with QGis Mobility. If not, see
+#  <http://www.gnu.org/licenses/>.
+#
+
+import os
+import time
+import select
+import unittest
+
+from qgis_mobility.generator import jobserver
+from qgis_mobility.generator.jobserver import Jobserver
+
+
+def pipe_tokens(read_fd):
+    """ Takes all tokens currently in the pipe and returns them """
+    tokens = []
+    while len(select.select([read_fd], [], [], 0)[0]) > 0:
+        tokens.append(os.read(read_fd, 1))
+    return tokens
+
+def free_slots(server):
+    """ Returns how many slots can be taken right away, giving them back """
+    taken = []
+    while True:
+        acquired, token = server._acquire_within(0)
+        if not acquired: break
+        taken.append(token)
+    for token in taken: server.release(token)
+    return len(taken)
+
+
+class JobserverTest(unittest.TestCase):
+
+    def setUp(self):
+        self._timeout = jobserver._lease_timeout
+        jobserver._lease_timeout = 0.2
+
+    def tearDown(self):
+        jobserver._lease_timeout = self._timeout
+
+    def test_pipe_holds_all_but_the_implicit_token(self):
+        server = Jobserver(4)
+        tokens = pipe_tokens(server._read_fd)
+        self.assertEqual(len(tokens), 3)
+        for token in tokens: os.write(server._write_fd, token)
+        self.assertEqual(free_slots(server), 4)
+
+    def test_environment_points_make_at_the_pipe(self):
+        server = Jobserver(2)
+        env = server.environment({ 'MAKEFLAGS' : '-j8 --jobserver-fds=5,6 -k' })
+        self.assertEqual(env['MAKEFLAGS'].split(),
+                         ['-k', '-j', '--jobserver-fds=%d,%d' % (
+                             server._read_fd, server._write_fd)])
+
+    def test_lease_holds_its_slots(self):
+        server = Jobserver(4)
+        with server.lease(3) as lease:
+            self.assertEqual(lease.get_jobs(), 3)
+            self.assertEqual(free_slots(server), 1)
+            self.assertEqual(len(pipe_tokens(lease._read_fd)), 2)
+        self.assertEqual(free_slots(server), 4)
+
+    def test_lease_of_the_whole_budget_shares_the_pipe(self):
+        server = Jobserver(4)
+        with server.lease(8) as lease:
+            self.assertTrue(lease is server)
+            self.assertEqual(free_slots(server), 3)
+        self.assertEqual(free_slots(server), 4)
+
+    def test_private_lease_holds_the_slots_it_reports(self):
+        server = Jobserver(4)
+        with server.lease(8, private=True) as lease:
+            self.assertEqual(lease.get_jobs(), 4)
+            self.assertEqual(free_slots(server), 0)
+        taken = [server.acquire(), server.acquire()]
+        with server.lease(4, private=True) as lease:
+            self.assertEqual(lease.get_jobs(), 2)
+            self.assertEqual(free_slots(server), 0)
+        for token in taken: server.release(token)
+        self.assertEqual(free_slots(server), 4)
+
+    def test_lease_gives_its_slots_back_on_exceptions(self):
+        server = Jobserver(4)
+        def fail():
+            with server.lease(3):
+                raise ValueError("make failed")
+        self.assertRaises(ValueError, fail)
+        self.assertEqual(free_slots(server), 4)
+        self.assertRaises(ValueError, fail)
+        self.assertEqual(free_slots(server), 4)
+
+    def test_lease_takes_fewer_slots_after_the_timeout(self):
+        server = Jobserver(4)
+        taken = [server.acquire(), server.acquire()]
+        start = time.time()
+        with server.lease(4 - 1) as lease:
+            self.assertEqual(lease.get_jobs(), 2)
+            self.assertEqual(free_slots(server), 0)
+        self.assertTrue(time.time() - start < 5)
+        for token in taken: server.release(token)
+        self.assertEqual(free_slots(server), 4)
+
+    def test_implicit_slot_is_handed_to_waiters(self):
+        server = Jobserver(1)
+        token = server.acquire()
+        self.assertEqual(token, None)
+        self.assertEqual(server._acquire_within(0), (False, None))
+        server.release(token)
+        self.assertEqual(free_slots(server), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
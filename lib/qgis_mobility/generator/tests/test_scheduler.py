@@ -0,0 +1,56 @@
+#
+#  This file is part of QGis Mobility
+#
+#  QGis Mobility is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  QGis Mobility is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with QGis Mobility. If not, see
+#  <http://www.gnu.org/licenses/>.
+#
+
+import unittest
+
+from qgis_mobility.generator.scheduler import Scheduler
+
+
+def builder_class(name, *dependencies):
+    """ Returns a stand-in builder class depending on dependencies """
+    return type(name, (object,),
+                {'dependencies' : staticmethod(lambda: list(dependencies))})
+
+
+class EstimateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.toolchain = builder_class('Toolchain')
+        self.sqlite = builder_class('SQLite', self.toolchain)
+        self.geos = builder_class('Geos', self.toolchain)
+        self.spatialite = builder_class('Spatialite', self.sqlite, self.geos)
+        self.durations = { self.toolchain : 10.0, self.sqlite : 20.0,
+                           self.geos : 60.0, self.spatialite : 30.0 }
+
+    def estimate(self, workers, durations=None):
+        return Scheduler(None, workers).estimate(
+            [self.spatialite], durations or self.durations)
+
+    def test_independent_builders_overlap(self):
+        self.assertEqual(100.0, self.estimate(2))
+
+    def test_workers_limit_the_overlap(self):
+        self.assertEqual(120.0, self.estimate(1))
+
+    def test_missing_durations_take_no_time(self):
+        self.assertEqual(90.0, self.estimate(4, { self.geos : 60.0,
+                                                  self.spatialite : 30.0 }))
+
+
+if __name__ == '__main__':
+    unittest.main()
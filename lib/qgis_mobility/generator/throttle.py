@@ -0,0 +1,121 @@
+#
+#  This file is part of QGis Mobility
+#
+#  QGis Mobility is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  QGis Mobility is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with QGis Mobility. If not, see
+#  <http://www.gnu.org/licenses/>.
+#
+
+import os
+import time
+import threading
+import multiprocessing
+
+from qgis_mobility.generator.buildlog import console
+from qgis_mobility.generator.cacheusage import format_size
+
+# Only this share of the available memory is planned for, the rest is
+# left for the linker peaks and everything else running on the machine
+_memory_share = 0.8
+
+
+def read_meminfo():
+    """
+    Returns the total and the available memory in bytes, or None if the
+    system does not tell
+    """
+    values = {}
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2: values[parts[0].rstrip(':')] = int(parts[1]) * 1024
+    except IOError:
+        return None
+    if not 'MemTotal' in values: return None
+    available = values.get('MemAvailable')
+    if available == None:
+        # Kernels before 3.14 do not estimate it
+        available = (values.get('MemFree', 0) + values.get('Buffers', 0) +
+                     values.get('Cached', 0))
+    return values['MemTotal'], available
+
+def job_limit(job_memory, available, jobs):
+    """
+    Returns how many of jobs fit into the available memory in bytes when
+    every job peaks at job_memory bytes, at least one
+    """
+    if job_memory <= 0 or available == None: return jobs
+    return max(1, min(jobs, int(available * _memory_share / job_memory)))
+
+
+class Throttle(object):
+    """
+    Watches the free memory and the load of the machine while a run builds.
+    When the available memory drops below min_free, or the load exceeds the
+    CPUs by half, it holds back one slot of the jobserver after the other;
+    once both recovered, it hands them back one at a time.
+    """
+
+    def __init__(self, jobserver, min_free, interval=2.0):
+        self._jobserver = jobserver
+        self._min_free = min_free
+        self._interval = interval
+        self._max_load = multiprocessing.cpu_count() * 1.5
+        self._held = []
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """ Starts watching, unless already watching """
+        with self._lock:
+            if self._thread != None: return
+            self._thread = threading.Thread(target=self._watch)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def get_held(self):
+        """ Returns the amount of slots held back """
+        return len(self._held)
+
+    def _pressure(self):
+        """ Returns why the machine is under pressure, or None """
+        meminfo = read_meminfo()
+        if meminfo != None and meminfo[1] < self._min_free:
+            return "available memory %s below %s" % (
+                format_size(meminfo[1]), format_size(self._min_free))
+        load = os.getloadavg()[0]
+        if load > self._max_load:
+            return "load %.1f above %.1f" % (load, self._max_load)
+        return None
+
+    def _relieved(self):
+        """ Returns True if the machine has room for a slot held back """
+        meminfo = read_meminfo()
+        if meminfo != None and meminfo[1] < self._min_free * 1.5: return False
+        return os.getloadavg()[0] < self._max_load
+
+    def _watch(self):
+        while True:
+            time.sleep(self._interval)
+            pressure = self._pressure()
+            if pressure != None:
+                # The last slot is never held back, so builds go on
+                if len(self._held) < self._jobserver.get_jobs() - 1:
+                    self._held.append(self._jobserver.acquire())
+                    console("Holding back a job, %s (%d held back)" % (
+                        pressure, len(self._held)))
+            elif len(self._held) > 0 and self._relieved():
+                self._jobserver.release(self._held.pop())
+                console("Releasing a job held back (%d held back)" %
+                        len(self._held))
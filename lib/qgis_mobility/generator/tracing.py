@@ -0,0 +1,234 @@
+#
+#  This file is part of QGis Mobility
+#
+#  QGis Mobility is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  QGis Mobility is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with QGis Mobility. If not, see
+#  <http://www.gnu.org/licenses/>.
+#
+
+import os
+import glob
+import json
+import time
+import errno
+import threading
+from contextlib import contextmanager
+
+
+def wait_with_usage(process):
+    """
+    Waits for the Popen process like communicate(None) does and returns the
+    resource usage of the process and its waited for descendants
+    """
+    while True:
+        try:
+            pid, status, usage = os.wait4(process.pid, 0)
+            break
+        except OSError as e:
+            if e.errno != errno.EINTR: raise
+    if os.WIFSIGNALED(status): process.returncode = -os.WTERMSIG(status)
+    else: process.returncode = os.WEXITSTATUS(status)
+    return usage
+
+
+class Tracer(object):
+    """
+    Records the timeline of a qgsmg run: the phases of every builder and
+    every child process they start, with wall time, CPU time and peak RSS.
+    The timeline is written as Chrome trace events (chrome://tracing) with
+    a plain text summary next to it.
+    """
+
+    def __init__(self, path):
+        self._path = os.path.abspath(path)
+        self._start = time.time()
+        self._name = "%s-%d" % (time.strftime(
+            '%Y%m%d-%H%M%S', time.localtime(self._start)), os.getpid())
+        self._events = []
+        self._threads = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def get_path(self):
+        """ Returns the directory of the traces """
+        return self._path
+
+    def get_trace_path(self):
+        """ Returns the path of the trace event file of this run """
+        return os.path.join(self._path, self._name + '.json')
+
+    def get_summary_path(self):
+        """ Returns the path of the text summary of this run """
+        return os.path.join(self._path, self._name + '.txt')
+
+    def _open_phases(self):
+        if not hasattr(self._local, 'phases'): self._local.phases = []
+        return self._local.phases
+
+    def _thread_id(self, builder):
+        """ Returns the trace lane of the current thread, called locked """
+        ident = threading.current_thread().ident
+        if not ident in self._threads:
+            self._threads[ident] = len(self._threads) + 1
+            self._events.append({ 'name' : 'thread_name', 'ph' : 'M',
+                                  'pid' : os.getpid(),
+                                  'tid' : self._threads[ident],
+                                  'args' : { 'name' : builder } })
+        return self._threads[ident]
+
+    def _add(self, category, builder, name, start, end, args):
+        args = dict(args)
+        args['builder'] = builder
+        with self._lock:
+            self._events.append({ 'name' : name, 'cat' : category, 'ph' : 'X',
+                                  'pid' : os.getpid(),
+                                  'tid' : self._thread_id(builder),
+                                  'ts' : int((start - self._start) * 1e6),
+                                  'dur' : int((end - start) * 1e6),
+                                  'args' : args })
+
+    @contextmanager
+    def phase(self, builder, name):
+        """
+        Records the enclosed block as phase name of builder. The CPU time
+        and peak RSS of the phase are those of the child processes it ran.
+        """
+        record = { 'cpu' : 0.0, 'rss' : 0 }
+        phases = self._open_phases()
+        phases.append(record)
+        start = time.time()
+        try:
+            yield
+        except:
+            record['failed'] = True
+            raise
+        finally:
+            phases.pop()
+            self._add('phase', builder, name, start, time.time(), record)
+
+    def process(self, builder, args, start, end, usage):
+        """ Records a child process of builder with its resource usage """
+        cpu = usage.ru_utime + usage.ru_stime
+        for record in self._open_phases():
+            record['cpu'] += cpu
+            record['rss'] = max(record['rss'], usage.ru_maxrss)
+        self._add('process', builder, os.path.basename(args[0]), start, end,
+                  { 'cpu' : cpu, 'rss' : usage.ru_maxrss,
+                    'command' : ' '.join(args) })
+
+    def write(self):
+        """ Writes the trace and its summary of everything recorded so far """
+        with self._lock:
+            events = list(self._events)
+        if len(events) == 0: return
+        try:
+            os.makedirs(self._path)
+        except OSError as e:
+            if e.errno != errno.EEXIST: raise
+        with open(self.get_trace_path() + '.tmp', 'w') as f:
+            json.dump({ 'traceEvents' : events, 'displayTimeUnit' : 'ms' }, f)
+        os.rename(self.get_trace_path() + '.tmp', self.get_trace_path())
+        builders, phases = summarize(events)
+        with open(self.get_summary_path(), 'w') as f:
+            f.write("Build trace %s, %.1fs\n\n" % (self._name,
+                                                  time.time() - self._start))
+            for line in format_summary(builders, phases):
+                f.write(line + '\n')
+        print "Wrote build trace:", self.get_trace_path()
+
+
+def load_traces(path, count):
+    """ Returns the events of the last count traces in path, oldest first """
+    traces = []
+    for trace_path in sorted(glob.glob(os.path.join(path, '*.json')))[-count:]:
+        with open(trace_path) as f:
+            traces.append(json.load(f)['traceEvents'])
+    return traces
+
+def summarize(events):
+    """
+    Returns the totals of the builders and of their phases in events, as
+    dictionaries mapping a builder, or a (builder, phase) pair, to a
+    dictionary with the count, wall and cpu seconds and the peak rss in KiB.
+    A builder's wall time is that of its build phase, its CPU time that of
+    all its child processes.
+    """
+    builders = {}
+    phases = {}
+    def add(totals, key, wall, cpu, rss, count=1):
+        if not key in totals:
+            totals[key] = { 'count' : 0, 'wall' : 0.0, 'cpu' : 0.0, 'rss' : 0 }
+        totals[key]['count'] += count
+        totals[key]['wall'] += wall
+        totals[key]['cpu'] += cpu
+        totals[key]['rss'] = max(totals[key]['rss'], rss)
+
+    for event in events:
+        if event['ph'] != 'X': continue
+        builder = event['args']['builder']
+        wall = event['dur'] / 1e6
+        cpu = event['args']['cpu']
+        rss = event['args']['rss']
+        if event['cat'] == 'process':
+            add(builders, builder, 0.0, cpu, rss, count=0)
+        elif event['name'] == 'build':
+            add(builders, builder, wall, 0.0, 0)
+        else:
+            add(phases, (builder, event['name']), wall, cpu, rss)
+    return builders, phases
+
+def estimate_build_times(path, count):
+    """
+    Returns the mean wall time in seconds of the build phase of every
+    builder over the last count traces in path
+    """
+    builders, phases = summarize([event for events in load_traces(path, count)
+                                  for event in events])
+    return dict((builder, totals['wall'] / totals['count'])
+                for builder, totals in builders.items() if totals['count'] > 0)
+
+def estimate_phase_times(path, count):
+    """
+    Returns the mean wall time in seconds of a phase over the last count
+    traces in path, by (builder, phase) pair
+    """
+    builders, phases = summarize([event for events in load_traces(path, count)
+                                  for event in events])
+    return dict((key, totals['wall'] / totals['count'])
+                for key, totals in phases.items() if totals['count'] > 0)
+
+def format_duration(seconds):
+    """ Returns seconds as a short human readable duration """
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return "%dh %02dm" % (seconds / 3600, seconds % 3600 / 60)
+    if seconds >= 60: return "%dm %02ds" % (seconds / 60, seconds % 60)
+    return "%ds" % seconds
+
+def format_summary(builders, phases, limit=20):
+    """ Returns the lines of a summary of the totals from summarize """
+    def line(name, totals):
+        return "  %-40s %10.1fs wall %10.1fs cpu %8.1f MiB peak %4dx" % (
+            name, totals['wall'], totals['cpu'], totals['rss'] / 1024.0,
+            totals['count'])
+    def slowest(totals):
+        return sorted(totals.keys(), key=lambda key: totals[key]['wall'],
+                      reverse=True)[:limit]
+
+    lines = ["Slowest builders:"]
+    for builder in slowest(builders):
+        lines.append(line(builder, builders[builder]))
+    lines.append("Slowest phases:")
+    for builder, name in slowest(phases):
+        lines.append(line(builder + ' ' + name, phases[(builder, name)]))
+    return lines